@@ -0,0 +1,3 @@
+"""Reproducible benchmarks for the expman hot paths.
+
+Run with "python -m benchmarks --help" from the repository root."""
@@ -0,0 +1,96 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+from benchmarks.generator import LedgerSpec, generate_ledger, open_ledger
+from benchmarks.scenarios import build_scenarios
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="expman benchmarks")
+    parser.add_argument("--categories", type=int, default=50, help="Number of categories (default: 50)")
+    parser.add_argument("--expenses", type=int, default=10000, help="Number of expenses (default: 10000)")
+    parser.add_argument("--incomes", type=int, default=1000, help="Number of incomes (default: 1000)")
+    parser.add_argument("--years", type=int, default=5, help="Years covered by the transactions (default: 5)")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the data generator (default: 42)")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions of every scenario (default: 5)")
+    parser.add_argument("--only", type=str, default="", help="Comma separated list of scenarios to run")
+    parser.add_argument("--workdir", type=str, default=os.path.join(tempfile.gettempdir(), "expman_benchmarks"), help="Folder of the generated databases (reused between runs)")
+    parser.add_argument("--regenerate", action="store_true", help="Recreate the database even if it exists")
+    parser.add_argument("--output", type=str, default="", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", type=str, default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown of the best run before reporting a regression (default: 0.2 = 20%%)")
+    return parser
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Print current vs baseline best runs and return the names of the regressed scenarios.
+    The best run is the least affected by noise of the machine"""
+    regressions = []
+    if baseline.get("spec") != results["spec"]:
+        print("Warning: baseline was recorded with a different ledger spec", file=sys.stderr)
+    print(f"{'SCENARIO':<24} | {'BASELINE':>10} | {'CURRENT':>10} | {'RATIO':>6}")
+    for name, current in results["scenarios"].items():
+        reference = baseline.get("scenarios", {}).get(name)
+        if reference is None:
+            print(f"{name:<24} | {'-':>10} | {current['min']:10.4f} | {'-':>6}")
+            continue
+        ratio = current["min"] / reference["min"] if reference["min"] > 0 else 1.0
+        flag = " REGRESSION" if ratio > 1 + tolerance else ""
+        print(f"{name:<24} | {reference['min']:10.4f} | {current['min']:10.4f} | {ratio:6.2f}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    spec = LedgerSpec(args.categories, args.expenses, args.incomes, args.years, args.seed)
+    os.makedirs(args.workdir, exist_ok=True)
+    only = [name for name in args.only.split(",") if name]
+    results = {
+        "spec": spec.as_dict(),
+        "environment": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version, "platform": platform.platform()},
+        "scenarios": {},
+    }
+    # the generated ledger is kept for the next runs; scenarios work on a copy because some of them write
+    path = generate_ledger(spec, args.workdir, force=args.regenerate)
+    work_path = os.path.join(args.workdir, "work_" + spec.file_name)
+    shutil.copyfile(path, work_path)
+    open_ledger(work_path)
+    for scenario in build_scenarios(spec):
+        if only and scenario.name not in only:
+            continue
+        results["scenarios"][scenario.name] = scenario.measure(args.repeat)
+        print(f"{scenario.name:<24} best {results['scenarios'][scenario.name]['min']:.4f} s", file=sys.stderr)
+    open_ledger(path)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(work_path + suffix):
+            os.remove(work_path + suffix)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if not os.path.isfile(args.baseline):
+        print(f"No baseline found at {args.baseline}. Run with --save-baseline to create one.")
+        return 0
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"Regressions: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
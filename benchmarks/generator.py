@@ -0,0 +1,87 @@
+import os
+import random
+from contextlib import redirect_stdout
+from datetime import date, timedelta
+from io import StringIO
+from typing import Iterator, Tuple
+
+from src.core import DB, init_core_module, TABLE_NAME_CATEGORIES, TABLE_NAME_EXPENSES, TABLE_NAME_INCOMES
+from src.core import COLUMN_NAME_CATEGORY_PARENT, COLUMN_NAME_CATEGORY_TITLE, COLUMN_NAME_CATEGORY_DESCRIPTION
+from src.core import COLUMN_NAME_ALL_CATEGORY, COLUMN_NAME_ALL_DATE, COLUMN_NAME_ALL_AMOUNT, COLUMN_NAME_ALL_TITLE, COLUMN_NAME_ALL_NOTES
+
+TITLES = ("Groceries", "Rent", "Fuel", "Restaurant", "Pharmacy", "Train ticket", "Books", "Electricity",
+          "Internet", "Gym", "Cinema", "Insurance", "Salary", "Refund", "Gift", "Interests")
+NOTES = ("", "", "", "paid by card", "shared with family", "monthly", "to be checked")
+
+class LedgerSpec:
+    """Size and seed of a synthetic ledger"""
+    def __init__(self, categories: int=50, expenses: int=10000, incomes: int=1000, years: int=5, seed: int=42, max_depth: int=4, last_day: date=date(2025, 12, 31)):
+        self.categories = categories
+        self.expenses = expenses
+        self.incomes = incomes
+        self.years = years
+        self.seed = seed
+        self.max_depth = max_depth
+        self.last_day = last_day
+
+    @property
+    def first_day(self) -> date:
+        return date(self.last_day.year - self.years + 1, 1, 1)
+
+    @property
+    def file_name(self) -> str:
+        return f"bench_c{self.categories}_e{self.expenses}_i{self.incomes}_y{self.years}_s{self.seed}_{self.last_day:%Y%m%d}.db"
+
+    def as_dict(self) -> dict:
+        return {"categories": self.categories, "expenses": self.expenses, "incomes": self.incomes,
+                "years": self.years, "seed": self.seed, "max_depth": self.max_depth, "last_day": self.last_day.isoformat()}
+
+def category_rows(spec: LedgerSpec, rng: random.Random) -> Iterator[Tuple[int, str, str]]:
+    """Yield (parent, title, description) so that every parent is inserted before its children.
+    About a tenth of the categories are top level, the others hang below a random earlier category"""
+    depths = {0: 0}
+    for category_id in range(1, spec.categories + 1):
+        candidates = [parent for parent in range(max(1, category_id - 50), category_id) if depths[parent] < spec.max_depth]
+        if category_id <= max(1, spec.categories // 10) or not candidates:
+            parent = 0
+        else:
+            parent = rng.choice(candidates)
+        depths[category_id] = depths[parent] + 1
+        yield (parent, f"Category {category_id}", f"Level {depths[category_id]} category")
+
+def transaction_rows(spec: LedgerSpec, rng: random.Random, number: int, low: float, high: float) -> Iterator[Tuple[int, str, float, str, str]]:
+    """Yield (category, date, amount, title, notes) spread uniformly over the years of the spec"""
+    days = (spec.last_day - spec.first_day).days + 1
+    for _ in range(number):
+        day = spec.first_day + timedelta(days=rng.randrange(days))
+        yield (rng.randint(1, max(1, spec.categories)), day.isoformat(), round(rng.uniform(low, high), 2),
+               rng.choice(TITLES), rng.choice(NOTES))
+
+def open_ledger(path: str):
+    """Point the core module (and the DB singleton) to the database at path.
+    The read cache is disabled, so that the scenarios time SQL (see Scenario read_cache)"""
+    DB()._close()
+    init_core_module(os.path.dirname(path), os.path.basename(path), {"read_cache_size": 0})
+
+def generate_ledger(spec: LedgerSpec, folder: str, force: bool=False) -> str:
+    """Create the database described by spec inside folder, unless it already exists.
+    The same spec always produces the same content. Return the path of the database"""
+    path = os.path.join(folder, spec.file_name)
+    if force and os.path.exists(path):
+        os.remove(path)
+    if os.path.exists(path):
+        return path
+    open_ledger(path)
+    db = DB()
+    with redirect_stdout(StringIO()):
+        db._connect()
+    rng = random.Random(spec.seed)
+    transaction_columns = [COLUMN_NAME_ALL_CATEGORY, COLUMN_NAME_ALL_DATE, COLUMN_NAME_ALL_AMOUNT, COLUMN_NAME_ALL_TITLE, COLUMN_NAME_ALL_NOTES]
+    db.CreateMany(TABLE_NAME_CATEGORIES, [COLUMN_NAME_CATEGORY_PARENT, COLUMN_NAME_CATEGORY_TITLE, COLUMN_NAME_CATEGORY_DESCRIPTION],
+                  category_rows(spec, rng))
+    db.CreateMany(TABLE_NAME_EXPENSES, transaction_columns, transaction_rows(spec, rng, spec.expenses, 1.0, 500.0), 50000)
+    db.CreateMany(TABLE_NAME_INCOMES, transaction_columns, transaction_rows(spec, rng, spec.incomes, 100.0, 5000.0), 50000)
+    # checkpoint the WAL so that the file can be copied on its own
+    db._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db._close()
+    return path
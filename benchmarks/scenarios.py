@@ -0,0 +1,111 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import redirect_stdout
+from datetime import date
+from io import StringIO
+from typing import Callable, List
+
+from src.core import DB, Category, CategoryTree, Expense
+from src import core
+from src.utils import balance_month, balance_year, print_categories_tree
+from benchmarks.generator import LedgerSpec, transaction_rows
+
+REPOSITORY_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Read cache size of the scenarios that measure cache hits (the others run without cache)
+CACHED_READ_CACHE_SIZE = 8 * 1024 * 1024
+
+class Scenario:
+    """A named, repeatable piece of work. setup() runs untimed before every repetition.
+    Fast operations are run "number" times per repetition to rise above timer noise.
+    With read_cache the read cache is enabled (and emptied before every repetition),
+    so all but the first of the "number" runs are cache hits"""
+    def __init__(self, name: str, run: Callable[[], None], setup: Callable[[], None]=None, number: int=1, read_cache: bool=False):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.number = number
+        self.read_cache = read_cache
+
+    def measure(self, repeat: int) -> dict:
+        timings = []
+        previous_cache_size = core.DB_READ_CACHE_SIZE
+        core.DB_READ_CACHE_SIZE = CACHED_READ_CACHE_SIZE if self.read_cache else 0
+        db = DB()
+        try:
+            for _ in range(repeat):
+                db._read_cache = None
+                if self.setup is not None:
+                    self.setup()
+                with redirect_stdout(StringIO()):
+                    start = time.perf_counter()
+                    for _ in range(self.number):
+                        self.run()
+                    timings.append(time.perf_counter() - start)
+        finally:
+            core.DB_READ_CACHE_SIZE = previous_cache_size
+            db._read_cache = None
+        return {"min": min(timings), "median": statistics.median(timings), "max": max(timings), "runs": repeat, "number": self.number}
+
+def relative_month(day: date) -> int:
+    """Months between day and today, as expected by balance_month"""
+    today = date.today()
+    return max(0, (today.year - day.year) * 12 + today.month - day.month)
+
+def relative_year(day: date) -> int:
+    """Years between day and today, as expected by balance_year"""
+    return max(0, date.today().year - day.year)
+
+def build_scenarios(spec: LedgerSpec, add_count: int=200, bulk_count: int=10000) -> List[Scenario]:
+    """Scenarios over the ledger generated from spec. Read-only scenarios come first,
+    so that they always see the same data"""
+    last_year_from = date(spec.last_day.year, 1, 1).isoformat()
+    last_year_to = spec.last_day.isoformat()
+
+    def fetch_number():
+        Expense.FetchNumber(20)
+
+    def fetch_date():
+        Expense.FetchDateInterval(last_year_from, last_year_to)
+
+    def category_tree():
+        print_categories_tree(CategoryTree(Category.FetchAll()), 0)
+
+    def expense_add():
+        for index in range(add_count):
+            Expense(1, spec.last_day, 1.0 + index, "benchmark", "").Add()
+
+    bulk_csv = []
+    def prepare_bulk():
+        if not bulk_csv:
+            import random
+            lines = ["date,amount,category,title,notes"]
+            for category, day, amount, title, notes in transaction_rows(spec, random.Random(spec.seed + 1), bulk_count, 1.0, 500.0):
+                lines.append(f"{day},{amount},{category},{title},{notes}")
+            bulk_csv.append("\n".join(lines) + "\n")
+
+    def bulk_insert():
+        Expense.Import(StringIO(bulk_csv[0]))
+
+    return [
+        Scenario("fetch_number_x500", fetch_number, number=500),
+        Scenario("fetch_date_year", fetch_date),
+        Scenario("balance_month_x100", lambda: balance_month(relative_month(spec.last_day)), number=100),
+        Scenario("balance_year_x100", lambda: balance_year(relative_year(spec.last_day)), number=100),
+        Scenario("category_tree_x20", category_tree, number=20),
+        Scenario("balance_month_cached_x100", lambda: balance_month(relative_month(spec.last_day)), number=100, read_cache=True),
+        Scenario("fetch_date_year_cached_x100", fetch_date, number=100, read_cache=True),
+        Scenario("cli_startup", cli_startup),
+        Scenario(f"expense_add_x{add_count}", expense_add),
+        Scenario(f"bulk_insert_x{bulk_count}", bulk_insert, setup=prepare_bulk),
+    ]
+
+def cli_startup():
+    """Cold start of a new interpreter running "exp list -n 1" on the benchmark database"""
+    code = ("from src.core import init_core_module; "
+            f"init_core_module({core.DB_FOLDER!r}, {core.DB_NAME!r}, {{}}); "
+            "from src.cli import main_function; main_function(['exp', 'list', '-n', '1'])")
+    subprocess.run([sys.executable, "-c", code], cwd=REPOSITORY_ROOT, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
@@ -0,0 +1,72 @@
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from io import StringIO
+
+from src import core
+from src.core import DB, Expense, init_core_module, TABLE_NAME_EXPENSES, COLUMN_NAME_ALL_TITLE
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="expman concurrent writers stress test")
+    parser.add_argument("--writers", type=int, default=8, help="Number of writer processes (default: 8)")
+    parser.add_argument("--rows", type=int, default=200, help="Expenses added by every writer, one transaction each (default: 200)")
+    parser.add_argument("--busy-timeout", type=int, default=100, help="busy_timeout of the writers in ms, low to exercise the retries (default: 100)")
+    parser.add_argument("--retries", type=int, default=core.DB_WRITE_RETRIES, help=f"Retries of a locked write (default: {core.DB_WRITE_RETRIES})")
+    parser.add_argument("--workdir", type=str, default=os.path.join(tempfile.gettempdir(), "expman_stress"), help="Folder of the test database")
+    return parser
+
+def writer(folder: str, name: str, options: dict, writer_id: int, rows: int) -> int:
+    """Add rows expenses titled after the writer and return how many of them reported a failure"""
+    init_core_module(folder, name, options)
+    failures = 0
+    errors = StringIO()
+    with redirect_stdout(errors):
+        for row in range(rows):
+            expense = Expense(1, "2025-01-01", 1.0, f"writer {writer_id}", str(row))
+            if expense.Add() is None:
+                failures += 1
+    return failures
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    os.makedirs(args.workdir, exist_ok=True)
+    name = "stress.db"
+    path = os.path.join(args.workdir, name)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    with redirect_stdout(StringIO()):
+        init_core_module(args.workdir, name)
+        DB().SchemaVersion()
+    DB()._close()
+
+    options = {"busy_timeout": args.busy_timeout, "write_retries": args.retries}
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.writers) as pool:
+        failures = sum(pool.starmap(writer, [(args.workdir, name, options, writer_id, args.rows) for writer_id in range(args.writers)]))
+    elapsed = time.perf_counter() - start
+
+    connection = sqlite3.connect(path)
+    counts = dict(connection.execute(f"SELECT {COLUMN_NAME_ALL_TITLE}, COUNT(*) FROM {TABLE_NAME_EXPENSES} GROUP BY {COLUMN_NAME_ALL_TITLE}").fetchall())
+    connection.close()
+    stored = sum(counts.values())
+    expected = args.writers * args.rows
+    print(f"{args.writers} writers x {args.rows} rows in {elapsed:.2f} s ({expected / elapsed:.0f} rows/s)")
+    print(f"Stored: {stored} of {expected}, reported failures: {failures}")
+    for writer_id in range(args.writers):
+        count = counts.get(f"writer {writer_id}", 0)
+        if count != args.rows:
+            print(f"writer {writer_id}: {count} of {args.rows} rows")
+    # every row is either stored or reported as failed; nothing is dropped silently
+    if stored + failures != expected:
+        print(f"Lost rows: {expected - stored - failures}")
+        return 1
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator
+
+from src.core import DB
+
+# Worker threads of an AsyncDB, i.e. database connections used at the same time
+ASYNC_MAX_WORKERS = 4
+
+# Seconds after which a call is cancelled (None: no limit)
+ASYNC_TIMEOUT = None
+
+# Connections are opened one at a time, so that a new database is created and migrated once
+_connect_lock = threading.Lock()
+
+class _Job:
+    """A call run on a worker thread. Cancelling it before it starts skips it; cancelling it
+    while it runs interrupts the statement in progress on the worker connection"""
+    def __init__(self, function: Callable, args: tuple, kwargs: dict, databases: set):
+        self._function = function
+        self._args = args
+        self._kwargs = kwargs
+        self._databases = databases
+        self._lock = threading.Lock()
+        self._connection = None
+        self._cancelled = False
+
+    def __call__(self):
+        db = DB()
+        with _connect_lock:
+            connection = db._connect()
+        with self._lock:
+            if self._cancelled:
+                return None
+            self._databases.add(db)
+            self._connection = connection
+        try:
+            result = self._function(*self._args, **self._kwargs)
+            if isinstance(result, Iterator):
+                # iterators read from the worker connection: consume them here
+                result = tuple(result)
+            return result
+        finally:
+            with self._lock:
+                self._connection = None
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            if self._connection is not None:
+                self._connection.interrupt()
+
+class AsyncDB:
+    """Asyncio facade of DB. Calls run on a bounded pool of threads, each with its own DB
+    instance and connection, so the event loop never waits on sqlite3 and reads run
+    concurrently under WAL. DB methods can be awaited directly:
+
+        async with AsyncDB() as adb:
+            totals = await adb.FetchAggregate("2025-01-01", "2025-12-31", GroupBy.CATEGORY)
+            expenses = await adb.run(Expense.FetchNumber, 20, timeout=2.0)
+    """
+    def __init__(self, max_workers: int=None, timeout: float=None):
+        max_workers = max_workers or ASYNC_MAX_WORKERS
+        if max_workers <= 0:
+            raise ValueError(f"Invalid number of workers: {max_workers}")
+        self.timeout = ASYNC_TIMEOUT if timeout is None else timeout
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="expman-db")
+        self._databases = set()
+
+    async def run(self, function: Callable, *args, timeout: float=None, **kwargs):
+        """Await function(*args, **kwargs) run on a worker thread. On timeout (default: the pool one)
+        or cancellation the call is interrupted and asyncio.TimeoutError / CancelledError is raised"""
+        job = _Job(function, args, kwargs, self._databases)
+        future = asyncio.get_running_loop().run_in_executor(self._executor, job)
+        try:
+            return await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            job.cancel()
+            raise
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        async def call(*args, timeout: float=None, **kwargs):
+            return await self.run(lambda: getattr(DB(), name)(*args, **kwargs), timeout=timeout)
+        call.__name__ = name
+        return call
+
+    def close(self):
+        """Wait for the running calls and close the worker connections"""
+        self._executor.shutdown(wait=True)
+        for db in self._databases:
+            db._close()
+        self._databases.clear()
+
+    async def aclose(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+    async def __aenter__(self) -> "AsyncDB":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+_default_async_db = None
+
+def default_async_db() -> AsyncDB:
+    """Pool used by the a* methods of the item classes (e.g. Expense.afetch_date_interval)"""
+    global _default_async_db
+    if _default_async_db is None:
+        _default_async_db = AsyncDB()
+    return _default_async_db
@@ -1,67 +1,313 @@
 import argparse
 from datetime import date
+import os
 import sys
+import time
 
-from src.core import Expense, Income, Category, FormatType, date_is_valid
-from src.utils import print_categories_tree, balance_month, balance_year
+from src import core
+from src.core import DB, Expense, Income, Category, CategoryTree, FormatType, Granularity, date_is_valid, build_search_query, IMPORT_CHUNK_SIZE
 
 VERSION = "1.0.5"
 
-parser = argparse.ArgumentParser(description="Expenses manager")
-top_level_subparsers = parser.add_subparsers(dest="item", required=True, help="Available commands")
-# 'version' command
-version_parser = top_level_subparsers.add_parser("version", help="Show version")
-# 'exp' command
-exp_parser = top_level_subparsers.add_parser("exp", help="Manage expense records")
-exp_subparser = exp_parser.add_subparsers(dest="exp_command", required=True, help="Expense(s) manager command")
-# 'exp' -> 'list'
-exp_list_parser = exp_subparser.add_parser("list", help="List last expenses")
-exp_list_parser.add_argument("-n", "--number", type=int, default=20, help="Number of last items to be shown (default: 20)")
-exp_list_parser.add_argument("-c", "--category", type=int, default=-1, help="Filter expenses for a specific category ID. -1 means no filter. (default: -1)") # todo
-# 'exp' -> 'add'
-add_parser = exp_subparser.add_parser("add", help="Add expense")
-add_parser.add_argument("-a", "--amount", required=True, type=float, default=0.0, help="Amount of the expense (required)")
-add_parser.add_argument("-c", "--category", required=True, type=int, help="ID of the category for the expense (required)")
-add_parser.add_argument("-d", "--date", type=str, default="", help="Date of the expense in yyyy-mm-dd format. If not specified, today date is used.")
-add_parser.add_argument("-t", "--title", type=str, default="", help="Title of the expense")
-add_parser.add_argument("-n", "--notes", type=str, default="", help="Notes for the expense")
-
-# 'inc' command
-inc_parser = top_level_subparsers.add_parser("inc", help="Manage income records")
-inc_subparser = inc_parser.add_subparsers(dest="inc_command", required=True, help="income(s) manager command")
-# 'inc' -> 'list'
-inc_list_parser = inc_subparser.add_parser("list", help="List last incomes")
-inc_list_parser.add_argument("-n", "--number", type=int, default=20, help="Number of last items to be shown (default: 20)")
-inc_list_parser.add_argument("-c", "--category", type=int, default=-1, help="Filter incomes for a specific category ID. -1 means no filter. (default: -1)") # todo
-# 'inc' -> 'add'
-add_parser = inc_subparser.add_parser("add", help="Add income")
-add_parser.add_argument("-a", "--amount", required=True, type=float, default=0.0, help="Amount of the income")
-add_parser.add_argument("-d", "--date", type=str, default="", help="Date of the income in yyyy-mm-dd format. If not specified, today date is used.")
-add_parser.add_argument("-t", "--title", type=str, default="", help="Title of the income")
-add_parser.add_argument("-c", "--category", type=int, default=0, help="ID of the category for the income")
-add_parser.add_argument("-n", "--notes", type=str, default="", help="Notes for the income")
-
-# 'cat' command
-cat_parser = top_level_subparsers.add_parser("cat", help="Manage category records")
-cat_subparser = cat_parser.add_subparsers(dest="cat_command", required=True, help="Category manager command")
-# 'cat' -> 'list'
-cat_list_parser = cat_subparser.add_parser("list", help="List categories")
-# 'cat' -> 'tree'
-cat_tree_parser = cat_subparser.add_parser("tree", help="Show categories as a hierarchical tree")
-
-# 'balance' command # todo
-balance_parser = top_level_subparsers.add_parser("balance", help="Print balance statistics")
-balance_subparser = balance_parser.add_subparsers(dest="balance_command", required=True, help="Balance command")
-# 'balance' -> 'month' # todo
-balance_month_parser = balance_subparser.add_parser("month", help="Monthly balance")
-balance_month_parser.add_argument("-m", "--month", type=int, default=0, help="Month to be analyzed relative to the current month (0: current month, -1: previous month...)")
-# 'balance' -> 'year' # todo
-balance_year_parser = balance_subparser.add_parser("year", help="Yearly balance")
-balance_year_parser.add_argument("-y", "--year", type=int, default=0, help="Year to be analyzed relative to the current year (0: current year, -1: previous year...)")
-
-def main_function():
-    args = parser.parse_args()
+def build_parser() -> argparse.ArgumentParser:
+    """Build the argument parser. It is only constructed when a command is run"""
+    parser = argparse.ArgumentParser(description="Expenses manager")
+    parser.add_argument("--profile", action="store_true", help="Print executed SQL statements with timings and the query plan of the slowest ones")
+    parser.add_argument("--timing", action="store_true", help="Report startup time spent before the first database query (also enabled by EXPMAN_IMPORT_PROFILE)")
+    parser.add_argument("--format", choices=["table", "csv", "json", "jsonl", "tsv"], default=None, help="Output format of list, search, export and balance commands (default: table, csv for export)")
+    parser.add_argument("--ledger", action="append", default=None, help="Consolidate balance over the database files matching this glob, or a set of the [ledgers] configuration section (can be repeated)")
+    top_level_subparsers = parser.add_subparsers(dest="item", required=True, help="Available commands")
+    # 'version' command
+    version_parser = top_level_subparsers.add_parser("version", help="Show version")
+    # 'exp' command
+    exp_parser = top_level_subparsers.add_parser("exp", help="Manage expense records")
+    exp_subparser = exp_parser.add_subparsers(dest="exp_command", required=True, help="Expense(s) manager command")
+    # 'exp' -> 'list'
+    exp_list_parser = exp_subparser.add_parser("list", help="List last expenses")
+    exp_list_parser.add_argument("-n", "--number", type=int, default=20, help="Number of last items to be shown (default: 20)")
+    exp_list_parser.add_argument("-c", "--category", type=int, default=-1, help="Filter expenses for a specific category ID and its subcategories. -1 means no filter. (default: -1)")
+    exp_list_parser.add_argument("--before-id", type=int, default=None, help="Show expenses older than this ID")
+    exp_list_parser.add_argument("--after-id", type=int, default=None, help="Show expenses newer than this ID")
+    exp_list_parser.add_argument("--before-date", type=str, default=None, help="Show expenses dated before this day (yyyy-mm-dd), newest date first")
+    exp_list_parser.add_argument("--cursor", type=str, default=None, help="Continue from the page cursor printed by a previous list")
+    # 'exp' -> 'add'
+    add_parser = exp_subparser.add_parser("add", help="Add expense")
+    add_parser.add_argument("-a", "--amount", required=True, type=float, default=0.0, help="Amount of the expense (required)")
+    add_parser.add_argument("-c", "--category", required=True, type=int, help="ID of the category for the expense (required)")
+    add_parser.add_argument("-d", "--date", type=str, default="", help="Date of the expense in yyyy-mm-dd format. If not specified, today date is used.")
+    add_parser.add_argument("-t", "--title", type=str, default="", help="Title of the expense")
+    add_parser.add_argument("-n", "--notes", type=str, default="", help="Notes for the expense")
+    # 'exp' -> 'search'
+    exp_search_parser = exp_subparser.add_parser("search", help="Full-text search of expenses by title and notes")
+    exp_search_parser.add_argument("words", nargs="+", help="Words that shall all appear in the title or in the notes")
+    exp_search_parser.add_argument("-p", "--prefix", action="store_true", help="Match words as prefixes (e.g. 'groc' matches 'groceries')")
+    exp_search_parser.add_argument("--raw", action="store_true", help="Pass the words unchanged as an FTS5 query (AND/OR/NOT, \"phrases\", prefix*)")
+    exp_search_parser.add_argument("--from", dest="date_from", type=str, default="", help="First day in yyyy-mm-dd format")
+    exp_search_parser.add_argument("--to", dest="date_to", type=str, default="", help="Last day in yyyy-mm-dd format")
+    exp_search_parser.add_argument("-c", "--category", type=int, default=-1, help="Restrict to a category ID and its subcategories. -1 means no filter. (default: -1)")
+    exp_search_parser.add_argument("-n", "--number", type=int, default=20, help="Maximum number of results (default: 20)")
+    # 'exp' -> 'import'
+    exp_import_parser = exp_subparser.add_parser("import", help="Bulk import expenses from a CSV file")
+    exp_import_parser.add_argument("file", nargs="?", default="-", help="CSV file with header date,amount,category[,title,notes]. '-' reads from stdin (default: -)")
+    exp_import_parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE, help=f"Rows inserted per transaction (default: {IMPORT_CHUNK_SIZE})")
+    exp_import_parser.add_argument("--delimiter", type=str, default=",", help="CSV field delimiter (default: ,)")
+    # 'exp' -> 'export'
+    exp_export_parser = exp_subparser.add_parser("export", help="Write all the expenses of a date range, oldest first (CSV unless --format is given)")
+    exp_export_parser.add_argument("--from", dest="date_from", type=str, default="", help="First day in yyyy-mm-dd format (default: the first record)")
+    exp_export_parser.add_argument("--to", dest="date_to", type=str, default="", help="Last day in yyyy-mm-dd format (default: the last record)")
+    exp_export_parser.add_argument("-o", "--output", type=str, default="-", help="Output file. '-' writes to stdout (default: -)")
+    exp_export_parser.add_argument("--batch-size", type=int, default=core.FETCH_BATCH_SIZE, help=f"Rows read from the database and written at a time (default: {core.FETCH_BATCH_SIZE})")
 
+    # 'inc' command
+    inc_parser = top_level_subparsers.add_parser("inc", help="Manage income records")
+    inc_subparser = inc_parser.add_subparsers(dest="inc_command", required=True, help="income(s) manager command")
+    # 'inc' -> 'list'
+    inc_list_parser = inc_subparser.add_parser("list", help="List last incomes")
+    inc_list_parser.add_argument("-n", "--number", type=int, default=20, help="Number of last items to be shown (default: 20)")
+    inc_list_parser.add_argument("-c", "--category", type=int, default=-1, help="Filter incomes for a specific category ID and its subcategories. -1 means no filter. (default: -1)")
+    inc_list_parser.add_argument("--before-id", type=int, default=None, help="Show incomes older than this ID")
+    inc_list_parser.add_argument("--after-id", type=int, default=None, help="Show incomes newer than this ID")
+    inc_list_parser.add_argument("--before-date", type=str, default=None, help="Show incomes dated before this day (yyyy-mm-dd), newest date first")
+    inc_list_parser.add_argument("--cursor", type=str, default=None, help="Continue from the page cursor printed by a previous list")
+    # 'inc' -> 'add'
+    add_parser = inc_subparser.add_parser("add", help="Add income")
+    add_parser.add_argument("-a", "--amount", required=True, type=float, default=0.0, help="Amount of the income")
+    add_parser.add_argument("-d", "--date", type=str, default="", help="Date of the income in yyyy-mm-dd format. If not specified, today date is used.")
+    add_parser.add_argument("-t", "--title", type=str, default="", help="Title of the income")
+    add_parser.add_argument("-c", "--category", type=int, default=0, help="ID of the category for the income")
+    add_parser.add_argument("-n", "--notes", type=str, default="", help="Notes for the income")
+    # 'inc' -> 'search'
+    inc_search_parser = inc_subparser.add_parser("search", help="Full-text search of incomes by title and notes")
+    inc_search_parser.add_argument("words", nargs="+", help="Words that shall all appear in the title or in the notes")
+    inc_search_parser.add_argument("-p", "--prefix", action="store_true", help="Match words as prefixes (e.g. 'groc' matches 'groceries')")
+    inc_search_parser.add_argument("--raw", action="store_true", help="Pass the words unchanged as an FTS5 query (AND/OR/NOT, \"phrases\", prefix*)")
+    inc_search_parser.add_argument("--from", dest="date_from", type=str, default="", help="First day in yyyy-mm-dd format")
+    inc_search_parser.add_argument("--to", dest="date_to", type=str, default="", help="Last day in yyyy-mm-dd format")
+    inc_search_parser.add_argument("-c", "--category", type=int, default=-1, help="Restrict to a category ID and its subcategories. -1 means no filter. (default: -1)")
+    inc_search_parser.add_argument("-n", "--number", type=int, default=20, help="Maximum number of results (default: 20)")
+    # 'inc' -> 'import'
+    inc_import_parser = inc_subparser.add_parser("import", help="Bulk import incomes from a CSV file")
+    inc_import_parser.add_argument("file", nargs="?", default="-", help="CSV file with header date,amount,category[,title,notes]. '-' reads from stdin (default: -)")
+    inc_import_parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE, help=f"Rows inserted per transaction (default: {IMPORT_CHUNK_SIZE})")
+    inc_import_parser.add_argument("--delimiter", type=str, default=",", help="CSV field delimiter (default: ,)")
+    # 'inc' -> 'export'
+    inc_export_parser = inc_subparser.add_parser("export", help="Write all the incomes of a date range, oldest first (CSV unless --format is given)")
+    inc_export_parser.add_argument("--from", dest="date_from", type=str, default="", help="First day in yyyy-mm-dd format (default: the first record)")
+    inc_export_parser.add_argument("--to", dest="date_to", type=str, default="", help="Last day in yyyy-mm-dd format (default: the last record)")
+    inc_export_parser.add_argument("-o", "--output", type=str, default="-", help="Output file. '-' writes to stdout (default: -)")
+    inc_export_parser.add_argument("--batch-size", type=int, default=core.FETCH_BATCH_SIZE, help=f"Rows read from the database and written at a time (default: {core.FETCH_BATCH_SIZE})")
+
+    # 'cat' command
+    cat_parser = top_level_subparsers.add_parser("cat", help="Manage category records")
+    cat_subparser = cat_parser.add_subparsers(dest="cat_command", required=True, help="Category manager command")
+    # 'cat' -> 'list'
+    cat_list_parser = cat_subparser.add_parser("list", help="List categories")
+    # 'cat' -> 'tree'
+    cat_tree_parser = cat_subparser.add_parser("tree", help="Show categories as a hierarchical tree")
+
+    # 'balance' command # todo
+    balance_parser = top_level_subparsers.add_parser("balance", help="Print balance statistics")
+    balance_subparser = balance_parser.add_subparsers(dest="balance_command", required=True, help="Balance command")
+    # 'balance' -> 'month' # todo
+    balance_month_parser = balance_subparser.add_parser("month", help="Monthly balance")
+    balance_month_parser.add_argument("-m", "--month", type=int, default=0, help="Month to be analyzed relative to the current month (0: current month, -1: previous month...)")
+    balance_month_parser.add_argument("-c", "--by-category", action="store_true", help="Also print the totals per category")
+    # 'balance' -> 'year' # todo
+    balance_year_parser = balance_subparser.add_parser("year", help="Yearly balance")
+    balance_year_parser.add_argument("-y", "--year", type=int, default=0, help="Year to be analyzed relative to the current year (0: current year, -1: previous year...)")
+    balance_year_parser.add_argument("-c", "--by-category", action="store_true", help="Also print the totals per category")
+    # 'balance' -> 'series'
+    balance_series_parser = balance_subparser.add_parser("series", help="Balance for consecutive periods, with running balance")
+    balance_series_parser.add_argument("-g", "--granularity", choices=["day", "week", "month", "year"], default="month", help="Length of each period (default: month)")
+    balance_series_parser.add_argument("-n", "--periods", type=int, default=12, help="Number of periods up to today, ignored if --from is given (default: 12)")
+    balance_series_parser.add_argument("--from", dest="date_from", type=str, default="", help="First day of the range in yyyy-mm-dd format")
+    balance_series_parser.add_argument("--to", dest="date_to", type=str, default="", help="Last day of the range in yyyy-mm-dd format. If not specified, today date is used.")
+    balance_series_parser.add_argument("-c", "--by-category", action="store_true", help="Break down every period by category")
+
+    # 'serve' command
+    serve_parser = top_level_subparsers.add_parser("serve", help="Run a daemon that executes the commands of the expman script over a Unix socket")
+    serve_parser.add_argument("--socket", type=str, default="", help="Path of the Unix socket (default: $EXPMAN_SOCKET, or expman.sock in $XDG_RUNTIME_DIR or in a private folder of the temp folder)")
+    serve_parser.add_argument("--stop", action="store_true", help="Stop a running daemon")
+
+    # 'shell' and 'batch' commands
+    shell_parser = top_level_subparsers.add_parser("shell", help="Read commands (e.g. 'exp add -a 10 -c 1') from stdin and run them in this process")
+    batch_parser = top_level_subparsers.add_parser("batch", help="Run the commands of a file in this process")
+    batch_parser.add_argument("file", help="File with one command per line. '-' reads from stdin")
+    for command_parser in (shell_parser, batch_parser):
+        command_parser.add_argument("--batch-size", type=int, default=100, help="Commands committed per transaction (default: 100)")
+        command_parser.add_argument("--atomic", action="store_true", help="Commit only if every command succeeds")
+        command_parser.add_argument("--strict", action="store_true", help="Stop at the first failing command")
+
+    # 'snapshot' command
+    snapshot_parser = top_level_subparsers.add_parser("snapshot", help="Export expenses and incomes to a columnar snapshot for analysis (incremental)")
+    snapshot_parser.add_argument("-o", "--output", type=str, default="", help="Snapshot folder (default: next to the database)")
+    snapshot_parser.add_argument("--full", action="store_true", help="Export everything again, e.g. after editing existing records")
+    # 'db' command
+    db_parser = top_level_subparsers.add_parser("db", help="Database maintenance")
+    db_subparser = db_parser.add_subparsers(dest="db_command", required=True, help="Database command")
+    # 'db' -> 'status'
+    db_status_parser = db_subparser.add_parser("status", help="Show schema version and pending migrations")
+    # 'db' -> 'migrate'
+    db_migrate_parser = db_subparser.add_parser("migrate", help="Apply pending schema migrations")
+    # 'db' -> 'rebuild-summaries'
+    db_rebuild_summaries_parser = db_subparser.add_parser("rebuild-summaries", help="Recompute the monthly totals used by balance")
+    # 'db' -> 'checkpoint'
+    db_checkpoint_parser = db_subparser.add_parser("checkpoint", help="Copy the write-ahead log into the database file")
+    db_checkpoint_parser.add_argument("-m", "--mode", type=str, choices=["passive", "full", "restart", "truncate"], default="passive", help="Checkpoint mode (default: passive, never waits for other connections)")
+    # 'db' -> 'backup'
+    db_backup_parser = db_subparser.add_parser("backup", help="Copy the database while it is in use (online backup)")
+    db_backup_parser.add_argument("-o", "--output", type=str, default="", help="Backup file, or folder of timestamped backups: an existing folder, a path ending with '/' or any path with --keep (default: 'backups' next to the database)")
+    db_backup_parser.add_argument("--keep", type=int, default=0, help="Keep only the newest N timestamped backups of the folder (default: keep all)")
+    db_backup_parser.add_argument("--pages", type=int, default=core.BACKUP_PAGES_PER_STEP, help=f"Pages copied per step (default: {core.BACKUP_PAGES_PER_STEP})")
+    db_backup_parser.add_argument("--sleep", type=float, default=core.BACKUP_STEP_SLEEP, help=f"Seconds to pause between steps, leaving the disk to writers (default: {core.BACKUP_STEP_SLEEP})")
+    # 'db' -> 'compact'
+    db_compact_parser = db_subparser.add_parser("compact", help="Reclaim unused space")
+    db_compact_parser.add_argument("--into", type=str, default=None, help="Write a compacted copy to this file instead (VACUUM INTO, does not block writers)")
+    db_compact_parser.add_argument("--pages", type=int, default=0, help="Free pages released by an incremental vacuum (default: 0, all)")
+    return parser
+
+
+def backup_database(db: DB, output: str, keep: int, pages: int, sleep: float):
+    """Run an online backup, reporting progress on a terminal, then rotate the timestamped backups"""
+    folder = output or os.path.join(core.DB_FOLDER, "backups")
+    # a folder (created if missing) unless output names a file: --keep rotates the backups of a folder
+    if output and not keep and not os.path.isdir(output) and not output.endswith(("/", os.sep)):
+        target = output
+    else:
+        os.makedirs(folder, exist_ok=True)
+        target = db.BackupPath(folder)
+    progress = None
+    if sys.stderr.isatty():
+        def progress(remaining: int, total: int):
+            print(f"\rBackup: {100 * (total - remaining) // max(total, 1):3d}%", end="", file=sys.stderr, flush=True)
+    report = db.Backup(target, pages, sleep, progress)
+    if progress is not None:
+        print(file=sys.stderr)
+    print(report.to_string())
+    if keep:
+        for path in db.RotateBackups(folder, keep):
+            print(f"Removed old backup {path}")
+
+
+def import_transactions(item_class, file_name:str, chunk_size:int, delimiter:str):
+    """Run a bulk import from a file (or stdin) and print a summary"""
+    if file_name == "-":
+        report = item_class.Import(sys.stdin, chunk_size, delimiter)
+    else:
+        with open(file_name, newline="") as file:
+            report = item_class.Import(file, chunk_size, delimiter)
+    print(f"Imported {report.inserted} rows in {report.elapsed:.2f} s ({report.rows_per_second:.0f} rows/s)")
+    if report.rejected:
+        print(f"Rejected {len(report.rejected)} lines:", file=sys.stderr)
+        for line, reason in report.rejected:
+            print(f"  line {line}: {reason}", file=sys.stderr)
+        sys.exit(1)
+
+def print_timing(start_time:float, main_time:float, parsed_time:float):
+    """Print where the time went between process start and the end of the command"""
+    end_time = time.perf_counter()
+    first_query_time = core.FIRST_QUERY_TIME
+    print(f"imports:      {(main_time - start_time) * 1000:8.1f} ms", file=sys.stderr)
+    print(f"arguments:    {(parsed_time - main_time) * 1000:8.1f} ms", file=sys.stderr)
+    if first_query_time is not None and first_query_time >= start_time:
+        print(f"first query:  {(first_query_time - start_time) * 1000:8.1f} ms after start", file=sys.stderr)
+    print(f"total:        {(end_time - start_time) * 1000:8.1f} ms", file=sys.stderr)
+
+def transaction_writer(item_class, output_format: str, file=None):
+    """Row writer of expenses or incomes. The table keeps the layout of the records to_string"""
+    from src.output import RowWriter, TRANSACTION_COLUMNS
+    record_type = core.RECORD_TYPES[item_class.table_name]
+    return RowWriter(TRANSACTION_COLUMNS, output_format, file, lambda row: record_type._make(row).to_string())
+
+def export_transactions(item_class, args):
+    """Stream the records of a date range, oldest first, to a file or stdout"""
+    for value in (args.date_from, args.date_to):
+        if value != "" and not date_is_valid(value):
+            raise ValueError(f"Invalid date format for: {value}")
+    output_format = args.format or "csv"
+    file = sys.stdout if args.output == "-" else open(args.output, "w", newline="", encoding="utf-8")
+    try:
+        writer = transaction_writer(item_class, output_format, file)
+        writer.write_batches(DB().IterDateBatches(item_class.table_name, args.date_from or None, args.date_to or None, args.batch_size))
+        writer.close()
+    finally:
+        if file is not sys.stdout:
+            file.close()
+    print(f"Exported {writer.rows} rows", file=sys.stderr)
+
+def list_transactions(item_class, args):
+    """Print the latest transactions, or one page of them when a page position is given.
+    The cursors of the adjacent pages are printed on stderr"""
+    category_id = args.category if args.category >= 0 else None
+    number = abs(args.number)
+    positions = [value for value in (args.before_id, args.after_id, args.before_date, args.cursor) if value is not None]
+    if len(positions) > 1:
+        raise ValueError("Use only one of --before-id, --after-id, --before-date and --cursor")
+    if args.cursor is not None:
+        cursor = core.PageCursor.decode(args.cursor)
+    else:
+        cursor = core.PageCursor(args.before_id, args.after_id, args.before_date)
+    writer = transaction_writer(item_class, args.format or "table")
+    if not positions:
+        # no position: stream the latest rows
+        last_id = None
+        for rows in DB().IterNumberBatches(item_class.table_name, number, category_id=category_id):
+            writer.write_batch(rows)
+            last_id = rows[-1][0]
+        writer.close()
+        next_cursor = None
+        if writer.rows == number and last_id is not None:
+            # a full page: there is a next one only if older rows exist
+            candidate = core.PageCursor(before_id=last_id)
+            if item_class.FetchPage(1, candidate, category_id).records:
+                next_cursor = candidate
+        previous_cursor = None
+    else:
+        page = item_class.FetchPage(number, cursor, category_id)
+        writer.write_batch(list(page.records))
+        writer.close()
+        next_cursor = page.next_cursor
+        previous_cursor = page.previous_cursor
+    if next_cursor is not None:
+        print(f"Next page: --cursor {next_cursor.encode()}", file=sys.stderr)
+    if previous_cursor is not None:
+        print(f"Previous page: --cursor {previous_cursor.encode()}", file=sys.stderr)
+
+def search_transactions(item_class, args):
+    """Run a full-text search and print the matching records"""
+    for value in (args.date_from, args.date_to):
+        if value != "" and not date_is_valid(value):
+            raise ValueError(f"Invalid date format for: {value}")
+    text_query = " ".join(args.words) if args.raw else build_search_query(args.words, args.prefix)
+    category_id = args.category if args.category >= 0 else None
+    writer = transaction_writer(item_class, args.format or "table")
+    writer.write_batch(list(item_class.Search(text_query, args.date_from or None, args.date_to or None, category_id, abs(args.number))))
+    writer.close()
+
+def main_function(argv=None, start_time:float=None):
+    main_time = time.perf_counter()
+    if start_time is None:
+        start_time = main_time
+    args = build_parser().parse_args(argv)
+    parsed_time = time.perf_counter()
+    if not args.profile:
+        run_command(args)
+    else:
+        profiler = core.QueryProfiler()
+        DB().add_query_callback(profiler)
+        try:
+            run_command(args)
+        finally:
+            # also when the command fails: the daemon keeps DB() for the next commands
+            DB().remove_query_callback(profiler)
+            profiler.print_summary(file=sys.stderr)
+    if args.timing or os.environ.get("EXPMAN_IMPORT_PROFILE"):
+        print_timing(start_time, main_time, parsed_time)
+
+def run_command(args):
+    """Dispatch parsed arguments to the command handlers"""
+    if args.ledger and not (args.item == "balance" and args.balance_command in ("month", "year")):
+        raise ValueError("--ledger can only be used with balance month and balance year")
     if args.item == "version":
         if getattr(sys, 'frozen', False):
             # compoiled version
@@ -82,13 +328,18 @@ def main_function():
                     raise ValueError(f"Invalid date format for: {args.date}")
             expense = Expense(args.category, exp_date, args.amount, args.title, args.notes)
             #expense.Create()
-            expense.Add()
+            if expense.Add() is None:
+                raise ValueError("Expense not added to the database")
             print(f"Expense added to the database")
         elif args.exp_command == "list":
             # list expenses
-            tExp = Expense.FetchNumber(abs(args.number))
-            for exp in tExp:
-                print(exp.to_string())
+            list_transactions(Expense, args)
+        elif args.exp_command == "search":
+            search_transactions(Expense, args)
+        elif args.exp_command == "import":
+            import_transactions(Expense, args.file, args.chunk_size, args.delimiter)
+        elif args.exp_command == "export":
+            export_transactions(Expense, args)
     elif args.item == "inc":
         if args.inc_command == "add":
             # add income
@@ -102,25 +353,95 @@ def main_function():
                     raise ValueError(f"Invalid date format for: {args.date}")
             income = Income(args.category, inc_date, args.amount, args.title, args.notes)
             #income.Create()
-            income.Add()
+            if income.Add() is None:
+                raise ValueError("Income not added to the database")
             print(f"Income added to the database")
         elif args.inc_command == "list":
             # list all incomes
-            tInc = Income.FetchNumber(abs(args.number))
-            for inc in tInc:
-                print(inc.to_string())
+            list_transactions(Income, args)
+        elif args.inc_command == "search":
+            search_transactions(Income, args)
+        elif args.inc_command == "import":
+            import_transactions(Income, args.file, args.chunk_size, args.delimiter)
+        elif args.inc_command == "export":
+            export_transactions(Income, args)
     elif args.item == "cat":
         if args.cat_command == "list":
             # list categories
-            tCat = Category.FetchAll()
-            print(Category.get_list_header())
-            for cat in tCat:
-                print(cat.to_string(FormatType.LIST))
+            from src.output import RowWriter, CATEGORY_COLUMNS
+            writer = RowWriter(CATEGORY_COLUMNS, args.format or "table", table_row=lambda row: core.CategoryRecord._make(row).to_string(FormatType.LIST),
+                               table_header=Category.get_list_header())
+            writer.write_batch(list(Category.FetchAll()))
+            writer.close()
         elif args.cat_command == "tree":
-            tCat = Category.FetchAll()
-            print_categories_tree(tCat, 0, 0, 10)
+            from src.utils import print_categories_tree
+            print_categories_tree(CategoryTree.Cached(), 0)
     elif args.item == "balance":
+        from src.utils import balance_month, balance_year, balance_series, series_interval
+        ledgers = None
+        if args.ledger:
+            from src.ledgers import resolve_ledgers
+            ledgers = resolve_ledgers(args.ledger)
         if args.balance_command == "month":
-            balance_month(args.month)
+            balance_month(args.month, ledgers, args.by_category, args.format or "table")
         elif args.balance_command == "year":
-            balance_year(args.year)
\ No newline at end of file
+            balance_year(args.year, ledgers, args.by_category, args.format or "table")
+        elif args.balance_command == "series":
+            granularity = Granularity[args.granularity.upper()]
+            date_from, date_to = series_interval(granularity, args.periods)
+            for value in (args.date_from, args.date_to):
+                if value != "" and not date_is_valid(value):
+                    raise ValueError(f"Invalid date format for: {value}")
+            if args.date_from != "":
+                date_from = date.fromisoformat(args.date_from)
+            if args.date_to != "":
+                date_to = date.fromisoformat(args.date_to)
+            balance_series(granularity, date_from, date_to, args.by_category, args.format or "table")
+    elif args.item in ("shell", "batch"):
+        from src import shell
+        if args.item == "shell":
+            exit_code = shell.run_shell(args.batch_size, args.atomic, args.strict)
+        else:
+            exit_code = shell.run_batch(args.file, args.batch_size, args.atomic, args.strict)
+        if exit_code:
+            sys.exit(exit_code)
+    elif args.item == "serve":
+        from src import daemon
+        if args.stop:
+            if not daemon.stop(args.socket or None):
+                print("No daemon running")
+        else:
+            daemon.serve(args.socket or None)
+    elif args.item == "snapshot":
+        from src.snapshot import update_snapshot, default_folder
+        folder = args.output or default_folder()
+        for table_name, (appended, rows) in update_snapshot(folder, args.full).items():
+            print(f"{table_name}: {appended} rows appended, {rows} in total")
+        print(f"Snapshot: {folder}")
+    elif args.item == "db":
+        db = DB()
+        if args.db_command in ("status", "migrate"):
+            # report the pending migrations instead of applying them on connection
+            db.Open(migrate=False)
+        if args.db_command == "status":
+            pending = db.PendingMigrations()
+            print(f"Schema version: {db.SchemaVersion()}")
+            print(f"Pending migrations: {len(pending)}")
+            for version, description in pending:
+                print(f"  {version}: {description}")
+        elif args.db_command == "migrate":
+            applied = db.Migrate()
+            for version, description in applied:
+                print(f"Applied migration {version}: {description}")
+            print(f"Schema version: {db.SchemaVersion()}")
+        elif args.db_command == "rebuild-summaries":
+            db.RebuildSummaries()
+            print("Monthly totals rebuilt")
+        elif args.db_command == "checkpoint":
+            busy, log_frames, checkpointed = db.Checkpoint(args.mode)
+            print(f"Checkpoint ({args.mode}): {checkpointed} of {log_frames} WAL frames copied{' (database busy)' if busy else ''}")
+        elif args.db_command == "backup":
+            backup_database(db, args.output, args.keep, args.pages, args.sleep)
+        elif args.db_command == "compact":
+            report = db.Compact(args.into, args.pages)
+            print(report.to_string())
@@ -1,8 +1,18 @@
 
+import atexit
+import math
+import base64
 import os
+import random
 import sqlite3
-from datetime import date
-from typing import List, Tuple
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import date, timedelta
+from contextlib import contextmanager
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Sequence, TextIO, Tuple
 from enum import Enum
 import re
 
@@ -12,9 +22,16 @@ DB_NAME = "expman_db.db"
 TABLE_NAME_CATEGORIES = "CATEGORIES"
 TABLE_NAME_EXPENSES = "EXPENSES"
 TABLE_NAME_INCOMES = "INCOMES"
+TABLE_NAME_MONTHLY_TOTALS = "MONTHLY_TOTALS"
+# Suffix of the full-text index of a transaction table (e.g. EXPENSES_FTS)
+FTS_SUFFIX = "_FTS"
 
 COLUMN_NAME_ALL_ID = "ID"
 COLUMN_NAME_ALL_DATE = "DATETIME"
+COLUMN_NAME_ALL_CATEGORY = "CATEGORY"
+COLUMN_NAME_ALL_AMOUNT = "AMOUNT"
+COLUMN_NAME_ALL_TITLE = "TITLE"
+COLUMN_NAME_ALL_NOTES = "NOTES"
 
 COLUMN_NAME_CATEGORY_ID = "ID"
 COLUMN_NAME_CATEGORY_PARENT = "PARENT"
@@ -35,6 +52,13 @@ COLUMN_NAME_INCOME_AMOUNT = "AMOUNT"
 COLUMN_NAME_INCOME_TITLE = "TITLE"
 COLUMN_NAME_INCOME_NOTES = "NOTES"
 
+COLUMN_NAME_SUMMARY_YEAR = "YEAR"
+COLUMN_NAME_SUMMARY_MONTH = "MONTH"
+COLUMN_NAME_SUMMARY_CATEGORY = "CATEGORY"
+COLUMN_NAME_SUMMARY_KIND = "KIND"
+COLUMN_NAME_SUMMARY_TOTAL = "TOTAL"
+COLUMN_NAME_SUMMARY_COUNT = "COUNT"
+
 COLUMN_ATTRIBUTES_CATEGORY_ID = "INTEGER NOT NULL"
 COLUMN_ATTRIBUTES_CATEGORY_PARENT = "INTEGER NOT NULL"
 COLUMN_ATTRIBUTES_CATEGORY_TITLE = "TEXT NOT NULL"
@@ -54,21 +78,271 @@ COLUMN_ATTRIBUTES_INCOME_AMOUNT = "REAL NOT NULL"
 COLUMN_ATTRIBUTES_INCOME_TITLE = "TEXT"
 COLUMN_ATTRIBUTES_INCOME_NOTES = "TEXT"
 
-def init_core_module(db_path:str, db_name:str):
+# Pragmas applied to the shared connection. Each of them can be overridden
+# from the [database] section of the configuration file
+DB_PRAGMAS = {
+    "busy_timeout": "5000",
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": "-16000",
+    "mmap_size": "268435456",
+    "temp_store": "MEMORY",
+}
+
+# Number of rows inserted per transaction by the bulk import
+IMPORT_CHUNK_SIZE = 5000
+
+# perf_counter() value when the first database connection was opened (see --timing)
+FIRST_QUERY_TIME = None
+
+# Number of rows pulled from the cursor at a time by the streaming iterators
+FETCH_BATCH_SIZE = 1000
+
+# Number of prepared statements kept by the connection (sqlite3 cached_statements).
+# It can be overridden from the [database] section (statement_cache_size)
+DB_STATEMENT_CACHE_SIZE = 128
+
+# A write transaction still finding the database locked after busy_timeout is retried up to
+# DB_WRITE_RETRIES times, waiting DB_WRITE_RETRY_DELAY seconds before the first retry and
+# doubling the wait every time. Both can be overridden from the [database] section
+DB_WRITE_RETRIES = 5
+DB_WRITE_RETRY_DELAY = 0.1
+
+# Seconds between the explicit WAL checkpoints run after committed writes (0 disables them:
+# only SQLite's automatic checkpoint applies). [database] option checkpoint_interval
+DB_CHECKPOINT_INTERVAL = 60.0
+
+CHECKPOINT_MODES = ("PASSIVE", "FULL", "RESTART", "TRUNCATE")
+
+# Pages copied by each step of DB.Backup (0: all in one step), and pause in seconds between steps to leave I/O to the writers
+BACKUP_PAGES_PER_STEP = 1024
+BACKUP_STEP_SLEEP = 0.0
+
+# Memory bound, in bytes, of the results kept by the read cache (categories, date interval
+# fetches and aggregates). 0 disables it. [database] option read_cache_size
+DB_READ_CACHE_SIZE = 8 * 1024 * 1024
+
+# Apply pending schema migrations when DB is created. It can be disabled from the
+# [database] section (auto_migrate = no) and run offline with "expman db migrate"
+DB_AUTO_MIGRATE = True
+
+def _summary_table_statements() -> Tuple[str]:
+    """Statements creating MONTHLY_TOTALS and the triggers keeping it in sync with the transaction tables"""
+    key_columns = f"{COLUMN_NAME_SUMMARY_YEAR}, {COLUMN_NAME_SUMMARY_MONTH}, {COLUMN_NAME_SUMMARY_CATEGORY}, {COLUMN_NAME_SUMMARY_KIND}"
+    statements = [
+        f"CREATE TABLE IF NOT EXISTS {TABLE_NAME_MONTHLY_TOTALS} ("
+        f"{COLUMN_NAME_SUMMARY_YEAR} INTEGER NOT NULL, {COLUMN_NAME_SUMMARY_MONTH} INTEGER NOT NULL, "
+        f"{COLUMN_NAME_SUMMARY_CATEGORY} INTEGER NOT NULL, {COLUMN_NAME_SUMMARY_KIND} TEXT NOT NULL, "
+        f"{COLUMN_NAME_SUMMARY_TOTAL} REAL NOT NULL, {COLUMN_NAME_SUMMARY_COUNT} INTEGER NOT NULL, "
+        f"PRIMARY KEY({key_columns})) WITHOUT ROWID",
+    ]
+    for table_name in (TABLE_NAME_EXPENSES, TABLE_NAME_INCOMES):
+        def key_values(row: str) -> str:
+            return (f"CAST(substr({row}.{COLUMN_NAME_ALL_DATE}, 1, 4) AS INTEGER), CAST(substr({row}.{COLUMN_NAME_ALL_DATE}, 6, 2) AS INTEGER), "
+                    f"{row}.{COLUMN_NAME_ALL_CATEGORY}, '{table_name}'")
+        def key_match(row: str) -> str:
+            return (f"{COLUMN_NAME_SUMMARY_YEAR} = CAST(substr({row}.{COLUMN_NAME_ALL_DATE}, 1, 4) AS INTEGER) "
+                    f"AND {COLUMN_NAME_SUMMARY_MONTH} = CAST(substr({row}.{COLUMN_NAME_ALL_DATE}, 6, 2) AS INTEGER) "
+                    f"AND {COLUMN_NAME_SUMMARY_CATEGORY} = {row}.{COLUMN_NAME_ALL_CATEGORY} AND {COLUMN_NAME_SUMMARY_KIND} = '{table_name}'")
+        add_new = (f"INSERT INTO {TABLE_NAME_MONTHLY_TOTALS} ({key_columns}, {COLUMN_NAME_SUMMARY_TOTAL}, {COLUMN_NAME_SUMMARY_COUNT}) "
+                   f"VALUES ({key_values('NEW')}, NEW.{COLUMN_NAME_ALL_AMOUNT}, 1) "
+                   f"ON CONFLICT({key_columns}) DO UPDATE SET {COLUMN_NAME_SUMMARY_TOTAL} = {COLUMN_NAME_SUMMARY_TOTAL} + excluded.{COLUMN_NAME_SUMMARY_TOTAL}, "
+                   f"{COLUMN_NAME_SUMMARY_COUNT} = {COLUMN_NAME_SUMMARY_COUNT} + 1;")
+        remove_old = (f"UPDATE {TABLE_NAME_MONTHLY_TOTALS} SET {COLUMN_NAME_SUMMARY_TOTAL} = {COLUMN_NAME_SUMMARY_TOTAL} - OLD.{COLUMN_NAME_ALL_AMOUNT}, "
+                      f"{COLUMN_NAME_SUMMARY_COUNT} = {COLUMN_NAME_SUMMARY_COUNT} - 1 WHERE {key_match('OLD')}; "
+                      f"DELETE FROM {TABLE_NAME_MONTHLY_TOTALS} WHERE {key_match('OLD')} AND {COLUMN_NAME_SUMMARY_COUNT} <= 0;")
+        statements += [
+            f"CREATE TRIGGER IF NOT EXISTS TRG_{table_name}_SUMMARY_INSERT AFTER INSERT ON {table_name} BEGIN {add_new} END",
+            f"CREATE TRIGGER IF NOT EXISTS TRG_{table_name}_SUMMARY_DELETE AFTER DELETE ON {table_name} BEGIN {remove_old} END",
+            f"CREATE TRIGGER IF NOT EXISTS TRG_{table_name}_SUMMARY_UPDATE AFTER UPDATE OF {COLUMN_NAME_ALL_CATEGORY}, {COLUMN_NAME_ALL_DATE}, {COLUMN_NAME_ALL_AMOUNT} "
+            f"ON {table_name} BEGIN {remove_old} {add_new} END",
+        ]
+    return tuple(statements) + _summary_rebuild_statements()
+
+def _summary_rebuild_statements() -> Tuple[str]:
+    """Statements recomputing MONTHLY_TOTALS from scratch"""
+    key_columns = f"{COLUMN_NAME_SUMMARY_YEAR}, {COLUMN_NAME_SUMMARY_MONTH}, {COLUMN_NAME_SUMMARY_CATEGORY}, {COLUMN_NAME_SUMMARY_KIND}"
+    statements = [f"DELETE FROM {TABLE_NAME_MONTHLY_TOTALS}"]
+    for table_name in (TABLE_NAME_EXPENSES, TABLE_NAME_INCOMES):
+        statements.append(f"INSERT INTO {TABLE_NAME_MONTHLY_TOTALS} ({key_columns}, {COLUMN_NAME_SUMMARY_TOTAL}, {COLUMN_NAME_SUMMARY_COUNT}) "
+                          f"SELECT CAST(substr({COLUMN_NAME_ALL_DATE}, 1, 4) AS INTEGER) AS Y, CAST(substr({COLUMN_NAME_ALL_DATE}, 6, 2) AS INTEGER) AS M, "
+                          f"{COLUMN_NAME_ALL_CATEGORY}, '{table_name}', TOTAL({COLUMN_NAME_ALL_AMOUNT}), COUNT(*) "
+                          f"FROM {table_name} GROUP BY Y, M, {COLUMN_NAME_ALL_CATEGORY}")
+    return tuple(statements)
+
+# Recursive CTE naming SUBTREE the IDs of a category (first parameter) and of all its descendants
+CATEGORY_SUBTREE_WITH_CLAUSE = (f"WITH RECURSIVE SUBTREE({COLUMN_NAME_CATEGORY_ID}) AS (SELECT ? UNION "
+                                f"SELECT c.{COLUMN_NAME_CATEGORY_ID} FROM {TABLE_NAME_CATEGORIES} c JOIN SUBTREE s ON c.{COLUMN_NAME_CATEGORY_PARENT} = s.{COLUMN_NAME_CATEGORY_ID}) ")
+
+def _search_table_statements() -> Tuple[str]:
+    """Statements creating the FTS5 indexes over TITLE and NOTES, the triggers keeping them in sync and the initial build.
+    The indexes are external content tables: the text is stored only once, in the transaction tables"""
+    statements = []
+    for table_name in (TABLE_NAME_EXPENSES, TABLE_NAME_INCOMES):
+        fts_name = f"{table_name}{FTS_SUFFIX}"
+        text_columns = f"{COLUMN_NAME_ALL_TITLE}, {COLUMN_NAME_ALL_NOTES}"
+        insert_new = f"INSERT INTO {fts_name} (rowid, {text_columns}) VALUES (NEW.{COLUMN_NAME_ALL_ID}, NEW.{COLUMN_NAME_ALL_TITLE}, NEW.{COLUMN_NAME_ALL_NOTES});"
+        delete_old = (f"INSERT INTO {fts_name} ({fts_name}, rowid, {text_columns}) "
+                      f"VALUES ('delete', OLD.{COLUMN_NAME_ALL_ID}, OLD.{COLUMN_NAME_ALL_TITLE}, OLD.{COLUMN_NAME_ALL_NOTES});")
+        statements += [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts_name} USING fts5({text_columns}, content='{table_name}', "
+            f"content_rowid='{COLUMN_NAME_ALL_ID}', tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+            f"CREATE TRIGGER IF NOT EXISTS TRG_{table_name}_FTS_INSERT AFTER INSERT ON {table_name} BEGIN {insert_new} END",
+            f"CREATE TRIGGER IF NOT EXISTS TRG_{table_name}_FTS_DELETE AFTER DELETE ON {table_name} BEGIN {delete_old} END",
+            f"CREATE TRIGGER IF NOT EXISTS TRG_{table_name}_FTS_UPDATE AFTER UPDATE OF {text_columns} ON {table_name} BEGIN {delete_old} {insert_new} END",
+            f"INSERT INTO {fts_name} ({fts_name}) VALUES ('rebuild')",
+        ]
+    return tuple(statements)
+
+# Ordered schema migrations. Migration N (1-based) brings PRAGMA user_version to N.
+# Every statement shall be idempotent so that a partially upgraded file can be migrated again
+MIGRATIONS = (
+    ("Index transactions on date", (
+        f"CREATE INDEX IF NOT EXISTS IDX_{TABLE_NAME_EXPENSES}_{COLUMN_NAME_ALL_DATE} ON {TABLE_NAME_EXPENSES} ({COLUMN_NAME_ALL_DATE})",
+        f"CREATE INDEX IF NOT EXISTS IDX_{TABLE_NAME_INCOMES}_{COLUMN_NAME_ALL_DATE} ON {TABLE_NAME_INCOMES} ({COLUMN_NAME_ALL_DATE})",
+    )),
+    ("Index transactions on category and date", (
+        f"CREATE INDEX IF NOT EXISTS IDX_{TABLE_NAME_EXPENSES}_{COLUMN_NAME_ALL_CATEGORY}_{COLUMN_NAME_ALL_DATE} ON {TABLE_NAME_EXPENSES} ({COLUMN_NAME_ALL_CATEGORY}, {COLUMN_NAME_ALL_DATE})",
+        f"CREATE INDEX IF NOT EXISTS IDX_{TABLE_NAME_INCOMES}_{COLUMN_NAME_ALL_CATEGORY}_{COLUMN_NAME_ALL_DATE} ON {TABLE_NAME_INCOMES} ({COLUMN_NAME_ALL_CATEGORY}, {COLUMN_NAME_ALL_DATE})",
+    )),
+    ("Index categories on parent", (
+        f"CREATE INDEX IF NOT EXISTS IDX_{TABLE_NAME_CATEGORIES}_{COLUMN_NAME_CATEGORY_PARENT} ON {TABLE_NAME_CATEGORIES} ({COLUMN_NAME_CATEGORY_PARENT})",
+    )),
+    ("Index transactions on category and ID", (
+        f"CREATE INDEX IF NOT EXISTS IDX_{TABLE_NAME_EXPENSES}_{COLUMN_NAME_ALL_CATEGORY}_{COLUMN_NAME_ALL_ID} ON {TABLE_NAME_EXPENSES} ({COLUMN_NAME_ALL_CATEGORY}, {COLUMN_NAME_ALL_ID})",
+        f"CREATE INDEX IF NOT EXISTS IDX_{TABLE_NAME_INCOMES}_{COLUMN_NAME_ALL_CATEGORY}_{COLUMN_NAME_ALL_ID} ON {TABLE_NAME_INCOMES} ({COLUMN_NAME_ALL_CATEGORY}, {COLUMN_NAME_ALL_ID})",
+    )),
+    ("Add trigger-maintained monthly totals", _summary_table_statements()),
+    ("Add full-text search over titles and notes", _search_table_statements()),
+)
+
+# Schema versions that introduce the indexes and tables used by the latest items of a category,
+# FetchMonthlyTotals and Search
+SCHEMA_VERSION_CATEGORY_ID_INDEX = 4
+SCHEMA_VERSION_MONTHLY_TOTALS = 5
+SCHEMA_VERSION_FULL_TEXT_SEARCH = 6
+
+# Largest category subtree whose latest items are read with one index scan per category
+# (SQLite allows at most 500 terms in a compound SELECT); larger ones are filtered and sorted
+MERGED_CATEGORY_SCANS = 200
+
+pragma_value_pattern = re.compile(r"^-?[A-Za-z0-9_]+$")
+
+def _numeric_option(db_options: dict, key: str, typ: type, default):
+    """Read a non-negative number from the [database] options"""
+    value = db_options.get(key, None)
+    if value is None:
+        return default
+    try:
+        number = typ(str(value).strip())
+    except ValueError:
+        number = -1
+    if number < 0:
+        raise ValueError(f"Invalid value for {key}: {value}")
+    return number
+
+def is_locked_error(error: sqlite3.Error) -> bool:
+    """Whether error means that another connection holds a lock on the database (SQLITE_BUSY / SQLITE_LOCKED)"""
+    code = getattr(error, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xff in (5, 6)
+    message = str(error)
+    return "locked" in message or "busy" in message
+
+def init_core_module(db_path:str, db_name:str, db_options:dict=None):
     global DB_FOLDER 
     global DB_NAME 
+    global DB_AUTO_MIGRATE
+    global DB_STATEMENT_CACHE_SIZE
+    global DB_WRITE_RETRIES
+    global DB_WRITE_RETRY_DELAY
+    global DB_CHECKPOINT_INTERVAL
+    global DB_READ_CACHE_SIZE
+    global BACKUP_PAGES_PER_STEP
+    global BACKUP_STEP_SLEEP
     DB_FOLDER = db_path
     DB_NAME = db_name
+    if db_options is not None:
+        auto_migrate = db_options.get("auto_migrate", None)
+        if auto_migrate is not None:
+            DB_AUTO_MIGRATE = str(auto_migrate).strip().lower() in ("1", "yes", "true", "on")
+        DB_STATEMENT_CACHE_SIZE = _numeric_option(db_options, "statement_cache_size", int, DB_STATEMENT_CACHE_SIZE)
+        DB_WRITE_RETRIES = _numeric_option(db_options, "write_retries", int, DB_WRITE_RETRIES)
+        DB_WRITE_RETRY_DELAY = _numeric_option(db_options, "write_retry_delay", float, DB_WRITE_RETRY_DELAY)
+        DB_CHECKPOINT_INTERVAL = _numeric_option(db_options, "checkpoint_interval", float, DB_CHECKPOINT_INTERVAL)
+        DB_READ_CACHE_SIZE = _numeric_option(db_options, "read_cache_size", int, DB_READ_CACHE_SIZE)
+        BACKUP_PAGES_PER_STEP = _numeric_option(db_options, "backup_pages_per_step", int, BACKUP_PAGES_PER_STEP)
+        BACKUP_STEP_SLEEP = _numeric_option(db_options, "backup_step_sleep", float, BACKUP_STEP_SLEEP)
+        for pragma in DB_PRAGMAS:
+            value = db_options.get(pragma, None)
+            if value is None:
+                continue
+            value = str(value).strip()
+            if not pragma_value_pattern.match(value):
+                raise ValueError(f"Invalid value for {pragma}: {value}")
+            DB_PRAGMAS[pragma] = value
 
 date_pattern = re.compile(r"^\d{4}-(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01])$")
 
 def date_is_valid(date_string:str):
     return bool(date_pattern.match(date_string))
 
+def build_search_query(words: List[str], prefix: bool=False) -> str:
+    """Turn plain words into an FTS5 query matching all of them. Each word is quoted, so
+    punctuation is not interpreted as query syntax; with prefix words match as prefixes"""
+    star = "*" if prefix else ""
+    terms = []
+    for word in words:
+        for token in word.split():
+            terms.append('"' + token.replace('"', '""') + '"' + star)
+    return " ".join(terms)
+
 class FormatType(Enum):
     LIST = 1
     TREE = 2
 
+class GroupBy(Enum):
+    NONE = 1
+    CATEGORY = 2
+    MONTH = 3
+
+class Granularity(Enum):
+    DAY = 1
+    WEEK = 2
+    MONTH = 3
+    YEAR = 4
+
+# Column names of the rows returned by DB.FetchAggregate
+AGGREGATE_COLUMN_TABLE = "TABLE_NAME"
+AGGREGATE_COLUMN_GROUP = "GRP"
+AGGREGATE_COLUMN_TOTAL = "TOTAL"
+AGGREGATE_COLUMN_COUNT = "COUNT"
+
+# Column names of the rows returned by DB.FetchSeries
+SERIES_COLUMN_PERIOD = "PERIOD"
+SERIES_COLUMN_CATEGORY = "CATEGORY"
+SERIES_COLUMN_INCOMES = "INCOMES"
+SERIES_COLUMN_EXPENSES = "EXPENSES"
+SERIES_COLUMN_BALANCE = "BALANCE"
+SERIES_COLUMN_RUNNING_BALANCE = "RUNNING_BALANCE"
+
+def aggregate_query(group_by: GroupBy, schema: str="main") -> str:
+    """Query of DB.FetchAggregate on the tables of a database schema (main, or an attached database).
+    Its parameters are date_from, date_to, date_from, date_to"""
+    group_expressions = {
+        GroupBy.NONE: "NULL",
+        GroupBy.CATEGORY: COLUMN_NAME_ALL_CATEGORY,
+        GroupBy.MONTH: f"substr({COLUMN_NAME_ALL_DATE}, 1, 7)",
+    }
+    group_expression = group_expressions[group_by]
+    group_clause = "" if group_by == GroupBy.NONE else f" GROUP BY {AGGREGATE_COLUMN_GROUP}"
+    selects = []
+    for table_name in (TABLE_NAME_EXPENSES, TABLE_NAME_INCOMES):
+        selects.append(f"SELECT '{table_name}' AS {AGGREGATE_COLUMN_TABLE}, {group_expression} AS {AGGREGATE_COLUMN_GROUP}, "
+                       f"TOTAL({COLUMN_NAME_ALL_AMOUNT}) AS {AGGREGATE_COLUMN_TOTAL}, COUNT(*) AS {AGGREGATE_COLUMN_COUNT} "
+                       f"FROM {schema}.{table_name} WHERE {COLUMN_NAME_ALL_DATE} BETWEEN ? AND ?{group_clause}")
+    return " UNION ALL ".join(selects)
+
 class TableColumn:
     def __init__(self, name:str, typ:type, attributes:str):
         self._name = name
@@ -100,9 +374,13 @@ class TableColumn:
         self._attributes = value
 
 class DBTable:
+    """Table metadata. It also generates the parameterized statements used on the table:
+    the SQL text of each statement is built once and reused, so that the connection finds it
+    in its prepared statement cache"""
     def __init__(self, name:str, columns:Tuple[TableColumn]):
         self._name = name
         self._columns = columns
+        self._queries = {}
     
     @property
     def name(self) -> str:
@@ -115,46 +393,461 @@ class DBTable:
     @name.setter
     def name(self, value:str):
         self._name = value
+        self._queries.clear()
+
+    def column_names(self) -> Tuple[str]:
+        return tuple(column.name for column in self._columns)
+
+    def _column(self, name: str) -> TableColumn:
+        for column in self._columns:
+            if column.name == name:
+                return column
+        raise ValueError(f"Unknown column {name} of table {self._name}")
+
+    def _cached_query(self, key: tuple, build: Callable[[], str]) -> str:
+        query = self._queries.get(key)
+        if query is None:
+            query = self._queries[key] = build()
+        return query
+
+    def select_query(self, where_clause: str="", with_clause: str="") -> str:
+        """SELECT of all the columns. where_clause (and with_clause) must use ? placeholders for values"""
+        return self._cached_query(("SELECT", where_clause, with_clause),
+                                  lambda: f"{with_clause}SELECT {', '.join(self.column_names())} FROM {self._name}{where_clause}")
+
+    def insert_query(self, columns: Sequence[str]) -> str:
+        columns = tuple(columns)
+        for column in columns:
+            self._column(column)
+        return self._cached_query(("INSERT", columns),
+                                  lambda: f"INSERT INTO {self._name} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})")
+
+    def update_query(self, columns: Sequence[str]) -> str:
+        """UPDATE of some columns of the row with a given ID (the last parameter)"""
+        columns = tuple(columns)
+        for column in columns:
+            self._column(column)
+        return self._cached_query(("UPDATE", columns),
+                                  lambda: f"UPDATE {self._name} SET {', '.join(f'{column} = ?' for column in columns)} WHERE {COLUMN_NAME_ALL_ID} = ?")
+
+    def delete_query(self) -> str:
+        """DELETE of the row with a given ID"""
+        return self._cached_query(("DELETE",), lambda: f"DELETE FROM {self._name} WHERE {COLUMN_NAME_ALL_ID} = ?")
+
+    def bind(self, columns: Sequence[str], values: Sequence) -> tuple:
+        """Convert values to the Python type of their columns, ready to be passed as statement parameters"""
+        columns = tuple(columns)
+        values = tuple(values)
+        if len(columns) != len(values):
+            raise ValueError(f"{len(columns)} columns but {len(values)} values for table {self._name}")
+        return tuple(None if value is None else self._column(column).typ(value) for column, value in zip(columns, values))
+
+class CategoryRecord(NamedTuple):
+    """Read-only category row, built directly from the cursor"""
+    id: int
+    parent: int
+    title: str
+    description: str
+
+    @classmethod
+    def from_row(cls, cursor: sqlite3.Cursor, row: tuple) -> "CategoryRecord":
+        return cls._make(row)
+
+    def to_string(self, format:FormatType=FormatType.LIST) -> str:
+        if format == FormatType.LIST:
+            return f"{self.id:5} | {self.parent:10} | {self.title:<20} | {self.description or '':<50}"
+        elif format == FormatType.TREE:
+            return f"{self.id} | {self.title} ({self.description or ''})"
+        else:
+            return ""
+
+class TransactionRecord(NamedTuple):
+    """Read-only expense/income row, built directly from the cursor.
+    Fields follow the column order of the EXPENSES and INCOMES tables"""
+    id: int
+    category_id: int
+    amount: float
+    date: str
+    title: str
+    notes: str
+
+    @classmethod
+    def from_row(cls, cursor: sqlite3.Cursor, row: tuple) -> "TransactionRecord":
+        return cls._make(row)
+
+    def to_string(self):
+        return f"{self.id:5} | {self.category_id:5} | {self.amount:8} | {self.date:12} | {self.title or '':20} | {self.notes or ''}"
+
+class ExpenseRecord(TransactionRecord):
+    __slots__ = ()
+    table_name = TABLE_NAME_EXPENSES
+
+class IncomeRecord(TransactionRecord):
+    __slots__ = ()
+    table_name = TABLE_NAME_INCOMES
+
+# Record type returned by the fetch methods of DB for each table
+RECORD_TYPES = {
+    TABLE_NAME_CATEGORIES: CategoryRecord,
+    TABLE_NAME_EXPENSES: ExpenseRecord,
+    TABLE_NAME_INCOMES: IncomeRecord,
+}
+
+class QueryEvent:
+    """Statistics of one statement executed by DB, passed to the query callbacks"""
+    def __init__(self, sql: str, parameters):
+        self.sql = sql
+        self.parameters = parameters
+        self.execute_time = 0.0
+        self.fetch_time = 0.0
+        self.conversion_time = 0.0
+        self.rows = 0
+        self.error = None
+
+    @property
+    def total_time(self) -> float:
+        return self.execute_time + self.fetch_time
+
+class _ProfiledCursor:
+    """Cursor wrapper measuring fetch time and returned rows.
+    The event is reported once the rows are exhausted (or after fetchone)"""
+    def __init__(self, cursor: sqlite3.Cursor, event: QueryEvent, report: Callable[[QueryEvent], None]):
+        self._cursor = cursor
+        self._event = event
+        self._report = report
+        self._reported = False
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    def _finish(self):
+        if not self._reported:
+            self._reported = True
+            self._report(self._event)
+
+    def _timed_fetch(self, fetch, *args):
+        start = time.perf_counter()
+        result = fetch(*args)
+        self._event.fetch_time += time.perf_counter() - start
+        return result
+
+    def fetchone(self):
+        row = self._timed_fetch(self._cursor.fetchone)
+        if row is not None:
+            self._event.rows += 1
+        self._finish()
+        return row
+
+    def fetchmany(self, size: int):
+        rows = self._timed_fetch(self._cursor.fetchmany, size)
+        self._event.rows += len(rows)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed_fetch(self._cursor.fetchall)
+        self._event.rows += len(rows)
+        self._finish()
+        return rows
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(FETCH_BATCH_SIZE)
+            yield from rows
+            if len(rows) < FETCH_BATCH_SIZE:
+                break
+
+class QueryProfiler:
+    """Query callback collecting every event, with a printable summary per statement"""
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event: QueryEvent):
+        self.events.append(event)
+
+    def print_summary(self, file: TextIO=None, slowest: int=3):
+        """Print calls, time and rows per statement, and the query plan of the slowest statements"""
+        statements = {}
+        for event in self.events:
+            stats = statements.setdefault(event.sql, {"calls": 0, "time": 0.0, "conversion": 0.0, "rows": 0, "errors": 0, "parameters": event.parameters})
+            stats["calls"] += 1
+            stats["time"] += event.total_time
+            stats["conversion"] += event.conversion_time
+            stats["rows"] += event.rows
+            stats["errors"] += event.error is not None
+        ordered = sorted(statements.items(), key=lambda item: item[1]["time"], reverse=True)
+        total_time = sum(stats["time"] for stats in statements.values())
+        print(f"{len(self.events)} statements, {total_time * 1000:.2f} ms in the database", file=file)
+        print(f"{'CALLS':>5} | {'TIME ms':>9} | {'CONV ms':>8} | {'ROWS':>8} | STATEMENT", file=file)
+        for sql, stats in ordered:
+            error = f" ({stats['errors']} errors)" if stats["errors"] else ""
+            print(f"{stats['calls']:5} | {stats['time'] * 1000:9.2f} | {stats['conversion'] * 1000:8.2f} | {stats['rows']:8} | {' '.join(sql.split())[:120]}{error}", file=file)
+        db = DB()
+        for sql, stats in ordered[:slowest]:
+            if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+                continue
+            print(f"\nQuery plan of: {' '.join(sql.split())[:120]}", file=file)
+            try:
+                for row in db._conn.execute(f"EXPLAIN QUERY PLAN {sql}", stats["parameters"] or ()):
+                    print(f"  {row[-1]}", file=file)
+            except sqlite3.Error as e:
+                print(f"  not available: {e}", file=file)
+
+def _estimated_size(value, limit: int) -> int:
+    """Approximate memory used by a query result (containers, records, dicts and their fields).
+    The count stops as soon as it exceeds limit"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        # keys are column names shared by all the rows
+        items = value.values()
+    elif isinstance(value, (tuple, list)):
+        items = value
+    else:
+        return size
+    for item in items:
+        if size > limit:
+            break
+        size += _estimated_size(item, limit)
+    return size
+
+class ReadCache:
+    """LRU cache of query results, bounded by their estimated memory. It is bound to a validation
+    token (see DB._cache_token): a lookup with a different token, i.e. after a write by any
+    connection or process, drops every entry"""
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._token = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def validate(self, token):
+        if token != self._token:
+            self.clear()
+            self._token = token
+
+    def get(self, key) -> Tuple[bool, object]:
+        """Return (True, value) for a cached key, otherwise (False, None)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[0]
+
+    def put(self, key, value):
+        size = _estimated_size(key, self.max_size) + _estimated_size(value, self.max_size)
+        if size > self.max_size:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.size -= old[1]
+        while self._entries and self.size + size > self.max_size:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+        self._entries[key] = (value, size)
+        self.size += size
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+class PageCursor:
+    """Position in a listing for keyset pagination: rows older than before_id, newer than after_id,
+    or before a date (and, for rows of that same date, before before_date_id).
+    It is exchanged with users as an opaque token"""
+    def __init__(self, before_id: int=None, after_id: int=None, before_date: str=None, before_date_id: int=None):
+        if sum(value is not None for value in (before_id, after_id, before_date)) > 1:
+            raise ValueError("Only one of before_id, after_id and before_date can be used")
+        if before_date is not None and not date_is_valid(str(before_date)):
+            raise ValueError(f"Invalid date format: {before_date}")
+        self.before_id = before_id
+        self.after_id = after_id
+        self.before_date = None if before_date is None else str(before_date)
+        self.before_date_id = before_date_id
+
+    def encode(self) -> str:
+        if self.before_id is not None:
+            text = f"i:{self.before_id}"
+        elif self.after_id is not None:
+            text = f"a:{self.after_id}"
+        elif self.before_date is not None:
+            text = f"d:{self.before_date}:{'' if self.before_date_id is None else self.before_date_id}"
+        else:
+            text = "-"
+        return base64.urlsafe_b64encode(text.encode()).decode().rstrip("=")
+
+    @staticmethod
+    def decode(token: str) -> "PageCursor":
+        try:
+            text = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+            kind, _, value = text.partition(":")
+            if kind == "i":
+                return PageCursor(before_id=int(value))
+            elif kind == "a":
+                return PageCursor(after_id=int(value))
+            elif kind == "d":
+                day, _, record_id = value.partition(":")
+                return PageCursor(before_date=day, before_date_id=int(record_id) if record_id else None)
+            elif kind == "-":
+                return PageCursor()
+        except (ValueError, UnicodeDecodeError):
+            pass
+        raise ValueError(f"Invalid page cursor: {token}")
+
+class Page(NamedTuple):
+    """One page of a listing, newest first, with the cursors of the adjacent pages (None at the ends)"""
+    records: tuple
+    next_cursor: PageCursor
+    previous_cursor: PageCursor
+
+class MaintenanceReport:
+    """Outcome and timing of DB.Backup / DB.Compact"""
+    def __init__(self, operation: str, path: str):
+        self.operation = operation
+        self.path = path
+        self.elapsed = 0.0
+        self.pages = 0
+        self.page_size = 0
+        self.size_before = 0
+        self.size_after = 0
+
+    @property
+    def megabytes_per_second(self) -> float:
+        if self.elapsed <= 0:
+            return 0.0
+        return self.pages * self.page_size / self.elapsed / 1e6
+
+    def to_string(self) -> str:
+        return (f"{self.operation}: {self.path} | {self.pages} pages | {self.size_before / 1e6:.1f} MB -> {self.size_after / 1e6:.1f} MB"
+                f" | {self.elapsed:.2f} s ({self.megabytes_per_second:.1f} MB/s)")
+
+def _database_size(path: str) -> int:
+    """Size of a database file with its WAL"""
+    size = 0
+    for suffix in ("", "-wal"):
+        if os.path.exists(path + suffix):
+            size += os.path.getsize(path + suffix)
+    return size
+
+backup_name_pattern = re.compile(r"^(?P<stem>.+)-(?P<timestamp>\d{8}-\d{6})(-(?P<counter>\d+))?\.db$")
 
 def singleton(cls):
-    instances = {}
+    """One instance per thread: a sqlite3 connection and the transaction state kept with it
+    must not be shared by threads running at the same time (see src.aio)"""
+    local = threading.local()
     def wrapper(*args, **kwargs):
-        if cls not in instances:
-            instances[cls] = cls(*args, **kwargs)
-        return instances[cls]
+        instance = getattr(local, "instance", None)
+        if instance is None:
+            instance = local.instance = cls(*args, **kwargs)
+        return instance
     return wrapper
 
 @singleton
 class DB:
     def __init__(self):
-        self.tables = {
-            TABLE_NAME_CATEGORIES: DBTable(TABLE_NAME_CATEGORIES, (TableColumn(COLUMN_NAME_CATEGORY_ID, int, COLUMN_ATTRIBUTES_CATEGORY_ID),
-                                                                   TableColumn(COLUMN_NAME_CATEGORY_PARENT, int, COLUMN_ATTRIBUTES_CATEGORY_PARENT),
-                                                                   TableColumn(COLUMN_NAME_CATEGORY_TITLE, str, COLUMN_ATTRIBUTES_CATEGORY_TITLE),
-                                                                   TableColumn(COLUMN_NAME_CATEGORY_DESCRIPTION, str, COLUMN_ATTRIBUTES_CATEGORY_DESCRIPTION)
-            )),
-            TABLE_NAME_EXPENSES: DBTable(TABLE_NAME_EXPENSES, (TableColumn(COLUMN_NAME_EXPENSE_ID, int, COLUMN_ATTRIBUTES_EXPENSE_ID),
-                                                               TableColumn(COLUMN_NAME_EXPENSE_CATEGORY, int, COLUMN_ATTRIBUTES_EXPENSE_CATEGORY),
-                                                               TableColumn(COLUMN_NAME_EXPENSE_AMOUNT, float, COLUMN_ATTRIBUTES_EXPENSE_AMOUNT),
-                                                               TableColumn(COLUMN_NAME_EXPENSE_DATE, str, COLUMN_ATTRIBUTES_EXPENSE_DATE),
-                                                               TableColumn(COLUMN_NAME_EXPENSE_TITLE, str, COLUMN_ATTRIBUTES_EXPENSE_TITLE),
-                                                               TableColumn(COLUMN_NAME_EXPENSE_NOTES, str, COLUMN_ATTRIBUTES_EXPENSE_NOTES),
-            )),
-            TABLE_NAME_INCOMES: DBTable(TABLE_NAME_INCOMES, (TableColumn(COLUMN_NAME_INCOME_ID, int, COLUMN_ATTRIBUTES_INCOME_ID),
-                                                             TableColumn(COLUMN_NAME_INCOME_CATEGORY, int, COLUMN_ATTRIBUTES_INCOME_CATEGORY),
-                                                             TableColumn(COLUMN_NAME_INCOME_AMOUNT, float, COLUMN_ATTRIBUTES_INCOME_AMOUNT),
-                                                             TableColumn(COLUMN_NAME_INCOME_DATE, str, COLUMN_ATTRIBUTES_INCOME_DATE),
-                                                             TableColumn(COLUMN_NAME_INCOME_TITLE, str, COLUMN_ATTRIBUTES_INCOME_TITLE),
-                                                             TableColumn(COLUMN_NAME_INCOME_NOTES, str, COLUMN_ATTRIBUTES_INCOME_NOTES),
-            )),
-        }
-        # Create db file if not existing
-        if not os.path.exists(DB_FOLDER):
-            os.makedirs(DB_FOLDER)
-        if not os.path.isfile(os.path.join(DB_FOLDER, DB_NAME)):
+        self._conn = None
+        self._tables = None
+        self._query_callbacks = []
+        self._batch_depth = 0
+        self._savepoint_depth = 0
+        self._last_checkpoint = 0.0
+        self._read_cache = None
+
+    def add_query_callback(self, callback: Callable[[QueryEvent], None]):
+        """Call callback with a QueryEvent for every statement executed from now on"""
+        self._query_callbacks.append(callback)
+
+    def remove_query_callback(self, callback: Callable[[QueryEvent], None]):
+        self._query_callbacks.remove(callback)
+
+    def _report(self, event: QueryEvent):
+        for callback in self._query_callbacks:
+            callback(event)
+
+    def _execute(self, query: str, parameters=(), row_factory=None, many: bool=False):
+        """Execute a statement on the shared connection and return its cursor.
+        When query callbacks are registered the statement is timed and reported"""
+        self._connect()
+        cursor = self._conn.cursor()
+        if not self._query_callbacks:
+            cursor.row_factory = row_factory
+            if many:
+                return cursor.executemany(query, parameters)
+            return cursor.execute(query, parameters)
+        event = QueryEvent(query, None if many else parameters)
+        if row_factory is not None:
+            def timed_row_factory(cursor, row):
+                start = time.perf_counter()
+                record = row_factory(cursor, row)
+                event.conversion_time += time.perf_counter() - start
+                return record
+            cursor.row_factory = timed_row_factory
+        start = time.perf_counter()
+        try:
+            if many:
+                cursor.executemany(query, parameters)
+            else:
+                cursor.execute(query, parameters)
+        except sqlite3.Error as e:
+            event.execute_time = time.perf_counter() - start
+            event.error = str(e)
+            self._report(event)
+            raise
+        event.execute_time = time.perf_counter() - start
+        if many or cursor.description is None:
+            # statements without a result set are reported right away
+            event.rows = max(cursor.rowcount, 0)
+            self._report(event)
+            return cursor
+        return _ProfiledCursor(cursor, event, self._report)
+
+    @property
+    def tables(self) -> dict:
+        """Table metadata, built on first use"""
+        if self._tables is None:
+            self._tables = {
+                TABLE_NAME_CATEGORIES: DBTable(TABLE_NAME_CATEGORIES, (TableColumn(COLUMN_NAME_CATEGORY_ID, int, COLUMN_ATTRIBUTES_CATEGORY_ID),
+                                                                       TableColumn(COLUMN_NAME_CATEGORY_PARENT, int, COLUMN_ATTRIBUTES_CATEGORY_PARENT),
+                                                                       TableColumn(COLUMN_NAME_CATEGORY_TITLE, str, COLUMN_ATTRIBUTES_CATEGORY_TITLE),
+                                                                       TableColumn(COLUMN_NAME_CATEGORY_DESCRIPTION, str, COLUMN_ATTRIBUTES_CATEGORY_DESCRIPTION)
+                )),
+                TABLE_NAME_EXPENSES: DBTable(TABLE_NAME_EXPENSES, (TableColumn(COLUMN_NAME_EXPENSE_ID, int, COLUMN_ATTRIBUTES_EXPENSE_ID),
+                                                                   TableColumn(COLUMN_NAME_EXPENSE_CATEGORY, int, COLUMN_ATTRIBUTES_EXPENSE_CATEGORY),
+                                                                   TableColumn(COLUMN_NAME_EXPENSE_AMOUNT, float, COLUMN_ATTRIBUTES_EXPENSE_AMOUNT),
+                                                                   TableColumn(COLUMN_NAME_EXPENSE_DATE, str, COLUMN_ATTRIBUTES_EXPENSE_DATE),
+                                                                   TableColumn(COLUMN_NAME_EXPENSE_TITLE, str, COLUMN_ATTRIBUTES_EXPENSE_TITLE),
+                                                                   TableColumn(COLUMN_NAME_EXPENSE_NOTES, str, COLUMN_ATTRIBUTES_EXPENSE_NOTES),
+                )),
+                TABLE_NAME_INCOMES: DBTable(TABLE_NAME_INCOMES, (TableColumn(COLUMN_NAME_INCOME_ID, int, COLUMN_ATTRIBUTES_INCOME_ID),
+                                                                 TableColumn(COLUMN_NAME_INCOME_CATEGORY, int, COLUMN_ATTRIBUTES_INCOME_CATEGORY),
+                                                                 TableColumn(COLUMN_NAME_INCOME_AMOUNT, float, COLUMN_ATTRIBUTES_INCOME_AMOUNT),
+                                                                 TableColumn(COLUMN_NAME_INCOME_DATE, str, COLUMN_ATTRIBUTES_INCOME_DATE),
+                                                                 TableColumn(COLUMN_NAME_INCOME_TITLE, str, COLUMN_ATTRIBUTES_INCOME_TITLE),
+                                                                 TableColumn(COLUMN_NAME_INCOME_NOTES, str, COLUMN_ATTRIBUTES_INCOME_NOTES),
+                )),
+            }
+        return self._tables
+
+    def _initialize_schema(self, migrate: bool):
+        """Create the tables of an empty database and, with migrate, apply pending migrations.
+        An up-to-date database only costs one PRAGMA read"""
+        if self.SchemaVersion() == len(MIGRATIONS):
+            return
+        cursor = self._execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?", (TABLE_NAME_CATEGORIES,))
+        if cursor.fetchone()[0] == 0:
             print("Database not found. Creating a new one...")
-            # Connect attempt creates file automatically
-            self._connect()
             # Database shall be initialized with all the tables
             for table_name, table_value in self.tables.items():
                 query = f"CREATE TABLE IF NOT EXISTS \"{table_name}\" (\n"
@@ -163,133 +856,752 @@ class DB:
                     query += f"\"{table_column.name}\" {table_column.attributes},\n"
                 query += f"PRIMARY KEY(\"{COLUMN_NAME_ALL_ID}\" AUTOINCREMENT)\n"
                 query += ");"
-                cursor = self._conn.cursor()
                 print(query)
-                cursor.execute(query)
-            self._conn.commit()
-            self._close()
+                self._execute(query)
+            self._commit()
+        if migrate:
+            self.Migrate()
 
-    def _connect(self):
-        self._conn = sqlite3.connect(os.path.join(DB_FOLDER,DB_NAME))
+    def _connect(self, migrate: bool=None) -> sqlite3.Connection:
+        """Return the shared connection, opening it, applying the pragmas and initializing the schema on first use.
+        Pending migrations are applied when it is opened if migrate (default: auto_migrate) is set"""
+        global FIRST_QUERY_TIME
+        if self._conn is None:
+            if FIRST_QUERY_TIME is None:
+                FIRST_QUERY_TIME = time.perf_counter()
+            db_file = os.path.join(DB_FOLDER, DB_NAME)
+            try:
+                self._conn = sqlite3.connect(db_file, cached_statements=DB_STATEMENT_CACHE_SIZE, check_same_thread=False)
+            except sqlite3.OperationalError:
+                # the folder of a new database may not exist yet
+                os.makedirs(DB_FOLDER, exist_ok=True)
+                self._conn = sqlite3.connect(db_file, cached_statements=DB_STATEMENT_CACHE_SIZE, check_same_thread=False)
+            for pragma, value in DB_PRAGMAS.items():
+                self._conn.execute(f"PRAGMA {pragma} = {value}")
+            atexit.register(self._close)
+            self._last_checkpoint = time.monotonic()
+            self._initialize_schema(DB_AUTO_MIGRATE if migrate is None else migrate)
+        return self._conn
     
     def _close(self):
-        self._conn.close()
+        """Close the shared connection. It is reopened by the next _connect()"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+            atexit.unregister(self._close)
     
-    def getColumnsAsStrings(self, table_name: str) -> Tuple[str]:
-        if table_name in self.tables:
-            db_table = self.tables[table_name]
-            column_strings = []
-            for column_obj in db_table.columns:
-                column_strings.append(column_obj.name)
-            return tuple(column_strings)
+    def Open(self, migrate: bool=None):
+        """Open the connection now. With migrate=False pending migrations are left to Migrate(),
+        e.g. to report them first. No effect if the connection is already open"""
+        self._connect(migrate)
+
+    def SchemaVersion(self) -> int:
+        """Return the schema version stored in PRAGMA user_version"""
+        self._connect()
+        return self._execute("PRAGMA user_version").fetchone()[0]
+
+    # transaction control goes through _execute too, so that --profile shows
+    # the wait for the write lock (BEGIN IMMEDIATE) and the sync of COMMIT
+    def _commit(self):
+        if self._conn.in_transaction:
+            self._execute("COMMIT")
+
+    def _rollback(self):
+        if self._conn.in_transaction:
+            self._execute("ROLLBACK")
+
+    def BeginBatch(self):
+        """Start grouping writes: every Transaction() until EndBatch() becomes a savepoint
+        of a single outer transaction, opened by the first of them. Batches can be nested"""
+        self._connect()
+        self._batch_depth += 1
+
+    def EndBatch(self, commit: bool=True):
+        """Close a batch. The outer transaction is committed (or rolled back) when the outermost batch ends"""
+        if self._batch_depth == 0:
+            raise ValueError("No batch in progress")
+        self._batch_depth -= 1
+        if self._batch_depth == 0 and self._conn.in_transaction:
+            if commit:
+                self._commit()
+                self._checkpoint_if_due()
+            else:
+                self._rollback()
+
+    @contextmanager
+    def Batch(self):
+        """Group all the writes of the block in one transaction, rolled back if the block raises"""
+        self.BeginBatch()
+        try:
+            yield self
+        except BaseException:
+            self.EndBatch(commit=False)
+            raise
+        self.EndBatch(commit=True)
+
+    @contextmanager
+    def Transaction(self, immediate: bool=True):
+        """Run the block atomically. Outside a batch it is a transaction committed at the end;
+        inside a batch (or another Transaction) it is a savepoint released into the outer transaction.
+        A transaction opened here is a write transaction: BEGIN IMMEDIATE takes the write lock up front
+        (waiting up to busy_timeout), so a writer never fails halfway when upgrading a read lock.
+        With immediate=False it is deferred, for blocks that may only read"""
+        self._connect()
+        if self._batch_depth == 0 and self._savepoint_depth == 0:
+            self._execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            self._savepoint_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._rollback()
+                raise
+            else:
+                self._commit()
+            finally:
+                self._savepoint_depth -= 1
+            return
+        if not self._conn.in_transaction:
+            # first write of a batch
+            self._execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        self._savepoint_depth += 1
+        name = f"SP{self._savepoint_depth}"
+        self._execute(f"SAVEPOINT {name}")
+        try:
+            yield self
+        except BaseException:
+            self._execute(f"ROLLBACK TO {name}")
+            self._execute(f"RELEASE {name}")
+            raise
         else:
-            raise ValueError(f"Unknown table {table_name}")
+            self._execute(f"RELEASE {name}")
+        finally:
+            self._savepoint_depth -= 1
 
-    def Create(self, table_name: str, columns: List[str], values: List[str]):
+    def _write(self, work: Callable[[], object]):
+        """Run work() in a Transaction and return its result. If the database stays locked by other
+        connections beyond busy_timeout and no transaction was already open, the whole transaction
+        is retried with exponential backoff; the last error is raised, never swallowed"""
+        delay = DB_WRITE_RETRY_DELAY
+        attempt = 0
+        while True:
+            try:
+                with self.Transaction():
+                    result = work()
+                break
+            except sqlite3.OperationalError as e:
+                if attempt >= DB_WRITE_RETRIES or not is_locked_error(e) or self._conn.in_transaction:
+                    raise
+            attempt += 1
+            time.sleep(delay * random.uniform(1.0, 1.5))
+            delay *= 2
+        if not self._conn.in_transaction:
+            self._checkpoint_if_due()
+        return result
+
+    def Checkpoint(self, mode: str="PASSIVE") -> Tuple[int, int, int]:
+        """Copy the WAL content into the database file. PASSIVE never waits for other connections,
+        FULL/RESTART/TRUNCATE wait for them (up to busy_timeout) to checkpoint everything.
+        Return (busy, WAL frames, checkpointed frames) as reported by PRAGMA wal_checkpoint"""
+        mode = mode.upper()
+        if mode not in CHECKPOINT_MODES:
+            raise ValueError(f"Invalid checkpoint mode: {mode}")
+        self._connect()
+        busy, log_frames, checkpointed = self._execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        self._last_checkpoint = time.monotonic()
+        return busy, log_frames, checkpointed
+
+    def _checkpoint_if_due(self):
+        """Run a PASSIVE checkpoint when DB_CHECKPOINT_INTERVAL seconds passed since the last one"""
+        if DB_CHECKPOINT_INTERVAL <= 0 or time.monotonic() - self._last_checkpoint < DB_CHECKPOINT_INTERVAL:
+            return
         try:
-            if len(columns) != len(values):
-                #todo: throw error
-                pass
-            self._connect()
-            serialized_columns = ', '.join(columns)
-            serialized_values = ', '.join(f"'{value}'" for value in values)
-            query = f"INSERT INTO {table_name} ({serialized_columns}) VALUES ({serialized_values})"
-            cursor = self._conn.cursor()
-            cursor.execute(query)
-            self._conn.commit()
-            self._close()
+            self.Checkpoint()
+        except sqlite3.Error as e:
+            print(f"Error: {e}")
+
+    def DataVersion(self) -> Tuple[int, int]:
+        """Return a token that changes whenever the database content changes, either through
+        this connection (total_changes) or through other connections (PRAGMA data_version)"""
+        self._connect()
+        return (self._execute("PRAGMA data_version").fetchone()[0], self._conn.total_changes)
+
+    def _cache_token(self) -> tuple:
+        """Validation token of the read cache: data version plus modification time of the database
+        file and of its WAL, so that writes of other processes (or a replaced file) are noticed"""
+        db_file = os.path.join(DB_FOLDER, DB_NAME)
+        mtimes = []
+        for suffix in ("", "-wal"):
+            try:
+                mtimes.append(os.stat(db_file + suffix).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return self.DataVersion() + tuple(mtimes)
+
+    @property
+    def read_cache(self) -> ReadCache:
+        if self._read_cache is None:
+            self._read_cache = ReadCache(DB_READ_CACHE_SIZE)
+        return self._read_cache
+
+    def _cached_read(self, key: tuple, read: Callable[[], tuple]) -> tuple:
+        """Return read(), or its result stored under key by a previous call if the database did not change since then"""
+        if DB_READ_CACHE_SIZE <= 0:
+            return read()
+        cache = self.read_cache
+        cache.validate(self._cache_token())
+        found, value = cache.get(key)
+        if not found:
+            value = read()
+            cache.put(key, value)
+        return value
+
+    def _dict_rows(self, query: str, parameters: tuple, columns_tuple: Tuple[str]=None) -> List[dict]:
+        """Run a cached query and return its rows as dicts keyed by columns_tuple (default: the result column names)"""
+        def read() -> tuple:
+            cursor = self._execute(query, parameters)
+            columns = columns_tuple or tuple(description[0] for description in cursor.description)
+            return tuple(dict(zip(columns, record_tuple)) for record_tuple in cursor)
+        # the cached dicts are shared, callers get copies
+        return [dict(row) for row in self._cached_read((query, parameters, columns_tuple), read)]
+
+    def PendingMigrations(self) -> List[Tuple[int, str]]:
+        """Return (version, description) of the migrations not yet applied"""
+        current_version = self.SchemaVersion()
+        return [(version, description) for version, (description, _) in enumerate(MIGRATIONS, start=1) if version > current_version]
+
+    def Migrate(self) -> List[Tuple[int, str]]:
+        """Apply the pending migrations in order, each one in its own transaction.
+        Return the applied migrations"""
+        applied = []
+        for version, description in self.PendingMigrations():
+            _, statements = MIGRATIONS[version - 1]
+            with self.Transaction():
+                for statement in statements:
+                    self._execute(statement)
+                self._execute(f"PRAGMA user_version = {version}")
+            applied.append((version, description))
+        return applied
+
+    def _table(self, table_name: str) -> DBTable:
+        if table_name in self.tables:
+            return self.tables[table_name]
+        raise ValueError(f"Unknown table {table_name}")
+
+    def getColumnsAsStrings(self, table_name: str) -> Tuple[str]:
+        return self._table(table_name).column_names()
+
+    def Create(self, table_name: str, columns: List[str], values: List[str]) -> int:
+        """Insert one row and return its ID (None on error)"""
+        db_table = self._table(table_name)
+        query = db_table.insert_query(columns)
+        parameters = db_table.bind(columns, values)
+        try:
+            return self._write(lambda: self._execute(query, parameters).lastrowid)
 
         except sqlite3.Error as e:
             print(f"Error: {e}")
+            return None
 
-        finally:
-            pass
-    
-    def FetchAll(self, table_name: str) -> List[dict]:
+    def Update(self, table_name: str, id: int, columns: List[str], values: List[str]) -> bool:
+        """Change some columns of the row with the given ID. Return whether the row exists"""
+        db_table = self._table(table_name)
+        query = db_table.update_query(columns)
+        parameters = db_table.bind(columns, values) + (int(id),)
         try:
-            self._connect()
-            columns_tuple = self.getColumnsAsStrings(table_name)
-            serialized_columns = ", ".join(columns_tuple)
-            query = f"SELECT {serialized_columns} FROM {table_name}"
-            cursor = self._conn.cursor()
-            cursor.execute(query)
-            records = cursor.fetchall()
-            self._close()
-            # transform into a list of dictionaries where each key has the column name
-            records_dicts = []
-            for record_tuple in records:
-                record_dict = dict()
-                i = 0
-                for column in columns_tuple:
-                    record_dict[column] = record_tuple[i]
-                    i += 1
-                records_dicts.append(record_dict)
-            return records_dicts
+            return self._write(lambda: self._execute(query, parameters).rowcount > 0)
+
+        except sqlite3.Error as e:
+            print(f"Error: {e}")
+            return False
+
+    def Delete(self, table_name: str, id: int) -> bool:
+        """Delete the row with the given ID. Return whether the row existed"""
+        query = self._table(table_name).delete_query()
+        try:
+            return self._write(lambda: self._execute(query, (int(id),)).rowcount > 0)
+
+        except sqlite3.Error as e:
+            print(f"Error: {e}")
+            return False
+
+    def CreateMany(self, table_name: str, columns: List[str], rows: Iterable[Sequence], chunk_size: int=IMPORT_CHUNK_SIZE,
+                   on_error: Callable[[int, sqlite3.Error], None]=None) -> int:
+        """Insert rows with executemany, committing one transaction (or savepoint, inside a batch) every chunk_size rows.
+        Rows are consumed lazily, so any iterable (e.g. a generator over a file) can be used.
+        If a chunk fails (other than by a lock) and on_error is given, its rows are inserted one by one
+        and on_error(index of the row in rows, error) is called for each rejected one; otherwise the error is raised.
+        Return the number of inserted rows"""
+        if chunk_size <= 0:
+            raise ValueError(f"Invalid chunk size: {chunk_size}")
+        query = self._table(table_name).insert_query(columns)
+        inserted = 0
+        start = 0
+        rows_iter = iter(rows)
+        while True:
+            chunk = list(islice(rows_iter, chunk_size))
+            if not chunk:
+                break
+            try:
+                self._write(lambda: self._execute(query, chunk, many=True))
+                inserted += len(chunk)
+            except sqlite3.Error as e:
+                if on_error is None or is_locked_error(e):
+                    raise
+                for offset, row in enumerate(chunk):
+                    try:
+                        self._write(lambda: self._execute(query, row))
+                        inserted += 1
+                    except sqlite3.Error as row_error:
+                        if is_locked_error(row_error):
+                            raise
+                        on_error(start + offset, row_error)
+            start += len(chunk)
+        return inserted
+
+    def _record_cursor(self, table_name: str, where_clause: str, parameters: tuple, with_clause: str="") -> sqlite3.Cursor:
+        """Execute a SELECT of all the table columns and return a cursor that builds records directly from rows"""
+        record_type = RECORD_TYPES[table_name]
+        query = self._table(table_name).select_query(where_clause, with_clause)
+        return self._execute(query, parameters, record_type.from_row)
+
+    def _fetch(self, table_name: str, where_clause: str, parameters: tuple, with_clause: str="", cached: bool=False) -> list:
+        try:
+            if cached:
+                key = (self._table(table_name).select_query(where_clause, with_clause), parameters)
+                read = lambda: tuple(self._record_cursor(table_name, where_clause, parameters, with_clause).fetchall())
+                return list(self._cached_read(key, read))
+            return self._record_cursor(table_name, where_clause, parameters, with_clause).fetchall()
 
         except sqlite3.Error as e:
             print(f"Error: {e}")
             return []
 
-        finally:
-            pass
+    def FetchAll(self, table_name: str) -> list:
+        """Return all the records of a specific DB table"""
+        return self._fetch(table_name, "", (), cached=True)
+
+    def FetchId(self, table_name: str, id: int):
+        """Return the record with the given ID, or None"""
+        records = self._fetch(table_name, f" WHERE {COLUMN_NAME_ALL_ID} = ?", (int(id),))
+        return records[0] if records else None
     
-    def FetchDate(self, table_name:str, date_from: str, date_to: str) -> List[dict]:
-        """Return items from a specific DB table within from_date and to_date"""
+    def FetchDate(self, table_name:str, date_from: str, date_to: str) -> list:
+        """Return records from a specific DB table within from_date and to_date"""
+        where_clause = f" WHERE {COLUMN_NAME_ALL_DATE} BETWEEN ? AND ?"
+        return self._fetch(table_name, where_clause, (str(date_from), str(date_to)), cached=True)
+
+    def _number_query(self, table_name: str, number: int, category_id: int=None) -> Tuple[str, str, tuple]:
+        """Return with clause, where clause and parameters selecting the latest "number" items,
+        optionally restricted to a category and all its descendants"""
+        if category_id is None:
+            return "", f" ORDER BY {COLUMN_NAME_ALL_ID} DESC LIMIT ?", (int(number),)
+        category_ids = sorted(CategoryTree.Cached().subtree_ids(int(category_id)))
+        if len(category_ids) <= MERGED_CATEGORY_SCANS and self.SchemaVersion() >= SCHEMA_VERSION_CATEGORY_ID_INDEX:
+            # CATEGORY IN (subtree) ORDER BY ID sorts every item of the subtree in a temp B-tree.
+            # Each category is instead scanned backwards on its (CATEGORY, ID) index and SQLite merges
+            # the scans of the compound SELECT in ID order, so LIMIT stops them after "number" rows
+            scan = f"SELECT {COLUMN_NAME_ALL_ID} FROM {table_name} WHERE {COLUMN_NAME_ALL_CATEGORY} = ?"
+            where_clause = (f" WHERE {COLUMN_NAME_ALL_ID} IN ({' UNION ALL '.join([scan] * len(category_ids))}"
+                            f" ORDER BY {COLUMN_NAME_ALL_ID} DESC LIMIT ?) ORDER BY {COLUMN_NAME_ALL_ID} DESC")
+            return "", where_clause, tuple(category_ids) + (int(number),)
+        with_clause = CATEGORY_SUBTREE_WITH_CLAUSE
+        where_clause = (f" WHERE {COLUMN_NAME_ALL_CATEGORY} IN (SELECT {COLUMN_NAME_CATEGORY_ID} FROM SUBTREE)"
+                        f" ORDER BY {COLUMN_NAME_ALL_ID} DESC LIMIT ?")
+        return with_clause, where_clause, (int(category_id), int(number))
+
+    def Search(self, table_name: str, text_query: str, date_from: str=None, date_to: str=None, category_id: int=None, number: int=20) -> list:
+        """Return the records whose title or notes match an FTS5 query, best matches first.
+        The search can be restricted to a date interval and to a category with its descendants"""
+        if table_name not in (TABLE_NAME_EXPENSES, TABLE_NAME_INCOMES):
+            raise ValueError(f"Table {table_name} not recognized")
+        if self.SchemaVersion() < SCHEMA_VERSION_FULL_TEXT_SEARCH:
+            raise ValueError("Full-text search needs the latest database schema: run \"expman db migrate\"")
+        fts_name = f"{table_name}{FTS_SUFFIX}"
+        columns_tuple = self.getColumnsAsStrings(table_name)
+        serialized_columns = ", ".join(f"t.{column}" for column in columns_tuple)
+        with_clause = ""
+        parameters = []
+        if category_id is not None:
+            with_clause = CATEGORY_SUBTREE_WITH_CLAUSE
+            parameters.append(int(category_id))
+        where_clause = f" WHERE {fts_name} MATCH ?"
+        parameters.append(text_query)
+        if date_from is not None:
+            where_clause += f" AND t.{COLUMN_NAME_ALL_DATE} >= ?"
+            parameters.append(str(date_from))
+        if date_to is not None:
+            where_clause += f" AND t.{COLUMN_NAME_ALL_DATE} <= ?"
+            parameters.append(str(date_to))
+        if category_id is not None:
+            where_clause += f" AND t.{COLUMN_NAME_ALL_CATEGORY} IN (SELECT {COLUMN_NAME_CATEGORY_ID} FROM SUBTREE)"
+        parameters.append(int(number))
+        query = (f"{with_clause}SELECT {serialized_columns} FROM {fts_name} f JOIN {table_name} t ON t.{COLUMN_NAME_ALL_ID} = f.rowid"
+                 f"{where_clause} ORDER BY f.rank LIMIT ?")
         try:
-            self._connect()
-            columns_tuple = self.getColumnsAsStrings(table_name)
-            serialized_columns = ", ".join(columns_tuple)
-            query = f"SELECT {serialized_columns} FROM {table_name} WHERE {COLUMN_NAME_ALL_DATE} BETWEEN '{date_from}' AND '{date_to}'"
-            cursor = self._conn.cursor()
-            cursor.execute(query)
-            records = cursor.fetchall()
-            self._close()
-            # transform into a list of dictionaries where each key has the column name
-            records_dicts = []
-            for record_tuple in records:
-                record_dict = dict()
-                i = 0
-                for column in columns_tuple:
-                    record_dict[column] = record_tuple[i]
-                    i += 1
-                records_dicts.append(record_dict)
-            return records_dicts
+            return self._execute(query, tuple(parameters), RECORD_TYPES[table_name].from_row).fetchall()
 
         except sqlite3.Error as e:
             print(f"Error: {e}")
             return []
 
-        finally:
-            pass
+    def FetchSeries(self, date_from: str, date_to: str, granularity: Granularity, by_category: bool=False) -> List[dict]:
+        """Return incomes, expenses, balance and running balance per period (and optionally per category)
+        within date_from and date_to, computed with a single grouped query over both tables.
+        Periods are keyed as yyyy-mm-dd (day), Monday yyyy-mm-dd (week), yyyy-mm (month) or yyyy (year).
+        Periods without transactions are not returned"""
+        period_expressions = {
+            Granularity.DAY: COLUMN_NAME_ALL_DATE,
+            Granularity.WEEK: f"date({COLUMN_NAME_ALL_DATE}, '-6 days', 'weekday 1')",
+            Granularity.MONTH: f"substr({COLUMN_NAME_ALL_DATE}, 1, 7)",
+            Granularity.YEAR: f"substr({COLUMN_NAME_ALL_DATE}, 1, 4)",
+        }
+        period_expression = period_expressions[granularity]
+        category_column = f", {COLUMN_NAME_ALL_CATEGORY} AS {SERIES_COLUMN_CATEGORY}" if by_category else ""
+        group_columns = f"{SERIES_COLUMN_PERIOD}, {SERIES_COLUMN_CATEGORY}" if by_category else SERIES_COLUMN_PERIOD
+        partition = f"PARTITION BY {SERIES_COLUMN_CATEGORY} " if by_category else ""
+        query = (f"WITH T AS ("
+                 f"SELECT {period_expression} AS {SERIES_COLUMN_PERIOD}{category_column}, 0 AS INC, {COLUMN_NAME_ALL_AMOUNT} AS EXP "
+                 f"FROM {TABLE_NAME_EXPENSES} WHERE {COLUMN_NAME_ALL_DATE} BETWEEN ? AND ? "
+                 f"UNION ALL "
+                 f"SELECT {period_expression} AS {SERIES_COLUMN_PERIOD}{category_column}, {COLUMN_NAME_ALL_AMOUNT} AS INC, 0 AS EXP "
+                 f"FROM {TABLE_NAME_INCOMES} WHERE {COLUMN_NAME_ALL_DATE} BETWEEN ? AND ?) "
+                 f"SELECT {group_columns}, TOTAL(INC) AS {SERIES_COLUMN_INCOMES}, TOTAL(EXP) AS {SERIES_COLUMN_EXPENSES}, "
+                 f"TOTAL(INC) - TOTAL(EXP) AS {SERIES_COLUMN_BALANCE}, "
+                 f"SUM(TOTAL(INC) - TOTAL(EXP)) OVER ({partition}ORDER BY {SERIES_COLUMN_PERIOD} ROWS UNBOUNDED PRECEDING) AS {SERIES_COLUMN_RUNNING_BALANCE} "
+                 f"FROM T GROUP BY {group_columns} ORDER BY {group_columns}")
+        try:
+            return self._dict_rows(query, (str(date_from), str(date_to)) * 2)
+
+        except sqlite3.Error as e:
+            print(f"Error: {e}")
+            return []
+
+    def _check_no_transaction(self, operation: str):
+        if self._connect().in_transaction:
+            raise ValueError(f"{operation} cannot run inside a transaction")
+
+    def Backup(self, target: str, pages: int=None, sleep: float=None, progress: Callable[[int, int], None]=None) -> MaintenanceReport:
+        """Copy the database to target with the sqlite3 online backup API, "pages" pages per step and
+        a pause of "sleep" seconds between steps, so writers are never blocked for long. Every step
+        is a short read; if another process writes meanwhile SQLite restarts the copy, which stays
+        consistent. The copy is written next to target and renamed when complete.
+        progress(remaining, total) is called after every step"""
+        self._check_no_transaction("Backup")
+        pages = BACKUP_PAGES_PER_STEP if pages is None else pages
+        sleep = BACKUP_STEP_SLEEP if sleep is None else sleep
+        if sleep < 0:
+            raise ValueError(f"Invalid backup sleep: {sleep}")
+        if os.path.exists(target):
+            raise ValueError(f"Backup target already exists: {target}")
+        report = MaintenanceReport("backup", target)
+        report.size_before = _database_size(os.path.join(DB_FOLDER, DB_NAME))
+        partial = target + ".partial"
+        start = time.perf_counter()
+        def step(status, remaining, total):
+            report.pages = total
+            if progress is not None:
+                progress(remaining, total)
+            if sleep > 0 and remaining > 0:
+                time.sleep(sleep)
+        destination = sqlite3.connect(partial)
+        try:
+            self._conn.backup(destination, pages=pages, progress=step)
+            destination.execute("PRAGMA journal_mode = DELETE")
+        except BaseException:
+            destination.close()
+            os.remove(partial)
+            raise
+        destination.close()
+        os.replace(partial, target)
+        report.elapsed = time.perf_counter() - start
+        report.page_size = self._execute("PRAGMA page_size").fetchone()[0]
+        report.size_after = os.path.getsize(target)
+        return report
+
+    def RotateBackups(self, folder: str, keep: int) -> List[str]:
+        """Delete all but the "keep" newest backups of this database in folder (named <name>-yyyymmdd-HHMMSS.db).
+        Return the deleted files"""
+        if keep < 1:
+            raise ValueError(f"Invalid number of backups to keep: {keep}")
+        stem = os.path.splitext(DB_NAME)[0]
+        backups = []
+        for file_name in os.listdir(folder):
+            match = backup_name_pattern.match(file_name)
+            if match is not None and match.group("stem") == stem:
+                # same-second backups get a counter: -1 is newer than none
+                backups.append((match.group("timestamp"), int(match.group("counter") or 0), file_name))
+        removed = [os.path.join(folder, file_name) for _, _, file_name in sorted(backups)[:-keep]]
+        for path in removed:
+            os.remove(path)
+        return removed
+
+    def BackupPath(self, folder: str) -> str:
+        """Path of a new timestamped backup in folder"""
+        stem = os.path.splitext(DB_NAME)[0]
+        path = os.path.join(folder, f"{stem}-{time.strftime('%Y%m%d-%H%M%S')}.db")
+        counter = 1
+        while os.path.exists(path):
+            path = os.path.join(folder, f"{stem}-{time.strftime('%Y%m%d-%H%M%S')}-{counter}.db")
+            counter += 1
+        return path
+
+    def Compact(self, into: str=None, pages: int=0) -> MaintenanceReport:
+        """Reclaim free pages. With "into" a compacted copy is written with VACUUM INTO (a single read
+        transaction: writers go on). Otherwise, on a database in incremental auto-vacuum mode, up to
+        "pages" free pages (0: all) are released with PRAGMA incremental_vacuum, which is quick; the
+        first time a full VACUUM switches the database to that mode, blocking writers while it runs"""
+        self._check_no_transaction("Compact")
+        db_file = os.path.join(DB_FOLDER, DB_NAME)
+        report = MaintenanceReport("compact", into or db_file)
+        report.page_size = self._execute("PRAGMA page_size").fetchone()[0]
+        report.size_before = _database_size(db_file)
+        start = time.perf_counter()
+        if into is not None:
+            if os.path.exists(into):
+                raise ValueError(f"Compact target already exists: {into}")
+            report.pages = self._execute("PRAGMA page_count").fetchone()[0] - self._execute("PRAGMA freelist_count").fetchone()[0]
+            self._execute("VACUUM INTO ?", (into,))
+            report.size_after = os.path.getsize(into)
+        else:
+            free_pages = self._execute("PRAGMA freelist_count").fetchone()[0]
+            if self._execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                self._execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+                report.operation = "incremental vacuum"
+            else:
+                self._execute("PRAGMA auto_vacuum = INCREMENTAL")
+                self._execute("VACUUM")
+                report.operation = "vacuum"
+            report.pages = free_pages - self._execute("PRAGMA freelist_count").fetchone()[0]
+            self.Checkpoint("TRUNCATE")
+            report.size_after = _database_size(db_file)
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    def RebuildSummaries(self):
+        """Recompute MONTHLY_TOTALS from the transaction tables in a single transaction"""
+        def rebuild():
+            for statement in _summary_rebuild_statements():
+                self._execute(statement)
+        self._write(rebuild)
+
+    def FetchMonthlyTotals(self, date_from: str, date_to: str, group_by: GroupBy=GroupBy.NONE) -> List[dict]:
+        """Same result as FetchAggregate, but whole months are read from MONTHLY_TOTALS.
+        Only the partial months at the edges of the interval are aggregated from the transaction tables"""
+        date_from = date.fromisoformat(str(date_from))
+        date_to = date.fromisoformat(str(date_to))
+        if date_from > date_to or self.SchemaVersion() < SCHEMA_VERSION_MONTHLY_TOTALS:
+            # MONTHLY_TOTALS does not exist until the database is migrated (auto_migrate = no)
+            return self.FetchAggregate(date_from, date_to, group_by)
+        first_full_month = date_from if date_from.day == 1 else date(date_from.year + date_from.month // 12, date_from.month % 12 + 1, 1)
+        last_full_day = date_to if (date_to + timedelta(days=1)).day == 1 else date_to.replace(day=1) - timedelta(days=1)
+        partial_intervals = []
+        if first_full_month > last_full_day:
+            partial_intervals.append((date_from, date_to))
+        else:
+            if date_from < first_full_month:
+                partial_intervals.append((date_from, first_full_month - timedelta(days=1)))
+            if last_full_day < date_to:
+                partial_intervals.append((last_full_day + timedelta(days=1), date_to))
+
+        merged = {}
+        if group_by == GroupBy.NONE:
+            for table_name in (TABLE_NAME_EXPENSES, TABLE_NAME_INCOMES):
+                merged[(table_name, None)] = [0.0, 0]
+        rows = []
+        for interval_from, interval_to in partial_intervals:
+            rows += self.FetchAggregate(interval_from, interval_to, group_by)
+        if first_full_month <= last_full_day:
+            group_expressions = {
+                GroupBy.NONE: "NULL",
+                GroupBy.CATEGORY: COLUMN_NAME_SUMMARY_CATEGORY,
+                GroupBy.MONTH: f"printf('%04d-%02d', {COLUMN_NAME_SUMMARY_YEAR}, {COLUMN_NAME_SUMMARY_MONTH})",
+            }
+            query = (f"SELECT {COLUMN_NAME_SUMMARY_KIND}, {group_expressions[group_by]} AS {AGGREGATE_COLUMN_GROUP}, "
+                     f"TOTAL({COLUMN_NAME_SUMMARY_TOTAL}), TOTAL({COLUMN_NAME_SUMMARY_COUNT}) FROM {TABLE_NAME_MONTHLY_TOTALS} "
+                     f"WHERE ({COLUMN_NAME_SUMMARY_YEAR}, {COLUMN_NAME_SUMMARY_MONTH}) BETWEEN (?, ?) AND (?, ?) "
+                     f"GROUP BY {COLUMN_NAME_SUMMARY_KIND}, {AGGREGATE_COLUMN_GROUP}")
+            columns_tuple = (AGGREGATE_COLUMN_TABLE, AGGREGATE_COLUMN_GROUP, AGGREGATE_COLUMN_TOTAL, AGGREGATE_COLUMN_COUNT)
+            try:
+                rows += self._dict_rows(query, (first_full_month.year, first_full_month.month, last_full_day.year, last_full_day.month), columns_tuple)
+
+            except sqlite3.Error as e:
+                print(f"Error: {e}")
+        for row in rows:
+            totals = merged.setdefault((row[AGGREGATE_COLUMN_TABLE], row[AGGREGATE_COLUMN_GROUP]), [0.0, 0])
+            totals[0] += row[AGGREGATE_COLUMN_TOTAL]
+            totals[1] += int(row[AGGREGATE_COLUMN_COUNT])
+        return [{AGGREGATE_COLUMN_TABLE: table_name, AGGREGATE_COLUMN_GROUP: group, AGGREGATE_COLUMN_TOTAL: total, AGGREGATE_COLUMN_COUNT: count}
+                for (table_name, group), (total, count) in merged.items()]
+
+    def FetchNumber(self, table_name:str, number:int, category_id: int=None) -> list:
+        """Return a specific number of records, ordered by ID descending.
+        If category_id is given only that category and its descendants are considered"""
+        with_clause, where_clause, parameters = self._number_query(table_name, number, category_id)
+        return self._fetch(table_name, where_clause, parameters, with_clause)
     
-    def FetchNumber(self, table_name:str, number:int) -> List[dict]:
-        """Return a specific number of items, ordered by ID descending"""
+    def _exists(self, table_name: str, listing: tuple, condition: str, value, with_clause: str="") -> bool:
+        """Whether the listing (conditions, parameters) has a row that also matches condition on value"""
+        conditions, parameters = listing
+        where_clause = " AND ".join(conditions + (condition,))
+        query = f"{with_clause}SELECT EXISTS (SELECT 1 FROM {table_name} WHERE {where_clause})"
+        try:
+            return bool(self._execute(query, parameters + (value,)).fetchone()[0])
+
+        except sqlite3.Error as e:
+            print(f"Error: {e}")
+            return False
+
+    def FetchPage(self, table_name: str, number: int, cursor: PageCursor=None, category_id: int=None) -> Page:
+        """Return one page of at most "number" records, newest first, using keyset pagination:
+        the position is a condition on the ID (or on DATETIME, ID) index, so every page costs the same
+        regardless of how far back it is"""
+        cursor = cursor or PageCursor()
+        with_clause = ""
+        conditions = []
+        parameters = []
+        if category_id is not None:
+            with_clause = CATEGORY_SUBTREE_WITH_CLAUSE
+            parameters.append(int(category_id))
+            conditions.append(f"{COLUMN_NAME_ALL_CATEGORY} IN (SELECT {COLUMN_NAME_CATEGORY_ID} FROM SUBTREE)")
+        # the listing without the position, to look for rows beyond the other end of the page
+        listing = (tuple(conditions), tuple(parameters))
+        by_date = cursor.before_date is not None
+        ascending = cursor.after_id is not None
+        if cursor.before_id is not None:
+            conditions.append(f"{COLUMN_NAME_ALL_ID} < ?")
+            parameters.append(int(cursor.before_id))
+        elif ascending:
+            conditions.append(f"{COLUMN_NAME_ALL_ID} > ?")
+            parameters.append(int(cursor.after_id))
+        elif by_date and cursor.before_date_id is not None:
+            conditions.append(f"({COLUMN_NAME_ALL_DATE}, {COLUMN_NAME_ALL_ID}) < (?, ?)")
+            parameters += [cursor.before_date, int(cursor.before_date_id)]
+        elif by_date:
+            conditions.append(f"{COLUMN_NAME_ALL_DATE} < ?")
+            parameters.append(cursor.before_date)
+        where_clause = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+        if by_date:
+            where_clause += f" ORDER BY {COLUMN_NAME_ALL_DATE} DESC, {COLUMN_NAME_ALL_ID} DESC LIMIT ?"
+        else:
+            where_clause += f" ORDER BY {COLUMN_NAME_ALL_ID} {'ASC' if ascending else 'DESC'} LIMIT ?"
+        # one row more than the page: it tells whether the listing goes on in the direction of the query
+        parameters.append(int(number) + 1)
+        records = self._fetch(table_name, where_clause, tuple(parameters), with_clause)
+        more = len(records) > number
+        del records[number:]
+        if ascending:
+            records.reverse()
+        next_cursor = None
+        previous_cursor = None
+        if records:
+            oldest = records[-1]
+            newest = records[0]
+            if by_date:
+                if more:
+                    next_cursor = PageCursor(before_date=oldest.date, before_date_id=oldest.id)
+            else:
+                if ascending:
+                    older = self._exists(table_name, listing, f"{COLUMN_NAME_ALL_ID} < ?", oldest.id, with_clause)
+                    newer = more
+                else:
+                    # the first page (no cursor) starts from the newest row
+                    older = more
+                    newer = cursor.before_id is not None and self._exists(table_name, listing, f"{COLUMN_NAME_ALL_ID} > ?", newest.id, with_clause)
+                if older:
+                    next_cursor = PageCursor(before_id=oldest.id)
+                if newer:
+                    previous_cursor = PageCursor(after_id=newest.id)
+        return Page(tuple(records), next_cursor, previous_cursor)
+
+    def _batches(self, table_name: str, where_clause: str, parameters: tuple, batch_size: int, with_clause: str="", records: bool=True) -> Iterator:
+        """Yield lists of up to batch_size rows of table_name pulled from the cursor,
+        as records or, with records=False, as the plain tuples returned by sqlite3.
+        Errors are raised: a stream written from the batches must not end silently"""
+        if batch_size <= 0:
+            raise ValueError(f"Invalid batch size: {batch_size}")
+        if records:
+            cursor = self._record_cursor(table_name, where_clause, parameters, with_clause)
+        else:
+            cursor = self._execute(self._table(table_name).select_query(where_clause, with_clause), parameters)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+    def _iterate(self, table_name: str, where_clause: str, parameters: tuple, batch_size: int, with_clause: str="") -> Iterator:
+        """Yield the records of table_name one by one, pulling batch_size rows at a time from the cursor"""
+        try:
+            for records in self._batches(table_name, where_clause, parameters, batch_size, with_clause):
+                yield from records
+
+        except sqlite3.Error as e:
+            print(f"Error: {e}")
+
+    def IterAll(self, table_name: str, batch_size: int=FETCH_BATCH_SIZE) -> Iterator:
+        """Lazily yield all the records of a specific DB table"""
+        return self._iterate(table_name, "", (), batch_size)
+
+    def IterDate(self, table_name: str, date_from: str, date_to: str, batch_size: int=FETCH_BATCH_SIZE) -> Iterator:
+        """Lazily yield the records of a specific DB table within from_date and to_date, ordered by date"""
+        where_clause = f" WHERE {COLUMN_NAME_ALL_DATE} BETWEEN ? AND ? ORDER BY {COLUMN_NAME_ALL_DATE}, {COLUMN_NAME_ALL_ID}"
+        return self._iterate(table_name, where_clause, (str(date_from), str(date_to)), batch_size)
+
+    def IterNumber(self, table_name: str, number: int, batch_size: int=FETCH_BATCH_SIZE, category_id: int=None) -> Iterator:
+        """Lazily yield a specific number of records, ordered by ID descending.
+        If category_id is given only that category and its descendants are considered"""
+        with_clause, where_clause, parameters = self._number_query(table_name, number, category_id)
+        return self._iterate(table_name, where_clause, parameters, batch_size, with_clause)
+
+    def IterDateBatches(self, table_name: str, date_from: str=None, date_to: str=None, batch_size: int=FETCH_BATCH_SIZE) -> Iterator[List[tuple]]:
+        """Lazily yield batches of plain row tuples (columns in table order) dated within date_from and
+        date_to (both optional), ordered by date. No record is built: meant for bulk output"""
+        conditions = []
+        parameters = []
+        if date_from is not None:
+            conditions.append(f"{COLUMN_NAME_ALL_DATE} >= ?")
+            parameters.append(str(date_from))
+        if date_to is not None:
+            conditions.append(f"{COLUMN_NAME_ALL_DATE} <= ?")
+            parameters.append(str(date_to))
+        where_clause = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        where_clause += f" ORDER BY {COLUMN_NAME_ALL_DATE}, {COLUMN_NAME_ALL_ID}"
+        return self._batches(table_name, where_clause, tuple(parameters), batch_size, records=False)
+
+    def IterNumberBatches(self, table_name: str, number: int, batch_size: int=FETCH_BATCH_SIZE, category_id: int=None) -> Iterator[List[tuple]]:
+        """Lazily yield batches of plain row tuples of the most recent records, ordered by ID descending"""
+        with_clause, where_clause, parameters = self._number_query(table_name, number, category_id)
+        return self._batches(table_name, where_clause, parameters, batch_size, with_clause, records=False)
+
+    def FetchCategorySubtree(self, root_id: int=0) -> List[CategoryRecord]:
+        """Return the categories below root_id with a single recursive query, parents before children"""
+        columns_tuple = self.getColumnsAsStrings(TABLE_NAME_CATEGORIES)
+        serialized_columns = ", ".join(columns_tuple)
+        child_columns = ", ".join(f"c.{column}" for column in columns_tuple)
+        query = (f"WITH RECURSIVE SUBTREE({serialized_columns}) AS ("
+                 f"SELECT {serialized_columns} FROM {TABLE_NAME_CATEGORIES} WHERE {COLUMN_NAME_CATEGORY_PARENT} = ? "
+                 f"UNION SELECT {child_columns} FROM {TABLE_NAME_CATEGORIES} c JOIN SUBTREE s ON c.{COLUMN_NAME_CATEGORY_PARENT} = s.{COLUMN_NAME_CATEGORY_ID}"
+                 f") SELECT {serialized_columns} FROM SUBTREE")
         try:
             self._connect()
-            columns_tuple = self.getColumnsAsStrings(table_name)
-            serialized_columns = ", ".join(columns_tuple)
-            query = f"SELECT {serialized_columns} FROM {table_name} ORDER BY {COLUMN_NAME_ALL_ID} DESC LIMIT {number}"
-            cursor = self._conn.cursor()
-            cursor.execute(query)
-            records = cursor.fetchall()
-            self._close()
-            # transform into a list of dictionaries where each key has the column name
-            records_dicts = []
-            for record_tuple in records:
-                record_dict = dict()
-                i = 0
-                for column in columns_tuple:
-                    record_dict[column] = record_tuple[i]
-                    i += 1
-                records_dicts.append(record_dict)
-            return records_dicts
+            return self._execute(query, (int(root_id),), CategoryRecord.from_row).fetchall()
 
         except sqlite3.Error as e:
             print(f"Error: {e}")
             return []
 
-        finally:
-            pass
+    def FetchAggregate(self, date_from: str, date_to: str, group_by: GroupBy=GroupBy.NONE) -> List[dict]:
+        """Return SUM and COUNT of expenses and incomes within date_from and date_to,
+        optionally grouped by category or by month, in a single query.
+        Without grouping one row per table is always returned (zero when empty)"""
+        query = aggregate_query(group_by)
+        columns_tuple = (AGGREGATE_COLUMN_TABLE, AGGREGATE_COLUMN_GROUP, AGGREGATE_COLUMN_TOTAL, AGGREGATE_COLUMN_COUNT)
+        try:
+            return self._dict_rows(query, (str(date_from), str(date_to)) * 2, columns_tuple)
+
+        except sqlite3.Error as e:
+            print(f"Error: {e}")
+            return []
 
 class Item:
     def __init__(self, table:str, id=0):
@@ -309,6 +1621,33 @@ class Item:
     def add_dict_element(self, column:str, data: str):
         self._query_dict[column] = data
 
+    def _fill_query_dict(self):
+        """Set the column values written by Add and Update"""
+        pass
+
+    def Add(self) -> int:
+        """Insert the item in the database and return its new ID"""
+        self._fill_query_dict()
+        db = DB()
+        self._id = db.Create(self.table_name, self._query_dict.keys(), self._query_dict.values())
+        return self._id
+
+    def Update(self) -> bool:
+        """Write the item over the database row with its ID"""
+        self._fill_query_dict()
+        db = DB()
+        return db.Update(self.table_name, self.id, self._query_dict.keys(), self._query_dict.values())
+
+    def Delete(self) -> bool:
+        """Delete the database row with the item ID"""
+        db = DB()
+        return db.Delete(self.table_name, self.id)
+
+    async def aadd(self, timeout: float=None) -> int:
+        """Add, awaited on the AsyncDB pool of src.aio"""
+        from src.aio import default_async_db
+        return await default_async_db().run(self.Add, timeout=timeout)
+
 class Category(Item):
     def get_list_header():
         return f"{' '*(5-len('ID'))}ID | {' '*(10-len('PARENT'))}PARENT | TITLE {' '*(20-len('TITLE'))}| DESCRIPTION {' '*(50-len('DESCRIPTION'))}"
@@ -344,28 +1683,144 @@ class Category(Item):
     def description(self, value):
         self._description = value
     
+    def _fill_query_dict(self):
+        self.add_dict_element(COLUMN_NAME_CATEGORY_PARENT,      self.parent)
+        self.add_dict_element(COLUMN_NAME_CATEGORY_TITLE,       self.title)
+        self.add_dict_element(COLUMN_NAME_CATEGORY_DESCRIPTION, self.description)
+
     def to_string(self, format:FormatType=FormatType.LIST) -> str:
         if format == FormatType.LIST:
-            return f"{self.id:5} | {self.parent:10} | {self.title:<20} | {self.description:<50}"
+            return f"{self.id:5} | {self.parent:10} | {self.title:<20} | {self.description or '':<50}"
         elif format == FormatType.TREE:
-            return f"{self.id} | {self.title} ({self.description})"
+            return f"{self.id} | {self.title} ({self.description or ''})"
         else:
             return ""
     
     @staticmethod
-    def FetchAll():
-        """Fetch all categories from database and return a tuple of objects"""
+    def FetchAll() -> Tuple[CategoryRecord]:
+        """Fetch all categories from database and return a tuple of records"""
+        db = DB()
+        return tuple(db.FetchAll(TABLE_NAME_CATEGORIES))
+
+    @staticmethod
+    def FetchId(id: int) -> CategoryRecord:
+        """Fetch the category with the given ID, or None"""
         db = DB()
-        category_dict_list = db.FetchAll(TABLE_NAME_CATEGORIES)
-        category_list = []
-        for category_dict in category_dict_list:
-            category_list.append(Category(category_dict[COLUMN_NAME_CATEGORY_PARENT], 
-                                            category_dict[COLUMN_NAME_CATEGORY_TITLE], 
-                                            category_dict[COLUMN_NAME_CATEGORY_DESCRIPTION],
-                                            category_dict[COLUMN_NAME_CATEGORY_ID]))
-        return tuple(category_list)
+        return db.FetchId(TABLE_NAME_CATEGORIES, id)
+
+    @staticmethod
+    async def afetch_all(timeout: float=None) -> Tuple[CategoryRecord]:
+        """FetchAll, awaited on the AsyncDB pool of src.aio"""
+        from src.aio import default_async_db
+        return await default_async_db().run(Category.FetchAll, timeout=timeout)
 
     
+class CategoryTree:
+    """Parent -> children index of the categories, built in a single pass.
+    Subtree ID sets are computed once and cached"""
+    _cached = None
+
+    def __init__(self, categories: Iterable[CategoryRecord], root_id: int=0):
+        self._root_id = root_id
+        self._nodes = {}
+        self._children = {}
+        for category in categories:
+            self._nodes[category.id] = category
+            self._children.setdefault(category.parent, []).append(category.id)
+        self._subtree_cache = {}
+        self._check_cycles()
+
+    def _check_cycles(self):
+        """Raise ValueError if the parent links of some categories form a loop"""
+        checked = set()
+        for category_id in self._nodes:
+            path = []
+            on_path = set()
+            current = category_id
+            while current in self._nodes and current not in checked:
+                if current in on_path:
+                    cycle = path[path.index(current):]
+                    raise ValueError(f"Category cycle detected: {' -> '.join(str(node) for node in cycle + [current])}")
+                path.append(current)
+                on_path.add(current)
+                current = self._nodes[current].parent
+            checked.update(path)
+
+    @property
+    def root_id(self) -> int:
+        return self._root_id
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __contains__(self, category_id: int) -> bool:
+        return category_id in self._nodes
+
+    def get(self, category_id: int) -> CategoryRecord:
+        if category_id not in self._nodes:
+            raise ValueError(f"Unknown category {category_id}")
+        return self._nodes[category_id]
+
+    def children(self, category_id: int) -> Tuple[CategoryRecord]:
+        return tuple(self._nodes[child_id] for child_id in self._children.get(category_id, ()))
+
+    def ancestors(self, category_id: int) -> Tuple[CategoryRecord]:
+        """Return the ancestors of a category, from its parent up to the top level"""
+        ancestors = []
+        current = self.get(category_id).parent
+        while current in self._nodes:
+            ancestors.append(self._nodes[current])
+            current = self._nodes[current].parent
+        return tuple(ancestors)
+
+    def walk(self, category_id: int=None) -> Iterator[Tuple[int, CategoryRecord]]:
+        """Yield (depth, category) for the descendants of category_id in depth-first order.
+        The root itself is not yielded"""
+        if category_id is None:
+            category_id = self._root_id
+        stack = [(0, child_id) for child_id in reversed(self._children.get(category_id, ()))]
+        while stack:
+            depth, current = stack.pop()
+            yield depth, self._nodes[current]
+            stack.extend((depth + 1, child_id) for child_id in reversed(self._children.get(current, ())))
+
+    def descendants(self, category_id: int) -> Tuple[CategoryRecord]:
+        return tuple(category for _, category in self.walk(category_id))
+
+    def subtree_ids(self, category_id: int) -> frozenset:
+        """Return the IDs of a category and of all its descendants"""
+        if category_id not in self._subtree_cache:
+            ids = {category_id}
+            ids.update(category.id for _, category in self.walk(category_id))
+            self._subtree_cache[category_id] = frozenset(ids)
+        return self._subtree_cache[category_id]
+
+    def rollup(self, values: dict) -> dict:
+        """Given per-category values (e.g. totals), return for each category the sum over its subtree"""
+        rolled = {category_id: values.get(category_id, 0) for category_id in self._nodes}
+        # children come after their parent in walk order: accumulate in reverse
+        for _, category in reversed(list(self.walk())):
+            if category.parent in rolled:
+                rolled[category.parent] += rolled[category.id]
+        return rolled
+
+    @staticmethod
+    def Load(recursive_query: bool=False, root_id: int=0) -> "CategoryTree":
+        """Build the tree from the database. With recursive_query only the categories
+        reachable from root_id are loaded, through a single recursive CTE"""
+        db = DB()
+        if recursive_query:
+            return CategoryTree(db.FetchCategorySubtree(root_id), root_id)
+        return CategoryTree(db.FetchAll(TABLE_NAME_CATEGORIES), root_id)
+
+    @staticmethod
+    def Cached() -> "CategoryTree":
+        """Return the tree built by a previous call, unless the database changed since then"""
+        data_version = DB().DataVersion()
+        if CategoryTree._cached is None or CategoryTree._cached[0] != data_version:
+            CategoryTree._cached = (data_version, CategoryTree.Load())
+        return CategoryTree._cached[1]
+
 class TransactionItem(Item):
     def __init__(self, table: str, category_id: int, date: str, amount: float, title: str, notes: str, id=0):
         if (TABLE_NAME_EXPENSES != table) and (TABLE_NAME_INCOMES != table):
@@ -404,22 +1859,119 @@ class TransactionItem(Item):
     
     @date.setter
     def date(self, value: date):
-        self.date = value
+        self._date = value
 
     @amount.setter
     def amount(self, value: float):
-        self.amount = value
+        self._amount = value
 
     @title.setter
     def title(self, value: str):
-        self.title = value
+        self._title = value
 
     @notes.setter
     def notes(self, value: str):
-        self.notes = value
+        self._notes = value
     
+    def _fill_query_dict(self):
+        if not date_is_valid(str(self.date)):
+            raise ValueError(f"Invalid date format: {self.date}")
+        self.add_dict_element(COLUMN_NAME_ALL_CATEGORY, self.category_id)
+        self.add_dict_element(COLUMN_NAME_ALL_DATE,     self.date)
+        self.add_dict_element(COLUMN_NAME_ALL_AMOUNT,   self.amount)
+        self.add_dict_element(COLUMN_NAME_ALL_TITLE,    self.title)
+        self.add_dict_element(COLUMN_NAME_ALL_NOTES,    self.notes)
+
     def to_string(self):
-        return f"{self.id:5} | {self.category_id:5} | {self.amount:8} | {self.date:12} | {self.title:20} | {self.notes}"
+        return f"{self.id:5} | {self.category_id:5} | {self.amount:8} | {self.date:12} | {self.title or '':20} | {self.notes or ''}"
+
+    @staticmethod
+    def _import_csv(table_name: str, file: TextIO, chunk_size: int, delimiter: str) -> "ImportReport":
+        """Stream a CSV file into table_name. The first line is the header and must
+        contain the date, amount and category columns. title and notes are optional"""
+        import csv
+        report = ImportReport()
+        reader = csv.DictReader(file, delimiter=delimiter)
+        fieldnames = [name.strip().lower() for name in (reader.fieldnames or [])]
+        missing = [name for name in ("date", "amount", "category") if name not in fieldnames]
+        if missing:
+            raise ValueError(f"Missing CSV column(s): {', '.join(missing)}")
+        reader.fieldnames = fieldnames
+
+        # line numbers of the last chunk of rows handed to CreateMany, to report the ones the database rejects
+        chunk_lines = deque(maxlen=chunk_size)
+        yielded = 0
+
+        def valid_rows():
+            nonlocal yielded
+            for row in reader:
+                line = reader.line_num
+                record_date = (row.get("date") or "").strip()
+                if not date_is_valid(record_date):
+                    report.rejected.append((line, f"invalid date '{record_date}'"))
+                    continue
+                try:
+                    amount = float(row.get("amount"))
+                    category = int(row.get("category"))
+                except (TypeError, ValueError):
+                    report.rejected.append((line, "invalid amount or category"))
+                    continue
+                if not math.isfinite(amount):
+                    report.rejected.append((line, f"invalid amount '{row.get('amount')}'"))
+                    continue
+                chunk_lines.append(line)
+                yielded += 1
+                yield (category, record_date, amount, row.get("title") or "", row.get("notes") or "")
+
+        def rejected_row(index: int, error: sqlite3.Error):
+            report.rejected.append((chunk_lines[index - (yielded - len(chunk_lines))], str(error)))
+
+        columns = [COLUMN_NAME_ALL_CATEGORY, COLUMN_NAME_ALL_DATE, COLUMN_NAME_ALL_AMOUNT, COLUMN_NAME_ALL_TITLE, COLUMN_NAME_ALL_NOTES]
+        start = time.perf_counter()
+        report.inserted = DB().CreateMany(table_name, columns, valid_rows(), chunk_size, rejected_row)
+        # lines are reported in file order
+        report.rejected.sort()
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    # awaitable versions of the fetch methods of Expense and Income, run on the AsyncDB pool of src.aio
+    @classmethod
+    async def afetch_all(cls, timeout: float=None) -> tuple:
+        from src.aio import default_async_db
+        return await default_async_db().run(cls.FetchAll, timeout=timeout)
+
+    @classmethod
+    async def afetch_date_interval(cls, date_from: str, date_to: str, timeout: float=None) -> tuple:
+        from src.aio import default_async_db
+        return await default_async_db().run(cls.FetchDateInterval, date_from, date_to, timeout=timeout)
+
+    @classmethod
+    async def afetch_number(cls, number: int, category_id: int=None, timeout: float=None) -> tuple:
+        from src.aio import default_async_db
+        return await default_async_db().run(cls.FetchNumber, number, category_id, timeout=timeout)
+
+    @classmethod
+    async def afetch_page(cls, number: int, cursor: PageCursor=None, category_id: int=None, timeout: float=None) -> Page:
+        from src.aio import default_async_db
+        return await default_async_db().run(cls.FetchPage, number, cursor, category_id, timeout=timeout)
+
+    @classmethod
+    async def asearch(cls, text_query: str, date_from: str=None, date_to: str=None, category_id: int=None, number: int=20, timeout: float=None) -> tuple:
+        from src.aio import default_async_db
+        return await default_async_db().run(cls.Search, text_query, date_from, date_to, category_id, number, timeout=timeout)
+
+class ImportReport:
+    """Outcome of a bulk import"""
+    def __init__(self):
+        self.inserted = 0
+        self.elapsed = 0.0
+        self.rejected = []
+
+    @property
+    def rows_per_second(self) -> float:
+        if self.elapsed <= 0:
+            return 0.0
+        return self.inserted / self.elapsed
 
 class Expense(TransactionItem):
     table_name = TABLE_NAME_EXPENSES
@@ -427,49 +1979,63 @@ class Expense(TransactionItem):
     def __init__(self, category_id: int, date: date, amount: float, title: str, notes: str, id=0):
         super().__init__(TABLE_NAME_EXPENSES, category_id, date, amount, title, notes, id)
     
-    def Add(self):
-        self.add_dict_element(COLUMN_NAME_EXPENSE_CATEGORY, str(self.category_id))
-        self.add_dict_element(COLUMN_NAME_EXPENSE_DATE,     self.date)
-        self.add_dict_element(COLUMN_NAME_EXPENSE_AMOUNT,   str(self.amount))
-        self.add_dict_element(COLUMN_NAME_EXPENSE_TITLE,    self.title)
-        self.add_dict_element(COLUMN_NAME_EXPENSE_NOTES,    self.notes)
-        if not date_is_valid(self.date.strftime("%Y-%m-%d")):
-            raise ValueError(f"Invalid date format: {self.date}")
-        db = DB()
-        db.Create(Expense.table_name, self._query_dict.keys(), self._query_dict.values())
-    
     @staticmethod
-    def _from_dict_to_tuple(expense_dict_list):
-        expense_list = []
-        for expense_dict in expense_dict_list:
-            expense_list.append(Expense(    category_id =   expense_dict[COLUMN_NAME_EXPENSE_CATEGORY], 
-                                            date =          expense_dict[COLUMN_NAME_EXPENSE_DATE], 
-                                            amount =        expense_dict[COLUMN_NAME_EXPENSE_AMOUNT],
-                                            title =         expense_dict[COLUMN_NAME_EXPENSE_TITLE],
-                                            notes =         expense_dict[COLUMN_NAME_EXPENSE_NOTES],
-                                            id =            expense_dict[COLUMN_NAME_EXPENSE_ID]))
-        return tuple(expense_list)
+    def FetchAll() -> Tuple[ExpenseRecord]:
+        """Fetch all expenses items from database and return a tuple of records"""
+        db = DB()
+        return tuple(db.FetchAll(Expense.table_name))
 
     @staticmethod
-    def FetchAll():
-        """Fetch all expenses items from database and return a tuple of objects"""
+    def FetchId(id: int) -> ExpenseRecord:
+        """Fetch the expense with the given ID, or None"""
         db = DB()
-        expense_dict_list = db.FetchAll(Expense.table_name)
-        return Expense._from_dict_to_tuple(expense_dict_list)
+        return db.FetchId(Expense.table_name, id)
 
     @staticmethod
     def FetchDateInterval(date_from:str, date_to:str):
         """Fetch all expenses between a date interval"""
         db = DB()
-        expense_dict_list = db.FetchDate(Expense.table_name, date_from, date_to)
-        return Expense._from_dict_to_tuple(expense_dict_list)
+        return tuple(db.FetchDate(Expense.table_name, date_from, date_to))
+
+    @staticmethod
+    def FetchNumber(number:str, category_id: int=None):
+        """Fetch the most recent expenses. Get at maximum "number" elements.
+        If category_id is given, only expenses of that category or of its descendants are returned"""
+        db = DB()
+        return tuple(db.FetchNumber(Expense.table_name, number, category_id))
+
+    @staticmethod
+    def iter_all(batch_size: int=FETCH_BATCH_SIZE) -> Iterator[ExpenseRecord]:
+        """Lazily yield all the expenses using bounded memory"""
+        return DB().IterAll(Expense.table_name, batch_size)
+
+    @staticmethod
+    def iter_date_interval(date_from: str, date_to: str, batch_size: int=FETCH_BATCH_SIZE) -> Iterator[ExpenseRecord]:
+        """Lazily yield the expenses between a date interval using bounded memory"""
+        return DB().IterDate(Expense.table_name, date_from, date_to, batch_size)
+
+    @staticmethod
+    def iter_number(number: int, batch_size: int=FETCH_BATCH_SIZE, category_id: int=None) -> Iterator[ExpenseRecord]:
+        """Lazily yield the most recent expenses. Get at maximum "number" elements.
+        If category_id is given, only expenses of that category or of its descendants are returned"""
+        return DB().IterNumber(Expense.table_name, number, batch_size, category_id)
+
+    @staticmethod
+    def FetchPage(number: int, cursor: PageCursor=None, category_id: int=None) -> Page:
+        """Fetch one page of expenses, newest first, starting from a cursor of a previous page"""
+        db = DB()
+        return db.FetchPage(Expense.table_name, number, cursor, category_id)
 
     @staticmethod
-    def FetchNumber(number:str):
-        """Fetch the most recent expenses. Get at maximum "number" elements"""
+    def Search(text_query: str, date_from: str=None, date_to: str=None, category_id: int=None, number: int=20) -> Tuple[ExpenseRecord]:
+        """Full-text search of expenses by title and notes (FTS5 query syntax), best matches first"""
         db = DB()
-        expense_dict_list = db.FetchNumber(Expense.table_name, number)
-        return Expense._from_dict_to_tuple(expense_dict_list)
+        return tuple(db.Search(Expense.table_name, text_query, date_from, date_to, category_id, number))
+
+    @staticmethod
+    def Import(file: TextIO, chunk_size: int=IMPORT_CHUNK_SIZE, delimiter: str=",") -> ImportReport:
+        """Bulk load expenses from a CSV stream using batched inserts"""
+        return TransactionItem._import_csv(Expense.table_name, file, chunk_size, delimiter)
 
 class Income(TransactionItem):
     table_name = TABLE_NAME_INCOMES
@@ -477,46 +2043,60 @@ class Income(TransactionItem):
     def __init__(self, category_id: int, date: date, amount: float, title: str, notes: str, id=0):
         super().__init__(TABLE_NAME_INCOMES, category_id, date, amount, title, notes, id)
 
-    def Add(self):
-        self.add_dict_element(COLUMN_NAME_INCOME_CATEGORY, str(self.category_id))
-        self.add_dict_element(COLUMN_NAME_INCOME_DATE,     self.date)
-        self.add_dict_element(COLUMN_NAME_INCOME_AMOUNT,   str(self.amount))
-        self.add_dict_element(COLUMN_NAME_INCOME_TITLE,    self.title)
-        self.add_dict_element(COLUMN_NAME_INCOME_NOTES,    self.notes)
-        if not date_is_valid(self.date.strftime("%Y-%m-%d")):
-            raise ValueError(f"Invalid date format: {self.date}")
+    @staticmethod
+    def FetchAll() -> Tuple[IncomeRecord]:
+        """Fetch all incomes items from database and return a tuple of records"""
         db = DB()
-        db.Create(Income.table_name, self._query_dict.keys(), self._query_dict.values())
+        return tuple(db.FetchAll(Income.table_name))
     
     @staticmethod
-    def _from_dict_to_tuple(income_dict_list):
-        income_list = []
-        for income_dict in income_dict_list:
-            income_list.append(Income(  category_id =   income_dict[COLUMN_NAME_INCOME_CATEGORY], 
-                                        date =          income_dict[COLUMN_NAME_INCOME_DATE], 
-                                        amount =        income_dict[COLUMN_NAME_INCOME_AMOUNT],
-                                        title =         income_dict[COLUMN_NAME_INCOME_TITLE],
-                                        notes =         income_dict[COLUMN_NAME_INCOME_NOTES],
-                                        id =            income_dict[COLUMN_NAME_INCOME_ID]))
-        return tuple(income_list)
-
-    @staticmethod
-    def FetchAll():
-        """Fetch all incomes items from database and return a tuple of objects"""
+    def FetchId(id: int) -> IncomeRecord:
+        """Fetch the income with the given ID, or None"""
         db = DB()
-        income_dict_list = db.FetchAll(Income.table_name)
-        return Income._from_dict_to_tuple(income_dict_list)
-    
+        return db.FetchId(Income.table_name, id)
+
     @staticmethod
     def FetchDateInterval(date_from: str, date_to: str):
         """Fetch all incomes between a date interval"""
         db = DB()
-        income_dict_list = db.FetchDate(Income.table_name, date_from, date_to)
-        return Income._from_dict_to_tuple(income_dict_list)
+        return tuple(db.FetchDate(Income.table_name, date_from, date_to))
+
+    @staticmethod
+    def FetchNumber(number:str, category_id: int=None):
+        """Fetch the most recent incomes. Get at maximum "number" elements.
+        If category_id is given, only incomes of that category or of its descendants are returned"""
+        db = DB()
+        return tuple(db.FetchNumber(Income.table_name, number, category_id))
+
+    @staticmethod
+    def iter_all(batch_size: int=FETCH_BATCH_SIZE) -> Iterator[IncomeRecord]:
+        """Lazily yield all the incomes using bounded memory"""
+        return DB().IterAll(Income.table_name, batch_size)
+
+    @staticmethod
+    def iter_date_interval(date_from: str, date_to: str, batch_size: int=FETCH_BATCH_SIZE) -> Iterator[IncomeRecord]:
+        """Lazily yield the incomes between a date interval using bounded memory"""
+        return DB().IterDate(Income.table_name, date_from, date_to, batch_size)
+
+    @staticmethod
+    def iter_number(number: int, batch_size: int=FETCH_BATCH_SIZE, category_id: int=None) -> Iterator[IncomeRecord]:
+        """Lazily yield the most recent incomes. Get at maximum "number" elements.
+        If category_id is given, only incomes of that category or of its descendants are returned"""
+        return DB().IterNumber(Income.table_name, number, batch_size, category_id)
+
+    @staticmethod
+    def FetchPage(number: int, cursor: PageCursor=None, category_id: int=None) -> Page:
+        """Fetch one page of incomes, newest first, starting from a cursor of a previous page"""
+        db = DB()
+        return db.FetchPage(Income.table_name, number, cursor, category_id)
 
     @staticmethod
-    def FetchNumber(number:str):
-        """Fetch the most recent incomes. Get at maximum "number" elements"""
+    def Search(text_query: str, date_from: str=None, date_to: str=None, category_id: int=None, number: int=20) -> Tuple[IncomeRecord]:
+        """Full-text search of incomes by title and notes (FTS5 query syntax), best matches first"""
         db = DB()
-        income_dict_list = db.FetchNumber(Income.table_name, number)
-        return Income._from_dict_to_tuple(income_dict_list)
+        return tuple(db.Search(Income.table_name, text_query, date_from, date_to, category_id, number))
+
+    @staticmethod
+    def Import(file: TextIO, chunk_size: int=IMPORT_CHUNK_SIZE, delimiter: str=",") -> ImportReport:
+        """Bulk load incomes from a CSV stream using batched inserts"""
+        return TransactionItem._import_csv(Income.table_name, file, chunk_size, delimiter)
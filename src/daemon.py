@@ -0,0 +1,186 @@
+import json
+import os
+import socket
+import sys
+import tempfile
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+from typing import List, Optional
+
+from src import core
+
+# Commands that cannot be forwarded: they read the client's stdin, run many commands or control the daemon itself
+LOCAL_ONLY_COMMANDS = ("serve", "shell", "batch")
+
+def socket_folder() -> str:
+    """Folder of the default socket, readable only by the user: $XDG_RUNTIME_DIR or a per-user folder in the temp folder"""
+    return os.environ.get("XDG_RUNTIME_DIR") or os.path.join(tempfile.gettempdir(), f"expman-{os.getuid()}")
+
+def default_socket_path() -> str:
+    """Socket used by "expman serve" and by the client, overridable with EXPMAN_SOCKET"""
+    return os.environ.get("EXPMAN_SOCKET", os.path.join(socket_folder(), "expman.sock"))
+
+def _owned_by_user(path: str) -> bool:
+    try:
+        return os.stat(path).st_uid == os.getuid()
+    except FileNotFoundError:
+        return False
+
+def _private_folder(folder: str):
+    """Create folder accessible only by the user, or check that an existing one is"""
+    os.makedirs(folder, mode=0o700, exist_ok=True)
+    status = os.stat(folder)
+    if status.st_uid != os.getuid() or status.st_mode & 0o077:
+        raise RuntimeError(f"{folder} shall be owned by the user and not accessible by others")
+
+def db_file() -> str:
+    return os.path.abspath(os.path.join(core.DB_FOLDER, core.DB_NAME))
+
+def _send(connection: socket.socket, message: dict):
+    connection.sendall(json.dumps(message).encode() + b"\n")
+
+def _receive(connection: socket.socket) -> Optional[dict]:
+    with connection.makefile("rb") as stream:
+        line = stream.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+def can_forward(argv: List[str]) -> bool:
+    """Return False for the commands that must run in the calling process"""
+    if os.environ.get("EXPMAN_NO_DAEMON"):
+        return False
+    from src.cli import build_parser
+    try:
+        # invalid arguments and --help are left to the local parser, which prints them
+        with redirect_stdout(StringIO()), redirect_stderr(StringIO()):
+            args = build_parser().parse_args(argv)
+    except SystemExit:
+        return False
+    if args.item in LOCAL_ONLY_COMMANDS:
+        return False
+    # an import from stdin needs the client's standard input
+    return getattr(args, "file", None) != "-"
+
+def forward(argv: List[str], socket_path: str=None) -> Optional[int]:
+    """Run a command on the daemon. Return its exit code, or None if no daemon
+    serving the same database is listening (the caller shall run the command itself)"""
+    socket_path = socket_path or default_socket_path()
+    # parsing argv costs more than the rest of the client: do it only when a daemon may be listening.
+    # A socket created by another user is never trusted with the commands and their output
+    if not _owned_by_user(socket_path) or not can_forward(argv):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(socket_path)
+            _send(connection, {"argv": argv, "cwd": os.getcwd(), "db": db_file()})
+            reply = _receive(connection)
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+    if reply is None or reply.get("rejected"):
+        return None
+    sys.stdout.write(reply["stdout"])
+    sys.stderr.write(reply["stderr"])
+    return reply["exit_code"]
+
+def stop(socket_path: str=None) -> bool:
+    """Ask the daemon to exit. Return False if it was not running"""
+    socket_path = socket_path or default_socket_path()
+    if not _owned_by_user(socket_path):
+        return False
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(socket_path)
+            _send(connection, {"shutdown": True})
+            _receive(connection)
+    except (FileNotFoundError, ConnectionRefusedError):
+        return False
+    return True
+
+def _run(argv: List[str], cwd: str) -> dict:
+    """Run one command in this process, capturing its output"""
+    from src.cli import main_function
+    stdout = StringIO()
+    stderr = StringIO()
+    exit_code = 0
+    previous_cwd = os.getcwd()
+    try:
+        os.chdir(cwd)
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            try:
+                main_function(argv)
+            except SystemExit as e:
+                exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+                if isinstance(e.code, str):
+                    print(e.code, file=sys.stderr)
+            except Exception:
+                traceback.print_exc()
+                exit_code = 1
+    finally:
+        os.chdir(previous_cwd)
+    return {"exit_code": exit_code, "stdout": stdout.getvalue(), "stderr": stderr.getvalue()}
+
+def _handle(connection: socket.socket) -> bool:
+    """Serve one request. Return True if the daemon was asked to exit"""
+    request = _receive(connection)
+    if request is None:
+        return False
+    if request.get("shutdown"):
+        _send(connection, {"stopped": True})
+        return True
+    if request.get("db") != db_file():
+        _send(connection, {"rejected": True})
+        return False
+    _send(connection, _run(request["argv"], request["cwd"]))
+    return False
+
+def serve(socket_path: str=None):
+    """Serve commands over a Unix domain socket, one at a time, keeping the
+    database connection and the caches warm between commands"""
+    socket_path = socket_path or default_socket_path()
+    folder = os.path.dirname(os.path.abspath(socket_path))
+    if folder == os.path.abspath(socket_folder()):
+        _private_folder(folder)
+    if os.path.exists(socket_path):
+        if _is_listening(socket_path):
+            raise RuntimeError(f"A daemon is already listening on {socket_path}")
+        os.remove(socket_path)
+    # open the connection (and check the schema) before accepting commands
+    core.DB()._connect()
+    core.CategoryTree.Cached()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        # bound under this umask the socket is accessible only by the user from the start: no other user can ever connect
+        umask = os.umask(0o077)
+        try:
+            server.bind(socket_path)
+        finally:
+            os.umask(umask)
+        server.listen()
+        print(f"Serving {db_file()} on {socket_path}")
+        sys.stdout.flush()
+        while True:
+            connection, _ = server.accept()
+            with connection:
+                try:
+                    if _handle(connection):
+                        break
+                except Exception as e:
+                    # a malformed request or a client that went away must not stop the daemon
+                    print(f"Error: request not served: {e!r}", file=sys.stderr)
+                    sys.stderr.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+def _is_listening(socket_path: str) -> bool:
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(socket_path)
+        return True
+    except (FileNotFoundError, ConnectionRefusedError):
+        return False
@@ -0,0 +1,141 @@
+import glob
+import os
+import sqlite3
+from itertools import repeat
+from typing import Dict, List, Sequence, Tuple
+from urllib.parse import quote
+
+from src.core import CategoryRecord, CategoryTree, GroupBy, aggregate_query, TABLE_NAME_CATEGORIES
+from src.core import COLUMN_NAME_CATEGORY_ID, COLUMN_NAME_CATEGORY_PARENT, COLUMN_NAME_CATEGORY_TITLE, COLUMN_NAME_CATEGORY_DESCRIPTION
+
+# Named sets of ledgers from the [ledgers] section: name -> glob patterns
+LEDGERS = {}
+
+# Up to this many ledgers are aggregated in this process, attached one at a time to a single
+# connection: no process start-up cost. Bigger sets are split over a process pool
+LEDGER_ATTACH_LIMIT = 8
+
+# Processes of the pool (0: one per CPU)
+LEDGER_WORKERS = 0
+
+# (table name, category path or None) -> [total, count]
+Totals = Dict[Tuple[str, str], list]
+
+def init_ledgers(options: dict):
+    """Read the [ledgers] section: attach_limit, workers, and any other key as
+    name = glob pattern(s), separated by commas or new lines"""
+    global LEDGER_ATTACH_LIMIT
+    global LEDGER_WORKERS
+    for key, value in options.items():
+        if key in ("attach_limit", "workers"):
+            try:
+                number = int(value)
+            except ValueError:
+                number = -1
+            if number < 0:
+                raise ValueError(f"Invalid value for {key}: {value}")
+            if key == "attach_limit":
+                LEDGER_ATTACH_LIMIT = number
+            else:
+                LEDGER_WORKERS = number
+        else:
+            LEDGERS[key] = [pattern.strip() for pattern in value.replace("\n", ",").split(",") if pattern.strip()]
+
+def resolve_ledgers(names_or_patterns: Sequence[str]) -> List[str]:
+    """Return the database files matching ledger set names or glob patterns, sorted and without duplicates"""
+    paths = []
+    for name in names_or_patterns:
+        patterns = LEDGERS.get(name.lower(), [name])
+        matches = []
+        for pattern in patterns:
+            matches += glob.glob(os.path.expanduser(pattern))
+        matches = [path for path in matches if os.path.isfile(path)]
+        if not matches:
+            raise ValueError(f"No ledger matches {name}")
+        paths += matches
+    return sorted(set(os.path.abspath(path) for path in paths))
+
+def _read_only_uri(path: str) -> str:
+    return f"file:{quote(os.path.abspath(path))}?mode=ro"
+
+def _category_paths(connection: sqlite3.Connection, schema: str) -> Dict[int, str]:
+    """Category ID -> "Parent/Child" path of titles. IDs differ between ledgers, paths are what is merged"""
+    columns = f"{COLUMN_NAME_CATEGORY_ID}, {COLUMN_NAME_CATEGORY_PARENT}, {COLUMN_NAME_CATEGORY_TITLE}, {COLUMN_NAME_CATEGORY_DESCRIPTION}"
+    tree = CategoryTree(CategoryRecord._make(row) for row in connection.execute(f"SELECT {columns} FROM {schema}.{TABLE_NAME_CATEGORIES}"))
+    paths = {}
+    for _, category in tree.walk():
+        titles = [ancestor.title for ancestor in reversed(tree.ancestors(category.id))]
+        paths[category.id] = "/".join(titles + [category.title])
+    return paths
+
+def _schema_totals(connection: sqlite3.Connection, schema: str, date_from: str, date_to: str, by_category: bool) -> Totals:
+    group_by = GroupBy.CATEGORY if by_category else GroupBy.NONE
+    rows = connection.execute(aggregate_query(group_by, schema), (date_from, date_to) * 2).fetchall()
+    paths = _category_paths(connection, schema) if by_category else {}
+    totals = {}
+    for table_name, group, total, count in rows:
+        key = (table_name, paths.get(group, f"#{group}") if by_category else None)
+        entry = totals.setdefault(key, [0.0, 0])
+        entry[0] += total
+        entry[1] += count
+    return totals
+
+def _merge(into: Totals, totals: Totals):
+    for key, (total, count) in totals.items():
+        entry = into.setdefault(key, [0.0, 0])
+        entry[0] += total
+        entry[1] += count
+
+def _file_totals(path: str, date_from: str, date_to: str, by_category: bool) -> Tuple[Totals, str]:
+    """Totals of one ledger, opened read-only. Run in the pool processes. Return (totals, error)"""
+    try:
+        connection = sqlite3.connect(_read_only_uri(path), uri=True)
+        try:
+            return _schema_totals(connection, "main", date_from, date_to, by_category), None
+        finally:
+            connection.close()
+    except (sqlite3.Error, ValueError) as e:
+        return {}, f"{path}: {e}"
+
+def _attached_totals(paths: Sequence[str], date_from: str, date_to: str, by_category: bool) -> List[Tuple[Totals, str]]:
+    """Totals of a few ledgers attached read-only to one in-memory connection"""
+    results = []
+    connection = sqlite3.connect("file::memory:", uri=True)
+    try:
+        for path in paths:
+            try:
+                connection.execute("ATTACH DATABASE ? AS LEDGER", (_read_only_uri(path),))
+            except sqlite3.Error as e:
+                results.append(({}, f"{path}: {e}"))
+                continue
+            try:
+                results.append((_schema_totals(connection, "LEDGER", date_from, date_to, by_category), None))
+            except (sqlite3.Error, ValueError) as e:
+                results.append(({}, f"{path}: {e}"))
+            finally:
+                connection.execute("DETACH DATABASE LEDGER")
+    finally:
+        connection.close()
+    return results
+
+def consolidate(paths: Sequence[str], date_from, date_to, by_category: bool=False, workers: int=None) -> Tuple[Totals, List[str]]:
+    """Sum expenses and incomes of date_from..date_to over many ledger files, in total or per category path.
+    Small sets are read in this process; bigger ones are split over a process pool and the partial
+    totals are merged. Return (totals, errors): a ledger that cannot be read is reported and skipped"""
+    date_from = str(date_from)
+    date_to = str(date_to)
+    if len(paths) <= LEDGER_ATTACH_LIMIT:
+        results = _attached_totals(paths, date_from, date_to, by_category)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        workers = min(workers or LEDGER_WORKERS or os.cpu_count() or 1, len(paths))
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(_file_totals, paths, repeat(date_from), repeat(date_to), repeat(by_category),
+                                    chunksize=max(1, len(paths) // (workers * 4))))
+    totals = {}
+    errors = []
+    for partial, error in results:
+        if error is not None:
+            errors.append(error)
+        _merge(totals, partial)
+    return totals, errors
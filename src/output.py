@@ -0,0 +1,105 @@
+import csv
+import io
+import math
+from json.encoder import encode_basestring
+import os
+import sys
+from typing import Callable, Iterable, List, Sequence, TextIO
+
+OUTPUT_FORMATS = ("table", "csv", "json", "jsonl", "tsv")
+
+# Output columns of expenses / incomes and categories, in the column order of their tables.
+# The transaction names match the header read by "exp import", so exports can be imported again
+TRANSACTION_COLUMNS = ("id", "category", "amount", "date", "title", "notes")
+CATEGORY_COLUMNS = ("id", "parent", "title", "description")
+
+# TSV fields cannot contain tabs or line breaks: they are escaped with a backslash
+TSV_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+def _tsv_field(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        if "\\" in value or "\t" in value or "\n" in value or "\r" in value:
+            return value.translate(TSV_ESCAPES)
+        return value
+    return str(value)
+
+def _json_value(value) -> str:
+    # sqlite3 returns only str, int, float and None here: numbers are written with repr,
+    # except infinities and NaN, which JSON cannot represent
+    if value.__class__ is str:
+        return encode_basestring(value)
+    if value is None or (value.__class__ is float and not math.isfinite(value)):
+        return "null"
+    return repr(value)
+
+class RowWriter:
+    """Write rows (tuples in the order of columns) to a text stream as a fixed width table, CSV,
+    TSV (with a header line), a JSON array of objects (closed by close()) or JSON lines. Every batch of rows is formatted in memory and written
+    with a single call, so rows can be streamed straight from a cursor with fetchmany.
+    table_row formats one row of the table (e.g. from the to_string of the record type)"""
+    def __init__(self, columns: Sequence[str], format: str="table", file: TextIO=None,
+                 table_row: Callable[[tuple], str]=None, table_header: str=None):
+        if format not in OUTPUT_FORMATS:
+            raise ValueError(f"Invalid output format: {format}")
+        self.columns = tuple(columns)
+        self.format = format
+        self.rows = 0
+        self._file = file if file is not None else sys.stdout
+        self._table_row = table_row or (lambda row: " | ".join("" if value is None else str(value) for value in row))
+        self._header = None
+        if format == "table" and table_header is not None:
+            self._header = table_header + "\n"
+        elif format in ("csv", "tsv"):
+            self._header = self._format_batch([self.columns])
+        elif format == "json":
+            self._header = "["
+        # JSON line of a row, "%s" standing for the encoded values (faster than json.dumps of a dict per row)
+        self._json_template = "{" + ", ".join(f"{encode_basestring(column)}: %s" for column in self.columns) + "}\n"
+
+    def _format_batch(self, rows: Iterable[tuple]) -> str:
+        if self.format == "csv":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            return buffer.getvalue()
+        if self.format == "tsv":
+            return "".join("\t".join(map(_tsv_field, row)) + "\n" for row in rows)
+        if self.format == "jsonl":
+            template = self._json_template
+            return "".join([template % tuple(map(_json_value, row)) for row in rows])
+        if self.format == "json":
+            # one object per line, separated by commas: the first one follows the "[" of the header
+            template = self._json_template[:-1]
+            if not rows:
+                return ""
+            separator = ",\n" if self.rows else "\n"
+            return separator + ",\n".join([template % tuple(map(_json_value, row)) for row in rows])
+        return "".join(self._table_row(row) + "\n" for row in rows)
+
+    def write_batch(self, rows: List[tuple]):
+        if self._header is not None:
+            self._file.write(self._header)
+            self._header = None
+        self._file.write(self._format_batch(rows))
+        self.rows += len(rows)
+
+    def write_batches(self, batches: Iterable[List[tuple]]) -> int:
+        """Write every batch, return the number of rows written"""
+        for rows in batches:
+            self.write_batch(rows)
+        return self.rows
+
+    def close(self):
+        """Write the header of an empty table, close the JSON array and flush"""
+        if self._header is not None:
+            self.write_batch([])
+        if self.format == "json":
+            self._file.write("\n]\n" if self.rows else "]\n")
+        self._file.flush()
+
+def silence_broken_pipe():
+    """The reader of stdout exited (e.g. "| head"): point stdout to /dev/null so that
+    the flush at exit does not fail again, as recommended by the Python documentation"""
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
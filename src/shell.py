@@ -0,0 +1,123 @@
+import shlex
+import sqlite3
+import sys
+from typing import Iterable, TextIO
+
+from src.core import DB
+
+# Commands that cannot run inside a shell or batch
+NESTED_COMMANDS = ("shell", "batch", "serve")
+
+# (command, subcommand) that write: their line opens the transaction with BEGIN IMMEDIATE
+WRITE_COMMANDS = (("exp", "add"), ("exp", "import"), ("inc", "add"), ("inc", "import"))
+
+class LineError(Exception):
+    """A command line that could not be parsed or failed while running"""
+
+def parse_line(parser, words: list):
+    """Parse one command line, return the args or None for --help and similar.
+    argparse errors become LineError"""
+    try:
+        args = parser.parse_args(words)
+    except SystemExit as e:
+        if e.code:
+            raise LineError("invalid arguments")
+        # --help and similar
+        return None
+    # the command is known only after parsing: global options such as --format may come first
+    if args.item in NESTED_COMMANDS:
+        raise LineError(f"'{args.item}' cannot be used here")
+    return args
+
+def writes(args) -> bool:
+    return (args.item, getattr(args, f"{args.item}_command", None)) in WRITE_COMMANDS
+
+def run_lines(lines: Iterable[str], batch_size: int=100, atomic: bool=False, strict: bool=False, prompt: str=None, output: TextIO=None) -> int:
+    """Run command lines in the syntax of the expman script in this process.
+    Writes are committed every batch_size commands; each command is a savepoint, so a failing
+    command leaves no partial writes. With atomic everything is committed only if every line
+    succeeds. Interactively (with a prompt, or lines from a terminal) writes are committed before
+    waiting for the next line, so an idle shell never holds the write lock.
+    Errors are reported on stderr; strict (or atomic) stops at the first one.
+    Return the exit code: 0 if all the lines succeeded"""
+    from src.cli import build_parser, run_command
+    if batch_size <= 0:
+        raise ValueError(f"Invalid batch size: {batch_size}")
+    output = output or sys.stdout
+    parser = build_parser()
+    interactive = bool(prompt) or (hasattr(lines, "isatty") and lines.isatty())
+    db = DB()
+    failures = 0
+    pending = 0
+    # whether the open transaction holds the write lock (it was opened by a writing line)
+    write_locked = False
+    db.BeginBatch()
+    try:
+        line_number = 0
+        if prompt:
+            print(prompt, end="", file=output, flush=True)
+        for line in lines:
+            line_number += 1
+            try:
+                words = shlex.split(line, comments=True)
+                if words and words[0] in ("exit", "quit"):
+                    break
+                if words == ["commit"]:
+                    db.EndBatch()
+                    db.BeginBatch()
+                    pending = 0
+                    write_locked = False
+                elif words:
+                    args = parse_line(parser, words)
+                    if args is not None:
+                        immediate = writes(args)
+                        if immediate and not write_locked:
+                            # a deferred transaction of the previous lines, which only read, would have to
+                            # upgrade its read lock and fail with SQLITE_BUSY on contention: end it first
+                            db.EndBatch()
+                            db.BeginBatch()
+                            pending = 0
+                        # lines that only read open a deferred transaction and never take the write lock
+                        with db.Transaction(immediate=immediate):
+                            write_locked = write_locked or immediate
+                            try:
+                                run_command(args)
+                            except SystemExit as e:
+                                # a command that failed after reporting why (e.g. rejected import lines)
+                                if e.code:
+                                    raise LineError(e.code if isinstance(e.code, str) else f"exit code {e.code}")
+                        pending += 1
+            except (LineError, ValueError, OSError, sqlite3.Error) as e:
+                failures += 1
+                print(f"line {line_number}: {e}", file=sys.stderr)
+                if strict or atomic:
+                    break
+            if not atomic and (pending >= batch_size or (interactive and pending)):
+                db.EndBatch()
+                db.BeginBatch()
+                pending = 0
+                write_locked = False
+            if prompt:
+                print(prompt, end="", file=output, flush=True)
+    except BaseException:
+        # e.g. Ctrl-C: keep the lines already reported as done, unless all or nothing was asked
+        db.EndBatch(commit=not atomic)
+        raise
+    if atomic and failures:
+        db.EndBatch(commit=False)
+        print(f"Rolled back: {failures} line(s) failed", file=sys.stderr)
+    else:
+        db.EndBatch(commit=True)
+    return 1 if failures else 0
+
+def run_shell(batch_size: int=100, atomic: bool=False, strict: bool=False) -> int:
+    """Interactive shell reading commands from stdin. The prompt is shown only on a terminal"""
+    prompt = "expman> " if sys.stdin.isatty() else None
+    return run_lines(sys.stdin, batch_size, atomic, strict, prompt)
+
+def run_batch(file_name: str, batch_size: int=100, atomic: bool=False, strict: bool=False) -> int:
+    """Run the commands of a file ('-' for stdin)"""
+    if file_name == "-":
+        return run_lines(sys.stdin, batch_size, atomic, strict)
+    with open(file_name) as file:
+        return run_lines(file, batch_size, atomic, strict)
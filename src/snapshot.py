@@ -0,0 +1,283 @@
+import json
+import mmap
+import os
+import sys
+import time
+from array import array
+from datetime import date
+from typing import Dict, List, Tuple
+
+from src.core import DB, FETCH_BATCH_SIZE, TABLE_NAME_EXPENSES, TABLE_NAME_INCOMES
+from src.core import COLUMN_NAME_ALL_ID, COLUMN_NAME_ALL_DATE, COLUMN_NAME_ALL_AMOUNT, COLUMN_NAME_ALL_CATEGORY, COLUMN_NAME_ALL_TITLE, COLUMN_NAME_ALL_NOTES
+
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_METADATA = "snapshot.json"
+SNAPSHOT_TABLES = (TABLE_NAME_EXPENSES, TABLE_NAME_INCOMES)
+
+# Fixed width columns of every table: file suffix -> array typecode. All little-endian.
+#   id: row ID, day: days since 1970-01-01, cents: amount * 100, category: category ID,
+#   title / note: index in the string pool (-1 for NULL)
+COLUMNS = {"id": "q", "day": "i", "cents": "q", "category": "i", "title": "i", "note": "i"}
+# String pool: UTF-8 strings stored once each, back to back in .pool, with their
+# start offsets in .offsets (one more entry than strings: the end of the last one)
+POOL = "pool"
+POOL_OFFSETS = "offsets"
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+def day_number(day) -> int:
+    """Day number of a date (or yyyy-mm-dd string) as stored in the day column"""
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    return day.toordinal() - EPOCH_ORDINAL
+
+def day_from_number(number: int) -> date:
+    return date.fromordinal(number + EPOCH_ORDINAL)
+
+def default_folder() -> str:
+    from src import core
+    return os.path.join(core.DB_FOLDER, core.DB_NAME + ".snapshot")
+
+def _file(folder: str, table_name: str, suffix: str) -> str:
+    return os.path.join(folder, f"{table_name}.{suffix}")
+
+def _read_metadata(folder: str) -> dict:
+    path = os.path.join(folder, SNAPSHOT_METADATA)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as file:
+        metadata = json.load(file)
+    if metadata.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported snapshot format in {folder}: {metadata.get('format')}")
+    return metadata
+
+def _write_metadata(folder: str, metadata: dict):
+    # written last and renamed in place: a snapshot interrupted while appending keeps its previous state
+    path = os.path.join(folder, SNAPSHOT_METADATA)
+    with open(path + ".tmp", "w") as file:
+        json.dump(metadata, file, indent=2)
+    os.replace(path + ".tmp", path)
+
+def _little_endian(values: array) -> array:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+class _PoolWriter:
+    """Appends strings to the pool of a table, reusing the index of strings already stored"""
+    def __init__(self, folder: str, table_name: str, strings: int, size: int):
+        self._indexes = {}
+        if strings:
+            pool = _read_pool(folder, table_name, strings, size)
+            for index in range(strings):
+                self._indexes[pool.get(index)] = index
+        self.strings = strings
+        self.size = size
+        self._data = bytearray()
+        self._offsets = array("q")
+
+    def index(self, text: str) -> int:
+        if text is None:
+            return -1
+        index = self._indexes.get(text)
+        if index is None:
+            index = self._indexes[text] = self.strings
+            encoded = text.encode("utf-8")
+            self._data += encoded
+            self.size += len(encoded)
+            self.strings += 1
+            self._offsets.append(self.size)
+        return index
+
+    def flush(self, pool_file, offsets_file):
+        pool_file.write(self._data)
+        offsets_file.write(_little_endian(self._offsets).tobytes())
+        self._data = bytearray()
+        self._offsets = array("q")
+
+def _truncate(path: str, size: int):
+    with open(path, "ab") as file:
+        file.truncate(size)
+
+def update_snapshot(folder: str=None, full: bool=False) -> Dict[str, Tuple[int, int]]:
+    """Create or refresh a columnar snapshot of the transaction tables. Only rows with an ID above
+    the last exported one are appended; if rows below it were deleted the table is exported again
+    (changes to already exported rows need full=True). Return {table: (appended rows, total rows)}"""
+    folder = folder or default_folder()
+    os.makedirs(folder, exist_ok=True)
+    metadata = None if full else _read_metadata(folder)
+    if metadata is None:
+        metadata = {"format": SNAPSHOT_FORMAT, "tables": {}}
+    db = DB()
+    result = {}
+    for table_name in SNAPSHOT_TABLES:
+        state = metadata["tables"].get(table_name)
+        if state is not None:
+            stored = db._execute(f"SELECT COUNT(*) FROM {table_name} WHERE {COLUMN_NAME_ALL_ID} <= ?", (state["last_id"],)).fetchone()[0]
+            if stored != state["rows"]:
+                state = None
+        if state is None:
+            state = {"rows": 0, "last_id": 0, "strings": 0, "pool_size": 0}
+        # drop anything appended after the last complete update
+        sizes = {suffix: state["rows"] * array(typecode).itemsize for suffix, typecode in COLUMNS.items()}
+        sizes[POOL] = state["pool_size"]
+        sizes[POOL_OFFSETS] = (state["strings"] + 1) * array("q").itemsize
+        for suffix, size in sizes.items():
+            _truncate(_file(folder, table_name, suffix), size)
+        if state["strings"] == 0:
+            with open(_file(folder, table_name, POOL_OFFSETS), "wb") as file:
+                file.write(_little_endian(array("q", [0])).tobytes())
+
+        pool = _PoolWriter(folder, table_name, state["strings"], state["pool_size"])
+        files = {suffix: open(_file(folder, table_name, suffix), "ab") for suffix in sizes}
+        appended = 0
+        try:
+            cursor = db._execute(f"SELECT {COLUMN_NAME_ALL_ID}, {COLUMN_NAME_ALL_DATE}, {COLUMN_NAME_ALL_AMOUNT}, {COLUMN_NAME_ALL_CATEGORY}, "
+                                 f"{COLUMN_NAME_ALL_TITLE}, {COLUMN_NAME_ALL_NOTES} FROM {table_name} WHERE {COLUMN_NAME_ALL_ID} > ? "
+                                 f"ORDER BY {COLUMN_NAME_ALL_ID}", (state["last_id"],))
+            while True:
+                rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+                if not rows:
+                    break
+                columns = {suffix: array(typecode) for suffix, typecode in COLUMNS.items()}
+                for row_id, day, amount, category, title, notes in rows:
+                    columns["id"].append(row_id)
+                    columns["day"].append(day_number(day))
+                    columns["cents"].append(round(amount * 100))
+                    columns["category"].append(category)
+                    columns["title"].append(pool.index(title))
+                    columns["note"].append(pool.index(notes))
+                for suffix, values in columns.items():
+                    files[suffix].write(_little_endian(values).tobytes())
+                pool.flush(files[POOL], files[POOL_OFFSETS])
+                appended += len(rows)
+                state["last_id"] = rows[-1][0]
+        finally:
+            for file in files.values():
+                file.close()
+        state["rows"] += appended
+        state["strings"] = pool.strings
+        state["pool_size"] = pool.size
+        metadata["tables"][table_name] = state
+        result[table_name] = (appended, state["rows"])
+    metadata["updated"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    _write_metadata(folder, metadata)
+    return result
+
+def _map(path: str, typecode: str, count: int) -> memoryview:
+    """Memory-map count values of a column file (zero-copy)"""
+    itemsize = array(typecode).itemsize
+    if count == 0:
+        return memoryview(array(typecode))
+    with open(path, "rb") as file:
+        mapped = mmap.mmap(file.fileno(), count * itemsize, access=mmap.ACCESS_READ)
+    view = memoryview(mapped).cast(typecode)
+    if sys.byteorder != "little":
+        # the files are little-endian: copy and swap once
+        values = array(typecode, view)
+        values.byteswap()
+        return memoryview(values)
+    return view
+
+class StringPool:
+    def __init__(self, data: memoryview, offsets: memoryview):
+        self._data = data
+        self._offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def get(self, index: int) -> str:
+        if index < 0:
+            return None
+        return bytes(self._data[self._offsets[index]:self._offsets[index + 1]]).decode("utf-8")
+
+def _read_pool(folder: str, table_name: str, strings: int, size: int) -> StringPool:
+    return StringPool(_map(_file(folder, table_name, POOL), "B", size), _map(_file(folder, table_name, POOL_OFFSETS), "q", strings + 1))
+
+class SnapshotTable:
+    """Columns of one table, memory-mapped as memoryviews: id, day, cents, category, title, note
+    (the last two index the string pool, see text())"""
+    def __init__(self, folder: str, table_name: str, state: dict):
+        self.name = table_name
+        self.rows = state["rows"]
+        for suffix, typecode in COLUMNS.items():
+            setattr(self, suffix, _map(_file(folder, table_name, suffix), typecode, self.rows))
+        self.strings = _read_pool(folder, table_name, state["strings"], state["pool_size"])
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def text(self, column: str, row: int) -> str:
+        """Title or note of a row"""
+        return self.strings.get(getattr(self, column)[row])
+
+    def numpy(self, column: str):
+        """A column as a NumPy array sharing the mapped memory (requires NumPy)"""
+        import numpy
+        dtypes = {"q": "<i8", "i": "<i4"}
+        return numpy.frombuffer(getattr(self, column), dtype=dtypes[COLUMNS[column]])
+
+class Snapshot:
+    """Read-only view of a snapshot folder"""
+    def __init__(self, folder: str=None):
+        folder = folder or default_folder()
+        metadata = _read_metadata(folder)
+        if metadata is None:
+            raise ValueError(f"No snapshot in {folder}. Create it with: expman snapshot")
+        self.folder = folder
+        self.updated = metadata.get("updated")
+        self.tables = {table_name: SnapshotTable(folder, table_name, state) for table_name, state in metadata["tables"].items()}
+
+    def __getitem__(self, table_name: str) -> SnapshotTable:
+        return self.tables[table_name]
+
+def _numpy():
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+def range_sum(table: SnapshotTable, date_from=None, date_to=None) -> Tuple[int, int]:
+    """Return (cents, count) of the rows dated within date_from and date_to (both optional).
+    Vectorized with NumPy when it is installed"""
+    low = -2**31 if date_from is None else day_number(date_from)
+    high = 2**31 - 1 if date_to is None else day_number(date_to)
+    numpy = _numpy()
+    if numpy is not None and len(table):
+        days = table.numpy("day")
+        mask = (days >= low) & (days <= high)
+        return int(table.numpy("cents")[mask].sum()), int(numpy.count_nonzero(mask))
+    cents = 0
+    count = 0
+    for day, amount in zip(table.day, table.cents):
+        if low <= day <= high:
+            cents += amount
+            count += 1
+    return cents, count
+
+def sum_by_category(table: SnapshotTable, date_from=None, date_to=None) -> Dict[int, Tuple[int, int]]:
+    """Return {category: (cents, count)} of the rows dated within date_from and date_to (both optional)"""
+    low = -2**31 if date_from is None else day_number(date_from)
+    high = 2**31 - 1 if date_to is None else day_number(date_to)
+    numpy = _numpy()
+    if numpy is not None and len(table):
+        days = table.numpy("day")
+        mask = (days >= low) & (days <= high)
+        categories = table.numpy("category")[mask]
+        if len(categories) == 0:
+            return {}
+        order = numpy.argsort(categories, kind="stable")
+        sorted_categories = categories[order]
+        starts = numpy.concatenate(([0], numpy.flatnonzero(numpy.diff(sorted_categories)) + 1))
+        sums = numpy.add.reduceat(table.numpy("cents")[mask][order], starts)
+        counts = numpy.diff(numpy.append(starts, len(sorted_categories)))
+        return {int(category): (int(total), int(count)) for category, total, count in zip(sorted_categories[starts], sums, counts)}
+    totals = {}
+    for day, amount, category in zip(table.day, table.cents, table.category):
+        if low <= day <= high:
+            total, count = totals.get(category, (0, 0))
+            totals[category] = (total + amount, count + 1)
+    return totals
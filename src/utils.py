@@ -1,39 +1,82 @@
 from datetime import date
 from dateutil.relativedelta import relativedelta
 import calendar
-from typing import Tuple
-from src.core import Expense, Income, Category, FormatType
-
-def print_categories_tree(lCat:Tuple[Category], parentId:int, depth:int, maxDepth:int):
-    if maxDepth > depth:
-        lCat_parent = [cat for cat in lCat if (cat.parent == parentId)]
-        for cat in lCat_parent:
-            tab_char = '\t'
-            print(f"{tab_char*depth}" + cat.to_string(FormatType.TREE))
-            print_categories_tree(lCat, cat.id, depth+1, maxDepth)
-    else:
-        pass
-
-def balance(date_from:date, date_to:date):
-    """Print balance for the indicated time interval"""
-    # 1. extract all expenses for the date interval
-    tExp = Expense.FetchDateInterval(date_from, date_to)
-    # 2. extract all incomes for the date interval
-    tInc = Income.FetchDateInterval(date_from, date_to)
-    # 3. sum all the expenses
-    exp_sum = 0
-    for exp in tExp:
-        exp_sum += float(exp.amount)
-    # 4. sum all the incomes
-    inc_sum = 0
-    for inc in tInc:
-        inc_sum += float(inc.amount)
+import os
+import sys
+from src import core
+from src.core import DB, CategoryTree, FormatType, GroupBy, Granularity, TABLE_NAME_EXPENSES, TABLE_NAME_INCOMES, AGGREGATE_COLUMN_TABLE, AGGREGATE_COLUMN_TOTAL
+from src.core import SERIES_COLUMN_PERIOD, SERIES_COLUMN_CATEGORY, SERIES_COLUMN_INCOMES, SERIES_COLUMN_EXPENSES, SERIES_COLUMN_BALANCE, SERIES_COLUMN_RUNNING_BALANCE
+
+def print_categories_tree(tree:CategoryTree, parentId:int=0):
+    """Print the categories below parentId, indented by depth"""
+    tab_char = '\t'
+    for depth, cat in tree.walk(parentId):
+        print(f"{tab_char*depth}" + cat.to_string(FormatType.TREE))
+
+BALANCE_COLUMNS = ("date_from", "date_to", "incomes", "expenses", "balance")
+BALANCE_CATEGORY_COLUMNS = ("category", "incomes", "expenses", "balance")
+
+def write_rows(columns:tuple, rows:list, output:str):
+    """Print rows in a machine-readable format (csv, json, jsonl or tsv), amounts rounded to cents
+    to hide floating point noise of the sums"""
+    from src.output import RowWriter
+    writer = RowWriter(columns, output)
+    writer.write_batch([tuple(round(value, 2) if isinstance(value, float) else value for value in row) for row in rows])
+    writer.close()
+
+def balance(date_from:date, date_to:date, ledgers:list=None, by_category:bool=False, output:str="table"):
+    """Print balance for the indicated time interval.
+    With ledgers (database files) the balance is consolidated over all of them;
+    with by_category the totals per category are printed too (only them in the machine-readable formats)"""
+    if ledgers is not None or by_category:
+        consolidated_balance(date_from, date_to, ledgers or [os.path.join(core.DB_FOLDER, core.DB_NAME)], by_category, output)
+        return
+    # 1. sum expenses and incomes of the date interval from the monthly totals
+    totals = {TABLE_NAME_EXPENSES: 0.0, TABLE_NAME_INCOMES: 0.0}
+    for row in DB().FetchMonthlyTotals(date_from, date_to, GroupBy.NONE):
+        totals[row[AGGREGATE_COLUMN_TABLE]] += row[AGGREGATE_COLUMN_TOTAL]
+    exp_sum = totals[TABLE_NAME_EXPENSES]
+    inc_sum = totals[TABLE_NAME_INCOMES]
+    if output != "table":
+        write_rows(BALANCE_COLUMNS, [(str(date_from), str(date_to), inc_sum, exp_sum, inc_sum - exp_sum)], output)
+        return
     print(f"From {date_from} to {date_to}")
     print(f"Incomes: {inc_sum:.2f}")
     print(f"Expenses: {exp_sum:.2f}")
     print(f"Balance: {(inc_sum - exp_sum):.2f}")
 
-def balance_month(relative_month:int):
+def consolidated_balance(date_from:date, date_to:date, ledgers:list, by_category:bool=False, output:str="table"):
+    """Print balance (and optionally totals per category path) summed over several ledger files"""
+    from src.ledgers import consolidate
+    totals, errors = consolidate(ledgers, date_from, date_to, by_category)
+    for error in errors:
+        print(f"Error: {error}", file=sys.stderr)
+    inc_sum = sum(total for (table_name, _), (total, _) in totals.items() if table_name == TABLE_NAME_INCOMES)
+    exp_sum = sum(total for (table_name, _), (total, _) in totals.items() if table_name == TABLE_NAME_EXPENSES)
+    if output != "table":
+        if by_category:
+            rows = []
+            for category in sorted(set(category for _, category in totals)):
+                incomes = totals.get((TABLE_NAME_INCOMES, category), [0.0, 0])[0]
+                expenses = totals.get((TABLE_NAME_EXPENSES, category), [0.0, 0])[0]
+                rows.append((category, incomes, expenses, incomes - expenses))
+            write_rows(BALANCE_CATEGORY_COLUMNS, rows, output)
+        else:
+            write_rows(BALANCE_COLUMNS, [(str(date_from), str(date_to), inc_sum, exp_sum, inc_sum - exp_sum)], output)
+        return
+    print(f"From {date_from} to {date_to} ({len(ledgers) - len(errors)} of {len(ledgers)} ledgers)")
+    print(f"Incomes: {inc_sum:.2f}")
+    print(f"Expenses: {exp_sum:.2f}")
+    print(f"Balance: {(inc_sum - exp_sum):.2f}")
+    if by_category:
+        categories = sorted(set(category for _, category in totals))
+        print(f"{'CATEGORY':<40} | {'INCOMES':>12} | {'EXPENSES':>12}")
+        for category in categories:
+            incomes = totals.get((TABLE_NAME_INCOMES, category), [0.0, 0])[0]
+            expenses = totals.get((TABLE_NAME_EXPENSES, category), [0.0, 0])[0]
+            print(f"{category:<40} | {incomes:12.2f} | {expenses:12.2f}")
+
+def balance_month(relative_month:int, ledgers:list=None, by_category:bool=False, output:str="table"):
     """Print balance for the requested relative month"""
     # 1. calculate date_from and date_to
     today = date.today()
@@ -43,9 +86,9 @@ def balance_month(relative_month:int):
     last_day_of_month = calendar.monthrange(shifted_date.year, shifted_date.month)[1]
     date_to = shifted_date.replace(day=last_day_of_month)
     # 2. extract and print balance
-    balance(date_from, date_to)
+    balance(date_from, date_to, ledgers, by_category, output)
 
-def balance_year(relative_year:int):
+def balance_year(relative_year:int, ledgers:list=None, by_category:bool=False, output:str="table"):
     """Print balance for the requested relative year"""
     # 1. Date from is January 1st of requested year. Date to is today
     date_today = date.today()
@@ -60,4 +103,75 @@ def balance_year(relative_year:int):
         date_from = date(year=year, month=1, day=1)
         date_to = date(year=year, month=12, day=31)
     # 2. extract balance
-    balance(date_from, date_to)
\ No newline at end of file
+    balance(date_from, date_to, ledgers, by_category, output)
+
+PERIOD_STEP = {
+    Granularity.DAY: relativedelta(days=1),
+    Granularity.WEEK: relativedelta(weeks=1),
+    Granularity.MONTH: relativedelta(months=1),
+    Granularity.YEAR: relativedelta(years=1),
+}
+
+def period_start(day:date, granularity:Granularity) -> date:
+    """Return the first day of the period containing day (weeks start on Monday)"""
+    if granularity == Granularity.DAY:
+        return day
+    elif granularity == Granularity.WEEK:
+        return day - relativedelta(days=day.weekday())
+    elif granularity == Granularity.MONTH:
+        return day.replace(day=1)
+    else:
+        return day.replace(day=1, month=1)
+
+def period_key(day:date, granularity:Granularity) -> str:
+    """Return the period label used by DB.FetchSeries for the period containing day"""
+    start = period_start(day, granularity)
+    if granularity == Granularity.MONTH:
+        return start.strftime("%Y-%m")
+    elif granularity == Granularity.YEAR:
+        return start.strftime("%Y")
+    return start.isoformat()
+
+def series_interval(granularity:Granularity, periods:int) -> tuple:
+    """Return (date_from, date_to) covering the last "periods" periods up to today"""
+    today = date.today()
+    date_from = period_start(today, granularity) - PERIOD_STEP[granularity] * (abs(periods) - 1)
+    return date_from, today
+
+def fill_series_gaps(rows:list, date_from:date, date_to:date, granularity:Granularity) -> list:
+    """Insert zero rows for periods without transactions, carrying the running balance"""
+    rows_by_period = {row[SERIES_COLUMN_PERIOD]: row for row in rows}
+    filled = []
+    running_balance = 0.0
+    day = period_start(date_from, granularity)
+    while day <= date_to:
+        key = period_key(day, granularity)
+        row = rows_by_period.get(key)
+        if row is None:
+            row = {SERIES_COLUMN_PERIOD: key, SERIES_COLUMN_INCOMES: 0.0, SERIES_COLUMN_EXPENSES: 0.0,
+                   SERIES_COLUMN_BALANCE: 0.0, SERIES_COLUMN_RUNNING_BALANCE: running_balance}
+        running_balance = row[SERIES_COLUMN_RUNNING_BALANCE]
+        filled.append(row)
+        day += PERIOD_STEP[granularity]
+    return filled
+
+def balance_series(granularity:Granularity, date_from:date, date_to:date, by_category:bool=False, output:str="table"):
+    """Print incomes, expenses, balance and running balance for every period of the interval"""
+    rows = DB().FetchSeries(date_from, date_to, granularity, by_category)
+    if not by_category:
+        rows = fill_series_gaps(rows, date_from, date_to, granularity)
+    columns = [SERIES_COLUMN_PERIOD]
+    if by_category:
+        columns.append(SERIES_COLUMN_CATEGORY)
+    amount_columns = [SERIES_COLUMN_INCOMES, SERIES_COLUMN_EXPENSES, SERIES_COLUMN_BALANCE, SERIES_COLUMN_RUNNING_BALANCE]
+    columns += amount_columns
+    if output != "table":
+        write_rows(columns, [tuple(row[column] for column in columns) for row in rows], output)
+    else:
+        print(f"From {date_from} to {date_to}")
+        category_header = f" | {'CATEGORY':>8}" if by_category else ""
+        print(f"{'PERIOD':<10}{category_header} | {'INCOMES':>12} | {'EXPENSES':>12} | {'BALANCE':>12} | {'RUNNING':>12}")
+        for row in rows:
+            category_cell = f" | {row[SERIES_COLUMN_CATEGORY]:8}" if by_category else ""
+            print(f"{row[SERIES_COLUMN_PERIOD]:<10}{category_cell} | {row[SERIES_COLUMN_INCOMES]:12.2f} | {row[SERIES_COLUMN_EXPENSES]:12.2f} | "
+                  f"{row[SERIES_COLUMN_BALANCE]:12.2f} | {row[SERIES_COLUMN_RUNNING_BALANCE]:12.2f}")
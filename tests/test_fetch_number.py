@@ -0,0 +1,47 @@
+import io
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+from src import core
+from src.core import DB, Category, Expense, init_core_module
+
+class FetchNumberTest(unittest.TestCase):
+    """Latest expenses of a category subtree: food (1) > groceries (2) > bakery (3), and travel (4)"""
+
+    def setUp(self):
+        self._merged_category_scans = core.MERGED_CATEGORY_SCANS
+        self._folder = tempfile.TemporaryDirectory()
+        with redirect_stdout(io.StringIO()):
+            init_core_module(self._folder.name, "ledger.db", {"read_cache_size": 0})
+            for parent, title in ((0, "food"), (1, "groceries"), (2, "bakery"), (0, "travel")):
+                Category(parent, title, "").Add()
+            for day, category in enumerate((3, 4, 1, 4, 2, 3, 4, 4), start=1):
+                Expense(category, f"2025-01-0{day}", 1.0, f"expense {day}", "").Add()
+
+    def tearDown(self):
+        DB()._close()
+        core.MERGED_CATEGORY_SCANS = self._merged_category_scans
+        self._folder.cleanup()
+
+    def latest_ids(self, number: int, category_id: int) -> list:
+        ids = [record.id for record in Expense.FetchNumber(number, category_id)]
+        streamed = [row[0] for rows in DB().IterNumberBatches(Expense.table_name, number, 2, category_id) for row in rows]
+        self.assertEqual(ids, streamed)
+        return ids
+
+    def test_subtree(self):
+        self.assertEqual(self.latest_ids(3, 1), [6, 5, 3])
+        self.assertEqual(self.latest_ids(10, 2), [6, 5, 1])
+        self.assertEqual(self.latest_ids(10, 3), [6, 1])
+        self.assertEqual(self.latest_ids(2, 4), [8, 7])
+        self.assertEqual(self.latest_ids(10, 99), [])
+
+    def test_large_subtree(self):
+        # filtered with IN (subtree) and sorted instead of merging one scan per category
+        core.MERGED_CATEGORY_SCANS = 1
+        self.assertEqual(self.latest_ids(3, 1), [6, 5, 3])
+        self.assertEqual(self.latest_ids(10, 3), [6, 1])
+
+if __name__ == "__main__":
+    unittest.main()
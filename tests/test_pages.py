@@ -0,0 +1,48 @@
+import io
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+from src.core import DB, Expense, PageCursor, init_core_module
+
+class FetchPageTest(unittest.TestCase):
+    """Pages of 2 expenses over a ledger of 4 (IDs 1 to 4)"""
+
+    def setUp(self):
+        self._folder = tempfile.TemporaryDirectory()
+        with redirect_stdout(io.StringIO()):
+            init_core_module(self._folder.name, "ledger.db")
+            for day in range(1, 5):
+                Expense(1, f"2025-01-0{day}", float(day), f"expense {day}", "").Add()
+
+    def tearDown(self):
+        DB()._close()
+        self._folder.cleanup()
+
+    def assertPage(self, page, ids: list, next_id, previous_id):
+        self.assertEqual([record.id for record in page.records], ids)
+        self.assertEqual(None if page.next_cursor is None else page.next_cursor.before_id, next_id)
+        self.assertEqual(None if page.previous_cursor is None else page.previous_cursor.after_id, previous_id)
+
+    def test_first_page(self):
+        self.assertPage(Expense.FetchPage(2), [4, 3], 3, None)
+
+    def test_last_page(self):
+        self.assertPage(Expense.FetchPage(2, PageCursor(before_id=3)), [2, 1], None, 2)
+
+    def test_back_to_the_newest_page(self):
+        self.assertPage(Expense.FetchPage(2, PageCursor(after_id=2)), [4, 3], 3, None)
+
+    def test_back_to_the_oldest_page(self):
+        self.assertPage(Expense.FetchPage(2, PageCursor(after_id=0)), [2, 1], None, 2)
+
+    def test_whole_ledger_in_one_page(self):
+        self.assertPage(Expense.FetchPage(4, PageCursor(before_id=5)), [4, 3, 2, 1], None, None)
+
+    def test_last_page_by_date(self):
+        page = Expense.FetchPage(2, PageCursor(before_date="2025-01-03"))
+        self.assertEqual([record.id for record in page.records], [2, 1])
+        self.assertIsNone(page.next_cursor)
+
+if __name__ == "__main__":
+    unittest.main()
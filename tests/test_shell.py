@@ -0,0 +1,59 @@
+import io
+import tempfile
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+
+from src.core import DB, init_core_module
+from src.shell import run_lines
+
+class RunLinesTest(unittest.TestCase):
+
+    def setUp(self):
+        self._folder = tempfile.TemporaryDirectory()
+        with redirect_stdout(io.StringIO()):
+            init_core_module(self._folder.name, "ledger.db")
+            DB().SchemaVersion()
+
+    def tearDown(self):
+        DB()._close()
+        self._folder.cleanup()
+
+    def run_lines(self, *lines: str) -> tuple:
+        """Run lines in a shell, return (exit code, stdout, stderr)"""
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            exit_code = run_lines([line + "\n" for line in lines])
+        return exit_code, stdout.getvalue(), stderr.getvalue()
+
+    def test_nested_command_after_global_options(self):
+        exit_code, stdout, stderr = self.run_lines("--format csv shell", "version")
+        self.assertEqual(exit_code, 1)
+        self.assertIn("line 1: 'shell' cannot be used here", stderr)
+        self.assertIn("EXPMAN version", stdout)
+
+    def test_writing_line_takes_the_write_lock_up_front(self):
+        statements = []
+        callback = lambda event: statements.append(event.sql)
+        DB().add_query_callback(callback)
+        try:
+            exit_code, _, stderr = self.run_lines("exp list", "exp add -a 10 -c 1 -d 2025-01-01", "exp list")
+        finally:
+            DB().remove_query_callback(callback)
+        self.assertEqual(exit_code, 0, stderr)
+        transaction_control = [sql for sql in statements if sql.split()[0] in ("BEGIN", "COMMIT")]
+        # the read transaction of the first line ends before the write starts
+        self.assertEqual(transaction_control, ["BEGIN", "COMMIT", "BEGIN IMMEDIATE", "COMMIT"])
+
+    def test_import_with_rejected_lines_fails(self):
+        csv_path = f"{self._folder.name}/expenses.csv"
+        with open(csv_path, "w") as file:
+            file.write("category,amount,date,title,notes\n1,10.0,2025-01-01,ok,\n1,not a number,2025-01-02,bad,\n")
+        exit_code, stdout, stderr = self.run_lines(f"exp import {csv_path}", "version")
+        self.assertEqual(exit_code, 1)
+        self.assertIn("Rejected 1 lines", stderr)
+        self.assertIn("line 1: exit code 1", stderr)
+        self.assertIn("EXPMAN version", stdout)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from datetime import date
+from io import StringIO
+
+from src import core
+from src.core import DB, Expense, Income, init_core_module, GroupBy, SCHEMA_VERSION_MONTHLY_TOTALS
+from src.utils import balance
+
+class UnmigratedLedgerTest(unittest.TestCase):
+    """Ledger left below the latest schema version (auto_migrate = no)"""
+
+    def setUp(self):
+        self._auto_migrate = core.DB_AUTO_MIGRATE
+        self._folder = tempfile.TemporaryDirectory()
+        with redirect_stdout(StringIO()):
+            init_core_module(self._folder.name, "ledger.db", {"auto_migrate": "no"})
+            Expense(1, "2025-01-10", 12.5, "groceries", "").Add()
+            Expense(1, "2025-02-15", 7.5, "bus", "").Add()
+            Expense(1, "2025-04-02", 100.0, "outside the interval", "").Add()
+            Income(1, "2025-02-01", 1000.0, "salary", "").Add()
+
+    def tearDown(self):
+        DB()._close()
+        core.DB_AUTO_MIGRATE = self._auto_migrate
+        self._folder.cleanup()
+
+    def test_schema_is_not_migrated(self):
+        self.assertLess(DB().SchemaVersion(), SCHEMA_VERSION_MONTHLY_TOTALS)
+
+    def test_monthly_totals_match_aggregate(self):
+        output = StringIO()
+        with redirect_stdout(output):
+            totals = DB().FetchMonthlyTotals("2025-01-01", "2025-03-31", GroupBy.NONE)
+            expected = DB().FetchAggregate("2025-01-01", "2025-03-31", GroupBy.NONE)
+        self.assertEqual(output.getvalue(), "")
+        self.assertEqual(totals, expected)
+
+    def test_balance(self):
+        output = StringIO()
+        with redirect_stdout(output):
+            balance(date(2025, 1, 1), date(2025, 3, 31), output="csv")
+        self.assertEqual(output.getvalue().splitlines(), [
+            "date_from,date_to,incomes,expenses,balance",
+            "2025-01-01,2025-03-31,1000.0,20.0,980.0",
+        ])
+
+    def test_search_needs_migration(self):
+        with self.assertRaisesRegex(ValueError, "db migrate"):
+            Expense.Search("groceries")
+
+if __name__ == "__main__":
+    unittest.main()